@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+from typing import Iterable
+
+import httpx
+
+import storage
+import migrate_settings
+import sessions
+import hh_api
+from hh_api import HHApiClient
+from hh_tokens import get_user_token
+import cover_letters
+from settings_utils import get_user_setting
+
+# Параметры воркера автооткликов (таблица queues)
+APPLY_BATCH = int(os.getenv("APPLY_BATCH", "20"))
+APPLY_CONCURRENCY = int(os.getenv("APPLY_CONCURRENCY", "4"))
+APPLY_LEASE = int(os.getenv("APPLY_LEASE", "300"))
+APPLY_MAX_ATTEMPTS = int(os.getenv("APPLY_MAX_ATTEMPTS", "5"))
+APPLY_POLL_INTERVAL = float(os.getenv("APPLY_POLL_INTERVAL", "5"))
+
+# идентификатор владельца аренды: разные uvicorn-воркеры не берут чужие строки
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+hh_client = HHApiClient()
+
+_worker_task: asyncio.Task | None = None
+
+
+class PermanentError(Exception):
+    """Ошибка, после которой повторять отклик бессмысленно."""
+
+
+class LeaseLost(Exception):
+    """Аренду строки забрал другой воркер — отклик отправит он."""
+
+
+async def enqueue(tg_user: int, vacancy_ids: Iterable[str], resume_id: str | None = None) -> int:
+    """Ставит вакансии в очередь на отклик; возвращает число добавленных строк."""
+    rows = [(tg_user, str(vid), resume_id) for vid in vacancy_ids]
+    await storage.executemany(
+        "INSERT INTO queues (tg_user, vacancy_id, resume_id) VALUES (?, ?, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+async def claim(batch: int = APPLY_BATCH) -> list[tuple]:
+    """
+    Атомарно арендует до batch строк: ожидающие и с истёкшей арендой.
+    Одна UPDATE ... RETURNING в транзакции писателя, поэтому два процесса
+    не получат одну и ту же строку. Истёкшая аренда значит, что прошлая
+    попытка упала вместе с воркером или зависла, — она засчитывается в
+    attempts, и после APPLY_MAX_ATTEMPTS строка закрывается.
+    """
+    now = int(time.time())
+
+    async def _claim(db) -> list[tuple]:
+        await db.execute(
+            """
+            UPDATE queues
+               SET status = 'failed', attempts = attempts + 1, last_error = 'lease expired',
+                   lease_owner = NULL, lease_until = NULL, updated_at = ?
+             WHERE status = 'leased' AND lease_until < ? AND attempts + 1 >= ?
+            """,
+            (now, now, APPLY_MAX_ATTEMPTS),
+        )
+        async with db.execute(
+            """
+            UPDATE queues
+               SET attempts = attempts + (status = 'leased'),
+                   status = 'leased', lease_owner = ?, lease_until = ?, updated_at = ?
+             WHERE id IN (
+                   SELECT id FROM queues
+                    WHERE (status = 'pending' AND available_at <= ?)
+                       OR (status = 'leased' AND lease_until < ?)
+                    ORDER BY available_at, id
+                    LIMIT ?)
+            RETURNING id, tg_user, vacancy_id, resume_id, attempts
+            """,
+            (WORKER_ID, now + APPLY_LEASE, now, now, now, batch),
+        ) as cur:
+            return list(await cur.fetchall())
+
+    return await storage.write(_claim)
+
+
+async def renew(job_ids: Iterable[int]) -> None:
+    """Продлевает аренду строк, которые этот воркер ещё обрабатывает."""
+    ids = list(job_ids)
+    if not ids:
+        return
+    marks = ",".join("?" * len(ids))
+    await storage.execute(
+        f"""
+        UPDATE queues SET lease_until = ?
+         WHERE lease_owner = ? AND status = 'leased' AND id IN ({marks})
+        """,
+        [int(time.time()) + APPLY_LEASE, WORKER_ID, *ids],
+    )
+
+
+async def owns(job_id: int) -> bool:
+    """Аренда строки всё ещё у этого воркера и не истекла."""
+    row = await storage.fetchone(
+        "SELECT 1 FROM queues WHERE id = ? AND status = 'leased' AND lease_owner = ? AND lease_until >= ?",
+        (job_id, WORKER_ID, int(time.time())),
+    )
+    return row is not None
+
+
+async def ack(job_id: int) -> None:
+    await storage.execute(
+        """
+        UPDATE queues SET status = 'done', lease_owner = NULL, lease_until = NULL,
+               last_error = NULL, updated_at = ?
+         WHERE id = ? AND lease_owner = ?
+        """,
+        (int(time.time()), job_id, WORKER_ID),
+    )
+
+
+async def fail(job_id: int, attempts: int, error: str, retry: bool) -> None:
+    """Возвращает строку в очередь с экспоненциальной паузой или закрывает её."""
+    attempts += 1
+    now = int(time.time())
+    if retry and attempts < APPLY_MAX_ATTEMPTS:
+        status, available_at = "pending", now + min(3600, 30 * 2 ** attempts)
+    else:
+        status, available_at = "failed", now
+    await storage.execute(
+        """
+        UPDATE queues SET status = ?, attempts = ?, available_at = ?, last_error = ?,
+               lease_owner = NULL, lease_until = NULL, updated_at = ?
+         WHERE id = ? AND lease_owner = ?
+        """,
+        (status, attempts, available_at, error[:500], now, job_id, WORKER_ID),
+    )
+
+
+async def apply_one(
+    tg_user: int, vacancy_id: str, resume_id: str | None, job_id: int | None = None
+) -> None:
+    """
+    Генерирует письмо и откликается на одну вакансию. С job_id перед
+    отправкой проверяется, что аренда строки всё ещё у этого воркера.
+    """
+    token = await get_user_token(tg_user)
+    if not token:
+        raise PermanentError("no token")
+    resume_id = resume_id or await get_user_setting(tg_user, "resume")
+    if not resume_id:
+        raise PermanentError("no resume selected")
+    # письмо могло быть сгенерировано заранее (POST /queue) — тогда
+    # вакансию из HH даже не загружаем
+    prompt = await get_user_setting(tg_user, "prompt")
+    cover_letter = await cover_letters.get_cover_letter(
+        vacancy_id, resume_id, prompt, token=token
+    )
+    if job_id is not None and not await owns(job_id):
+        raise LeaseLost(job_id)
+    await hh_client.respond_to_vacancy(vacancy_id, resume_id, cover_letter, token=token)
+
+
+async def _process(job: tuple) -> None:
+    job_id, tg_user, vacancy_id, resume_id, attempts = job
+    try:
+        await apply_one(tg_user, vacancy_id, resume_id, job_id)
+    except LeaseLost:
+        # строку уже обрабатывает другой воркер: ни ack, ни fail — они не наши
+        logger.warning("Аренда отклика %s истекла до отправки", job_id)
+    except PermanentError as e:
+        await fail(job_id, attempts, str(e), retry=False)
+    except httpx.HTTPStatusError as e:
+        code = e.response.status_code
+        # 4xx (кроме 429) — отказ HH по существу: уже откликались, вакансия закрыта и т.п.
+        retry = code == 429 or code >= 500
+        await fail(job_id, attempts, f"HH {code}: {e.response.text}", retry=retry)
+    except Exception as e:
+        logger.warning("Отклик %s на %s не удался: %s", tg_user, vacancy_id, e)
+        await fail(job_id, attempts, repr(e), retry=True)
+    else:
+        await ack(job_id)
+
+
+async def run_once(batch: int = APPLY_BATCH, concurrency: int = APPLY_CONCURRENCY) -> int:
+    """
+    Берёт одну пачку и обрабатывает её; возвращает размер пачки.
+    Пока пачка в работе, аренда незавершённых строк продлевается каждые
+    APPLY_LEASE / 3 секунд — хвост большой пачки не достанется другому воркеру.
+    """
+    jobs = await claim(batch)
+    if not jobs:
+        return 0
+    sem = asyncio.Semaphore(concurrency)
+    held = {job[0] for job in jobs}
+
+    async def _bounded(job: tuple) -> None:
+        try:
+            async with sem:
+                await _process(job)
+        finally:
+            held.discard(job[0])
+
+    async def _heartbeat() -> None:
+        while True:
+            await asyncio.sleep(APPLY_LEASE / 3)
+            try:
+                await renew(held)
+            except Exception:
+                logger.exception("Не удалось продлить аренду откликов")
+
+    heartbeat = asyncio.create_task(_heartbeat())
+    try:
+        await asyncio.gather(*(_bounded(job) for job in jobs))
+    finally:
+        heartbeat.cancel()
+    return len(jobs)
+
+
+async def run_worker(poll_interval: float = APPLY_POLL_INTERVAL) -> None:
+    """Бесконечный цикл: пачки подряд, пока есть работа, иначе пауза."""
+    while True:
+        try:
+            processed = await run_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка воркера откликов")
+            processed = 0
+        if not processed:
+            await asyncio.sleep(poll_interval)
+
+
+def start_worker() -> asyncio.Task:
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(run_worker())
+    return _worker_task
+
+
+async def stop_worker() -> None:
+    global _worker_task
+    if _worker_task is None:
+        return
+    _worker_task.cancel()
+    try:
+        await _worker_task
+    except asyncio.CancelledError:
+        pass
+    _worker_task = None
+
+
+async def main():
+    await storage.init_db()
+    await migrate_settings.migrate()
+    await hh_api.open_pool()
+    sessions.read_through()
+    try:
+        await run_worker()
+    finally:
+        await hh_api.close_pool()
+        await storage.close_db()
+
+
+if __name__ == "__main__":
+    # Отдельный процесс-воркер: python apply_worker.py
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(0)
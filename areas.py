@@ -0,0 +1,286 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Optional
+
+# Локальный справочник регионов HH (дерево /areas в виде плоского индекса)
+AREAS_CACHE_PATH = os.getenv("HH_AREAS_CACHE", "hh_areas.json")
+AREAS_REFRESH_INTERVAL = float(os.getenv("HH_AREAS_REFRESH", str(24 * 3600)))
+
+logger = logging.getLogger(__name__)
+
+FetchTree = Callable[[], Awaitable[list[dict[str, Any]]]]
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+class AreaSuggestion:
+    def __init__(self, name: str, id: str):
+        # текстовое название региона и его внутренний идентификатор
+        self.name = name
+        self.id = id
+
+
+def normalize(text: str) -> str:
+    """Приводит название к виду для поиска: регистр, ё→е, без пунктуации."""
+    text = text.casefold().replace("ё", "е")
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def _trigrams(norm: str) -> set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AreaDirectory:
+    """
+    Компактный индекс id -> (name, parent_id) по всему дереву регионов HH.
+    Заполняется один раз из /areas или из файла-снимка на диске.
+    """
+
+    def __init__(self):
+        self._areas: dict[str, tuple[str, Optional[str]]] = {}
+        self.fetched_at = 0.0
+        self._matcher: "AreaMatcher | None" = None
+
+    @property
+    def matcher(self) -> "AreaMatcher":
+        """Поисковый индекс; строится лениво после каждой загрузки."""
+        if self._matcher is None:
+            self._matcher = AreaMatcher(self)
+        return self._matcher
+
+    def __len__(self) -> int:
+        return len(self._areas)
+
+    def __contains__(self, area_id) -> bool:
+        return str(area_id) in self._areas
+
+    def items(self):
+        return self._areas.items()
+
+    def name(self, area_id: str | int) -> Optional[str]:
+        entry = self._areas.get(str(area_id))
+        return entry[0] if entry else None
+
+    def parent(self, area_id: str | int) -> Optional[str]:
+        entry = self._areas.get(str(area_id))
+        return entry[1] if entry else None
+
+    def load_tree(self, tree: list[dict[str, Any]], fetched_at: float | None = None) -> None:
+        """Разворачивает вложенный ответ /areas в плоский индекс."""
+        areas: dict[str, tuple[str, Optional[str]]] = {}
+        stack = list(tree)
+        while stack:
+            node = stack.pop()
+            parent = node.get("parent_id")
+            areas[str(node["id"])] = (node["name"], str(parent) if parent else None)
+            stack.extend(node.get("areas") or ())
+        self._areas = areas
+        self.fetched_at = fetched_at or time.time()
+        self._matcher = None
+
+    def replace(self, other: "AreaDirectory") -> None:
+        """Подменяет содержимое готовым справочником (вместе с индексом)."""
+        self._areas = other._areas
+        self.fetched_at = other.fetched_at
+        self._matcher = other._matcher
+
+    def load_file(self, path: str = AREAS_CACHE_PATH) -> bool:
+        """Читает снимок с диска; False, если файла нет или он битый."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._areas = {
+                area_id: (name, parent) for area_id, name, parent in data["areas"]
+            }
+            self.fetched_at = float(data.get("fetched_at", 0))
+            self._matcher = None
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Снимок регионов %s не прочитан: %s", path, e)
+            return False
+        return True
+
+    def save_file(self, path: str = AREAS_CACHE_PATH) -> None:
+        """Атомарно сохраняет индекс на диск."""
+        data = {
+            "fetched_at": self.fetched_at,
+            "areas": [[area_id, name, parent] for area_id, (name, parent) in self._areas.items()],
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+
+class AreaMatcher:
+    """
+    Офлайн-поиск регионов: префиксы слов через bisect по отсортированному
+    списку и нечёткое совпадение по триграммам. Ранжирование: точное
+    совпадение, префикс названия, префикс слова, затем похожесть по
+    Жаккару; при равенстве — менее вложенный и более короткий регион.
+    """
+
+    MIN_SIMILARITY = 0.3
+
+    def __init__(self, directory: "AreaDirectory"):
+        self._dir = directory
+        self._ids: list[str] = []
+        self._norm: list[str] = []
+        self._depth: list[int] = []
+        self._gram_count: list[int] = []
+        prefixes: list[tuple[str, int]] = []
+        grams: dict[str, list[int]] = {}
+        for idx, (area_id, (name, _)) in enumerate(directory.items()):
+            norm = normalize(name)
+            self._ids.append(area_id)
+            self._norm.append(norm)
+            self._depth.append(self._depth_of(area_id))
+            prefixes.append((norm, idx))
+            words = norm.split()
+            if len(words) > 1:
+                prefixes.extend((w, idx) for w in words)
+            name_grams = _trigrams(norm)
+            self._gram_count.append(len(name_grams))
+            for g in name_grams:
+                grams.setdefault(g, []).append(idx)
+        prefixes.sort()
+        self._prefix_keys = [p[0] for p in prefixes]
+        self._prefix_idx = [p[1] for p in prefixes]
+        self._grams = grams
+
+    def _depth_of(self, area_id: str) -> int:
+        depth = 0
+        parent = self._dir.parent(area_id)
+        while parent is not None and depth < 8:
+            depth += 1
+            parent = self._dir.parent(parent)
+        return depth
+
+    def _label(self, idx: int) -> str:
+        area_id = self._ids[idx]
+        name = self._dir.name(area_id)
+        # для городов и сёл подписываем регион, чтобы различать тёзок
+        if self._depth[idx] >= 2:
+            parent = self._dir.name(self._dir.parent(area_id))
+            if parent:
+                return f"{name} ({parent})"
+        return name
+
+    def search(self, query: str, limit: int = 10) -> list[AreaSuggestion]:
+        q = normalize(query)
+        if not q:
+            return []
+        scores: dict[int, float] = {}
+
+        lo = bisect_left(self._prefix_keys, q)
+        hi = bisect_left(self._prefix_keys, q + "\uffff", lo)
+        for pos in range(lo, hi):
+            idx = self._prefix_idx[pos]
+            norm = self._norm[idx]
+            if norm == q:
+                score = 3.0
+            elif norm.startswith(q):
+                score = 2.0 + len(q) / len(norm)
+            else:
+                score = 1.0 + len(q) / len(norm)
+            if score > scores.get(idx, 0.0):
+                scores[idx] = score
+
+        if len(scores) < limit and len(q) >= 3:
+            q_grams = _trigrams(q)
+            shared: dict[int, int] = {}
+            for g in q_grams:
+                for idx in self._grams.get(g, ()):
+                    shared[idx] = shared.get(idx, 0) + 1
+            for idx, common in shared.items():
+                if idx in scores:
+                    continue
+                sim = common / (len(q_grams) + self._gram_count[idx] - common)
+                if sim >= self.MIN_SIMILARITY:
+                    scores[idx] = sim
+
+        ranked = sorted(
+            scores,
+            key=lambda i: (-scores[i], self._depth[i], len(self._norm[i])),
+        )[:limit]
+        return [AreaSuggestion(self._label(i), self._ids[i]) for i in ranked]
+
+
+# общий справочник на процесс
+directory = AreaDirectory()
+_refresh_task: asyncio.Task | None = None
+
+
+async def refresh(fetch_tree: FetchTree, path: str = AREAS_CACHE_PATH) -> None:
+    """Загружает свежее дерево из HH и перезаписывает снимок."""
+    tree = await fetch_tree()
+    fresh = AreaDirectory()
+    fresh.load_tree(tree)
+    # индекс строится вне event loop, затем справочник подменяется целиком
+    await asyncio.to_thread(lambda: fresh.matcher)
+    directory.replace(fresh)
+    await asyncio.to_thread(directory.save_file, path)
+    logger.info("Справочник регионов обновлён: %d записей", len(directory))
+
+
+async def _refresh_loop(fetch_tree: FetchTree, interval: float, path: str) -> None:
+    while True:
+        age = time.time() - directory.fetched_at
+        if age < interval:
+            await asyncio.sleep(interval - age)
+        try:
+            await refresh(fetch_tree, path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Не удалось обновить справочник регионов: %s", e)
+            # повторяем не раньше чем через минуту, не молотя HH
+            await asyncio.sleep(min(interval, 60))
+
+
+def start_background_refresh(
+    fetch_tree: FetchTree,
+    interval: float = AREAS_REFRESH_INTERVAL,
+    path: str = AREAS_CACHE_PATH,
+) -> asyncio.Task:
+    """
+    Поднимает снимок с диска и запускает периодическое обновление.
+    Если снимка нет или он устарел, первое обновление идёт сразу.
+    """
+    global _refresh_task
+    if not len(directory):
+        directory.load_file(path)
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_loop(fetch_tree, interval, path))
+    return _refresh_task
+
+
+async def stop_background_refresh() -> None:
+    global _refresh_task
+    if _refresh_task is None:
+        return
+    _refresh_task.cancel()
+    try:
+        await _refresh_task
+    except asyncio.CancelledError:
+        pass
+    _refresh_task = None
+
+
+def suggest(query: str, limit: int = 10) -> list[AreaSuggestion]:
+    """Ранжированные подсказки регионов из локального индекса."""
+    return directory.matcher.search(query, limit)
+
+
+def area_name(area_id: str | int | None) -> str:
+    """Название региона по id без сетевых запросов."""
+    if not area_id:
+        return "—"
+    return directory.name(area_id) or str(area_id)
@@ -0,0 +1,146 @@
+"""
+Локальные заменители api.hh.ru и Telegram Bot API для бенчмарков
+и нагрузочного теста: ответы правдоподобной формы, без сети.
+"""
+import json
+import time
+import asyncio
+import itertools
+from typing import Any, Dict
+
+import httpx
+from aiogram.client.session.base import BaseSession
+
+AREAS_TREE = [
+    {"id": "113", "parent_id": None, "name": "Россия", "areas": [
+        {"id": "1", "parent_id": "113", "name": "Москва", "areas": []},
+        {"id": "2", "parent_id": "113", "name": "Санкт-Петербург", "areas": []},
+        {"id": "1620", "parent_id": "113", "name": "Республика Марий Эл", "areas": [
+            {"id": "1621", "parent_id": "1620", "name": "Йошкар-Ола", "areas": []},
+        ]},
+    ]},
+]
+
+DICTIONARIES = {
+    "schedule": [
+        {"id": "fullDay", "name": "Полный день"},
+        {"id": "flexible", "name": "Гибкий график"},
+        {"id": "shift", "name": "Сменный график"},
+    ],
+    "employment": [
+        {"id": "full", "name": "Полная занятость"},
+        {"id": "part", "name": "Частичная занятость"},
+        {"id": "project", "name": "Проектная работа"},
+        {"id": "probation", "name": "Стажировка"},
+    ],
+    "work_format": [
+        {"id": "ON_SITE", "name": "На месте работодателя"},
+        {"id": "REMOTE", "name": "Удалённо"},
+        {"id": "HYBRID", "name": "Гибрид"},
+    ],
+}
+
+
+def vacancy(vid: int) -> Dict[str, Any]:
+    return {
+        "id": str(vid),
+        "name": f"Python-разработчик {vid}",
+        "alternate_url": f"https://hh.ru/vacancy/{vid}",
+        "published_at": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime()),
+        "employer": {"id": "42", "name": "ООО Ромашка"},
+        "salary": {"from": 150000, "to": None, "currency": "RUR"},
+        "area": {"id": "1", "name": "Москва"},
+    }
+
+
+class FakeHH:
+    """
+    Обработчик для httpx.MockTransport: отвечает на те пути api.hh.ru
+    и hh.ru/oauth, которые использует HHApiClient. latency — задержка
+    ответа в секундах (для нагрузочного теста).
+    """
+
+    def __init__(self, pages: int = 5, latency: float = 0.0):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path
+        if path == "/oauth/token":
+            return httpx.Response(200, json={
+                "access_token": "bench-access", "refresh_token": "bench-refresh",
+                "expires_in": 1209600, "token_type": "bearer",
+            })
+        if path == "/vacancies":
+            per_page = int(request.url.params.get("per_page", 20))
+            page = int(request.url.params.get("page", 0))
+            start = page * per_page
+            return httpx.Response(200, json={
+                "items": [vacancy(start + i) for i in range(per_page)],
+                "found": self.pages * per_page, "pages": self.pages,
+                "page": page, "per_page": per_page,
+            })
+        if path.startswith("/vacancies/"):
+            vid = path.rsplit("/", 1)[-1]
+            data = vacancy(int(vid) if vid.isdigit() else 0)
+            data["description"] = "<p>Пишем сервисы на <b>Python</b> &amp; asyncio.</p>"
+            return httpx.Response(200, json=data)
+        if path == "/resumes/mine":
+            return httpx.Response(200, json={"items": [
+                {"id": f"r{i}", "title": f"Python developer {i}"} for i in range(3)
+            ]})
+        if path == "/negotiations":
+            return httpx.Response(201, json={})
+        if path == "/suggests/areas":
+            return httpx.Response(200, json={"items": [{"id": "1", "text": "Москва"}]})
+        if path == "/areas":
+            return httpx.Response(200, json=AREAS_TREE)
+        if path == "/dictionaries":
+            return httpx.Response(200, json=DICTIONARIES)
+        return httpx.Response(404, json={"errors": [{"type": "not_found"}]})
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Сессия aiogram, отвечающая вместо Telegram Bot API. Считает вызовы
+    по методам; latency имитирует время ответа сервера.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._message_ids = itertools.count(1000)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == "sendMessage":
+            result: Any = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "private"},
+                "text": method.text,
+            }
+        else:
+            result = True
+        return self.check_response(
+            bot=bot, method=method, status_code=200,
+            content=json.dumps({"ok": True, "result": result}),
+        ).result
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        if False:
+            yield b""
@@ -0,0 +1,320 @@
+"""
+Микробенчмарки горячих путей бота на локальных заменителях HH и Telegram
+(bench_fakes): настройки пользователя, сводка фильтров, клавиатуры,
+мультивыбор, полный апдейт через process_update и методы HHApiClient.
+
+Для каждой операции печатаются ops/sec, память на операцию (пик tracemalloc)
+и число SQL-выражений на операцию. Результат сравнивается с сохранённым
+bench_baseline.json; при регрессии скрипт завершается с кодом 1.
+
+    python bench_hot_paths.py                 # сравнить с базой
+    python bench_hot_paths.py --save          # перезаписать базу
+    python bench_hot_paths.py --only settings # только операции с подстрокой в имени
+"""
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from typing import Awaitable, Callable, Optional
+
+# окружение — до импорта модулей бота: они читают его при импорте
+_tmp = tempfile.mkdtemp(prefix="hh-bench-")
+os.environ.setdefault("TG_BOT_TOKEN", "1:bench")
+os.environ["TG_DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ["HH_AREAS_CACHE"] = os.path.join(_tmp, "areas.json")
+os.environ["HH_CACHE"] = "0"
+os.environ["TG_EDIT_DEBOUNCE"] = "0"
+os.environ["SESSION_FLUSH_INTERVAL"] = "3600"
+for _name in ("HH_RATE_LIMIT", "HH_RATE_BURST", "HH_USER_RATE_LIMIT", "HH_USER_RATE_BURST"):
+    os.environ[_name] = "1000000000"
+
+import httpx
+from aiogram import types
+
+import areas
+import hh_api
+import storage
+import sessions
+import migrate_settings
+import settings_utils
+import tg_register
+from bench_fakes import FakeHH, FakeTelegramSession, AREAS_TREE
+from tg_updates import callback_update
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_output.txt")
+# Минимальное время замера одной операции, секунд
+BENCH_TIME = float(os.getenv("BENCH_TIME", "0.5"))
+# Допуски: скорость шумит между машинами, память и SQL — почти нет
+SPEED_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.25
+MEMORY_SLACK_KIB = 2.0
+
+UID = 100500
+Op = Callable[[], Awaitable[object]]
+
+
+# ────────── счётчик SQL ──────────
+
+class StatementCounter:
+    """Считает выражения SQLite на всех соединениях хранилища (trace callback)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def _trace(self, _sql: str) -> None:
+        self.count += 1
+
+    async def attach(self) -> None:
+        await storage.storage._ensure_open()
+        for conn in [*storage.storage._all, storage.storage._writer]:
+            await conn.set_trace_callback(self._trace)
+
+
+# ────────── замер ──────────
+
+async def measure(op: Op, counter: StatementCounter) -> dict:
+    for _ in range(20):
+        await op()
+
+    # ops/sec: повторяем, пока не наберётся BENCH_TIME
+    gc.collect()
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        await op()
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= BENCH_TIME and runs >= 50:
+            break
+
+    # SQL и память на операцию — отдельным проходом
+    samples = min(runs, 200)
+    counter.count = 0
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await op()
+            peak_total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    statements = counter.count
+
+    return {
+        "ops_per_sec": round(runs / elapsed, 1),
+        "alloc_kib": round(peak_total / samples / 1024, 2),
+        "sql_per_op": round(statements / samples, 2),
+    }
+
+
+# ────────── сценарии ──────────
+
+def build_cases() -> dict[str, Op]:
+    client = hh_api.HHApiClient()
+    token = "bench-token"
+    multi = tg_register.MULTI_KEYS["schedule"]
+    toggle_update = callback_update(1, UID, f"schedule_suggest_{multi[0]}")
+
+    async def settings_get_warm():
+        return await settings_utils.get_user_setting(UID, "keyword")
+
+    async def settings_get_cold():
+        sessions.store.invalidate(UID)
+        return await settings_utils.get_user_settings(UID)
+
+    async def settings_set():
+        await settings_utils.save_user_setting(UID, "keyword", "python")
+
+    async def settings_set_flush():
+        await settings_utils.save_user_setting(UID, "keyword", "python")
+        await sessions.flush()
+
+    async def filters_summary():
+        return await tg_register.build_filters_summary(UID)
+
+    async def inline_suggestions():
+        return tg_register.build_inline_suggestions(multi, "schedule_suggest", {multi[0]}, with_back=True)
+
+    async def settings_keyboard():
+        return settings_utils.build_settings_keyboard()
+
+    async def toggle():
+        return await tg_register.toggle_multi_value(UID, "schedule", multi[0])
+
+    async def update_toggle():
+        update = types.Update.model_validate(toggle_update, context={"bot": tg_register.bot})
+        await tg_register.process_update(update)
+        await tg_register.edits.flush()
+
+    async def hh_get():
+        return await client.get("/vacancies", token=token, params={"text": "python"})
+
+    async def hh_exchange_code():
+        return await client.exchange_code_for_token("code")
+
+    async def hh_refresh_token():
+        return await client.refresh_access_token("refresh")
+
+    async def hh_search_vacancies():
+        return await client.search_vacancies("python", token=token)
+
+    async def hh_search_page():
+        return await client.search_page({"text": "python", "per_page": 20}, 1, token=token)
+
+    async def hh_iter_vacancies():
+        return [v async for v in client.iter_vacancies("python", per_page=20, token=token, max_results=100)]
+
+    async def hh_list_resumes():
+        return await client.list_resumes(token=token)
+
+    async def hh_get_vacancy():
+        return await client.get_vacancy("123", token=token)
+
+    async def hh_respond():
+        return await client.respond_to_vacancy("123", "r1", "Здравствуйте!", token=token)
+
+    return {
+        "settings.get_warm": settings_get_warm,
+        "settings.get_cold": settings_get_cold,
+        "settings.set": settings_set,
+        "settings.set_flush": settings_set_flush,
+        "tg.build_filters_summary": filters_summary,
+        "tg.build_inline_suggestions": inline_suggestions,
+        "tg.build_settings_keyboard": settings_keyboard,
+        "tg.toggle_multi_value": toggle,
+        "tg.process_update_toggle": update_toggle,
+        "hh.get": hh_get,
+        "hh.exchange_code_for_token": hh_exchange_code,
+        "hh.refresh_access_token": hh_refresh_token,
+        "hh.search_vacancies": hh_search_vacancies,
+        "hh.search_page": hh_search_page,
+        "hh.iter_vacancies": hh_iter_vacancies,
+        "hh.list_resumes": hh_list_resumes,
+        "hh.get_vacancy": hh_get_vacancy,
+        "hh.respond_to_vacancy": hh_respond,
+    }
+
+
+# ────────── сравнение с базой ──────────
+
+def compare(name: str, result: dict, base: Optional[dict], speed_tol: float) -> list[str]:
+    if base is None:
+        return []
+    problems = []
+    if result["ops_per_sec"] < base["ops_per_sec"] * (1 - speed_tol):
+        problems.append(f"ops/sec {result['ops_per_sec']} < {base['ops_per_sec']} (-{speed_tol:.0%})")
+    if result["sql_per_op"] > base["sql_per_op"]:
+        problems.append(f"SQL/op {result['sql_per_op']} > {base['sql_per_op']}")
+    limit = base["alloc_kib"] * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK_KIB
+    if result["alloc_kib"] > limit:
+        problems.append(f"KiB/op {result['alloc_kib']} > {round(limit, 2)}")
+    return [f"{name}: {p}" for p in problems]
+
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results: dict) -> None:
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+# ────────── запуск ──────────
+
+async def setup() -> StatementCounter:
+    fake_hh = FakeHH(pages=5)
+    hh_api._http = httpx.AsyncClient(base_url=hh_api.HHApiClient.BASE_URL, transport=fake_hh.transport())
+    fake_tg = FakeTelegramSession()
+    tg_register.bot.session = fake_tg
+    areas.directory.load_tree(AREAS_TREE)
+
+    await storage.init_db()
+    await migrate_settings.migrate()
+    for key, value in {"region": "1", "salary": "150000", "keyword": "python",
+                       "schedule": "гибкий график", "prompt": "Коротко"}.items():
+        await settings_utils.save_user_setting(UID, key, value)
+    (await sessions.get_session(UID)).remember_user()
+    await sessions.flush()
+
+    counter = StatementCounter()
+    await counter.attach()
+    return counter
+
+
+async def teardown() -> None:
+    await tg_register.edits.flush()
+    await sessions.close()
+    await hh_api.close_pool()
+    await storage.close_db()
+
+
+async def run(only: Optional[str]) -> dict:
+    counter = await setup()
+    results = {}
+    try:
+        for name, op in build_cases().items():
+            if only and only not in name:
+                continue
+            results[name] = await measure(op, counter)
+    finally:
+        await teardown()
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--save", action="store_true", help="записать результат как новую базу")
+    parser.add_argument("--only", help="только операции, содержащие подстроку")
+    parser.add_argument("--tolerance", type=float, default=SPEED_TOLERANCE,
+                        help="допустимое падение ops/sec, доля (по умолчанию 0.5)")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args.only))
+    baseline = load_baseline().get("results", {})
+
+    lines = [f"{'operation':32} {'ops/sec':>10} {'base':>10} {'KiB/op':>8} {'SQL/op':>7}"]
+    problems: list[str] = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        lines.append(
+            f"{name:32} {r['ops_per_sec']:>10.1f} "
+            f"{(base['ops_per_sec'] if base else 0):>10.1f} {r['alloc_kib']:>8.2f} {r['sql_per_op']:>7.2f}"
+        )
+        problems += compare(name, r, base, args.tolerance)
+
+    if args.save:
+        merged = {**baseline, **results}
+        save_baseline(merged)
+        lines.append(f"\nБаза сохранена: {BASELINE_PATH}")
+    elif problems:
+        lines.append("\nРЕГРЕССИИ:")
+        lines += [f"  {p}" for p in problems]
+    report = "\n".join(lines)
+    print(report)
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    return 1 if problems and not args.save else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
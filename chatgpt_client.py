@@ -11,9 +11,15 @@ class ChatGPTClient:
         # достаточно раскомментировать код OpenAI-запроса ниже
         self.api_key = os.getenv("OPENAI_API_KEY")
 
-    async def generate_cover_letter(self, job_description: str, resume_summary: str) -> str:
+    async def generate_cover_letter(
+        self,
+        job_description: str,
+        resume_summary: str,
+        prompt: str | None = None,
+    ) -> str:
         """
         Возвращает готовый шаблон письма без обращения к внешним сервисам.
+        prompt — пожелания пользователя к письму (настройка 'prompt').
         """
         return (
             "Здравствуйте! Я внимательно изучил(а) вашу вакансию и вижу, "
@@ -29,7 +35,8 @@ class ChatGPTClient:
         #     messages=[
         #         {"role": "system", "content": "Ты опытный HR, пиши на русском кратко и убедительно"},
         #         {"role": "user", "content": f"Вакансия: {job_description}"},
-        #         {"role": "user", "content": f"Резюме: {resume_summary}"}
+        #         {"role": "user", "content": f"Резюме: {resume_summary}"},
+        #         {"role": "user", "content": f"Пожелания: {prompt or '—'}"}
         #     ],
         #     temperature=0.7
         # )
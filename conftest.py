@@ -0,0 +1,49 @@
+import os
+import asyncio
+import tempfile
+
+# окружение — до импорта модулей бота: они читают его при импорте
+_tmp = tempfile.mkdtemp(prefix="hh-tests-")
+os.environ.setdefault("TG_BOT_TOKEN", "1:test")
+os.environ["TG_DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ["HH_CACHE_PATH"] = os.path.join(_tmp, "hh_cache.db")
+os.environ["HH_AREAS_CACHE"] = os.path.join(_tmp, "areas.json")
+os.environ["SESSION_FLUSH_INTERVAL"] = "3600"
+
+import pytest
+
+import storage
+import migrate_settings
+import search_filters
+from bench_fakes import DICTIONARIES
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """
+    Запускает async-сценарий на отдельной базе с актуальной схемой:
+    run(scenario) -> результат scenario().
+    """
+    db = storage.Storage(str(tmp_path / "test.db"), readers=2)
+    monkeypatch.setattr(storage, "storage", db)
+
+    def _run(scenario):
+        async def _main():
+            await db.open()
+            await migrate_settings.migrate()
+            try:
+                return await scenario()
+            finally:
+                await db.close()
+
+        return asyncio.run(_main())
+
+    return _run
+
+
+@pytest.fixture
+def label_map(monkeypatch):
+    """Справочники HH из bench_fakes вместо запроса к /dictionaries."""
+    monkeypatch.setattr(search_filters, "_label_map", search_filters.build_label_map(DICTIONARIES))
+    monkeypatch.setattr(search_filters, "_label_map_expires", float("inf"))
+    return search_filters._label_map
@@ -0,0 +1,238 @@
+import os
+import re
+import html
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional, Protocol
+
+import storage
+import metrics
+from chatgpt_client import ChatGPTClient
+from hh_api import HHApiClient
+
+# Какой генератор писем использовать: chatgpt или template (локальный шаблон)
+COVER_LETTER_BACKEND = os.getenv("COVER_LETTER_BACKEND", "chatgpt")
+# Одновременных генераций (внешний API медленный и платный)
+COVER_LETTER_CONCURRENCY = int(os.getenv("COVER_LETTER_CONCURRENCY", "4"))
+# Сколько хранить письмо; после — генерируется заново
+COVER_LETTER_TTL = int(os.getenv("COVER_LETTER_TTL", str(30 * 86400)))
+COVER_LETTER_TEMPLATE = os.getenv(
+    "COVER_LETTER_TEMPLATE",
+    "Здравствуйте! Меня заинтересовала вакансия «{vacancy}»{employer_part}. "
+    "Мой опыт и навыки хорошо подходят для описанных задач.{prompt_part} "
+    "Буду рад(а) обсудить детали сотрудничества!",
+)
+# как часто (в новых письмах) чистить устаревшие
+PRUNE_EVERY = 500
+
+logger = logging.getLogger(__name__)
+
+_TAG = re.compile(r"<[^>]+>")
+
+
+class Backend(Protocol):
+    async def generate(self, vacancy: Dict[str, Any], resume_id: str, prompt: Optional[str]) -> str:
+        ...
+
+
+def vacancy_text(vacancy: Dict[str, Any]) -> str:
+    """Текст вакансии для генератора: название и описание без HTML."""
+    description = html.unescape(_TAG.sub(" ", vacancy.get("description") or ""))
+    return " ".join(f"{vacancy.get('name', '')}\n{description}".split())
+
+
+class ChatGPTBackend:
+    def __init__(self, client: ChatGPTClient | None = None):
+        self.client = client or ChatGPTClient()
+
+    async def generate(self, vacancy: Dict[str, Any], resume_id: str, prompt: Optional[str]) -> str:
+        return await self.client.generate_cover_letter(vacancy_text(vacancy), resume_id, prompt)
+
+
+class TemplateBackend:
+    """Локальный шаблон: мгновенно и бесплатно, без внешних сервисов."""
+
+    def __init__(self, template: str = COVER_LETTER_TEMPLATE):
+        self.template = template
+
+    async def generate(self, vacancy: Dict[str, Any], resume_id: str, prompt: Optional[str]) -> str:
+        employer = (vacancy.get("employer") or {}).get("name")
+        return self.template.format(
+            vacancy=vacancy.get("name") or "",
+            employer_part=f" в компании {employer}" if employer else "",
+            prompt_part=f" {prompt.strip()}" if prompt and prompt.strip() else "",
+        )
+
+
+# имя -> фабрика генератора; свои генераторы добавляются register_backend()
+BACKENDS: dict[str, Callable[[], Backend]] = {
+    "chatgpt": ChatGPTBackend,
+    "template": TemplateBackend,
+}
+
+
+def register_backend(name: str, factory: Callable[[], Backend]) -> None:
+    BACKENDS[name] = factory
+
+
+class CoverLetters:
+    """
+    Слой над генератором писем: готовые письма хранятся в таблице
+    cover_letters по хэшу (генератор, вакансия, резюме, промпт), так что
+    одинаковое письмо не генерируется дважды — ни последовательно, ни
+    параллельно (single-flight). Число одновременных генераций ограничено.
+    Вакансия загружается из HH только при промахе.
+    """
+
+    def __init__(self, backend_name: str = COVER_LETTER_BACKEND, concurrency: int = COVER_LETTER_CONCURRENCY):
+        if backend_name not in BACKENDS:
+            raise ValueError(f"Неизвестный генератор писем: {backend_name}")
+        self.backend_name = backend_name
+        self.backend = BACKENDS[backend_name]()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._hh = HHApiClient()
+        self._inserted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, vacancy_id: str, resume_id: str, prompt: Optional[str]) -> str:
+        raw = json.dumps([self.backend_name, str(vacancy_id), str(resume_id), prompt or ""], ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def _lookup(self, keys: list[str]) -> dict[str, str]:
+        if not keys:
+            return {}
+        marks = ",".join("?" * len(keys))
+        rows = await storage.fetchall(
+            f"SELECT key, letter FROM cover_letters WHERE key IN ({marks}) AND created_at >= ?",
+            [*keys, int(time.time()) - COVER_LETTER_TTL],
+        )
+        return dict(rows)
+
+    async def _save(self, rows: list[tuple[str, str]]) -> None:
+        now = int(time.time())
+        await storage.executemany(
+            "INSERT OR REPLACE INTO cover_letters (key, letter, created_at) VALUES (?, ?, ?)",
+            [(key, letter, now) for key, letter in rows],
+        )
+        self._inserted += len(rows)
+        if self._inserted >= PRUNE_EVERY:
+            self._inserted = 0
+            await storage.execute(
+                "DELETE FROM cover_letters WHERE created_at < ?", (now - COVER_LETTER_TTL,)
+            )
+
+    async def _generate(
+        self,
+        vacancy_id: str,
+        resume_id: str,
+        prompt: Optional[str],
+        vacancy: Optional[Dict[str, Any]],
+        token: Optional[str],
+    ) -> str:
+        async with self._sem:
+            if vacancy is None:
+                vacancy = await self._hh.get_vacancy(vacancy_id, token=token)
+            return await self.backend.generate(vacancy, resume_id, prompt)
+
+    def _generate_once(self, key: str, *args) -> "asyncio.Task[str]":
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def get(
+        self,
+        vacancy_id: str,
+        resume_id: str,
+        prompt: Optional[str] = None,
+        *,
+        vacancy: Optional[Dict[str, Any]] = None,
+        token: Optional[str] = None,
+    ) -> str:
+        """Письмо для отклика; vacancy можно передать, если она уже загружена."""
+        key = self.key(vacancy_id, resume_id, prompt)
+        found = await self._lookup([key])
+        if key in found:
+            self.hits += 1
+            return found[key]
+        self.misses += 1
+        task = self._generate_once(key, vacancy_id, resume_id, prompt, vacancy, token)
+        letter = await asyncio.shield(task)
+        await self._save([(key, letter)])
+        return letter
+
+    async def get_many(
+        self,
+        vacancy_ids: Iterable[str],
+        resume_id: str,
+        prompt: Optional[str] = None,
+        *,
+        token: Optional[str] = None,
+    ) -> dict[str, str | Exception]:
+        """
+        Письма для списка вакансий: один запрос к БД на все, промахи
+        генерируются параллельно (в пределах семафора) и сохраняются
+        одной записью. Ошибка по вакансии возвращается вместо письма.
+        """
+        keys = {str(vid): self.key(vid, resume_id, prompt) for vid in vacancy_ids}
+        found = await self._lookup(list(set(keys.values())))
+        self.hits += sum(1 for key in keys.values() if key in found)
+        missing = {vid: key for vid, key in keys.items() if key not in found}
+        self.misses += len(missing)
+        tasks = {
+            vid: self._generate_once(key, vid, resume_id, prompt, None, token)
+            for vid, key in missing.items()
+        }
+        results = await asyncio.gather(*(asyncio.shield(t) for t in tasks.values()), return_exceptions=True)
+        generated = dict(zip(tasks, results))
+        fresh = [(missing[vid], letter) for vid, letter in generated.items() if isinstance(letter, str)]
+        if fresh:
+            await self._save(fresh)
+        letters: dict[str, str | Exception] = {}
+        for vid, key in keys.items():
+            letters[vid] = found[key] if key in found else generated[vid]
+        return letters
+
+
+_letters: CoverLetters | None = None
+
+
+def get_letters() -> CoverLetters:
+    """Общий на процесс слой генерации (создаётся при первом обращении)."""
+    global _letters
+    if _letters is None:
+        _letters = CoverLetters()
+    return _letters
+
+
+async def get_cover_letter(
+    vacancy_id: str,
+    resume_id: str,
+    prompt: Optional[str] = None,
+    *,
+    vacancy: Optional[Dict[str, Any]] = None,
+    token: Optional[str] = None,
+) -> str:
+    return await get_letters().get(vacancy_id, resume_id, prompt, vacancy=vacancy, token=token)
+
+
+async def generate_batch(
+    vacancy_ids: Iterable[str],
+    resume_id: str,
+    prompt: Optional[str] = None,
+    *,
+    token: Optional[str] = None,
+) -> dict[str, str | Exception]:
+    return await get_letters().get_many(vacancy_ids, resume_id, prompt, token=token)
+
+
+metrics.observe_cache(
+    "cover_letters", lambda: {"hit": _letters.hits, "miss": _letters.misses} if _letters else {}
+)
@@ -1,6 +1,136 @@
 import os
+import time
+import asyncio
+import logging
+import importlib.util
+from collections import deque
 import httpx
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List
+
+import areas
+import metrics
+import tracing
+from areas import AreaSuggestion
+from http_cache import CachingTransport
+from rate_limit import FairLimiter, backoff, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Параметры общего пула соединений с api.hh.ru
+USER_AGENT = os.getenv("HH_USER_AGENT", "HH HunterBot/1.0 (tg:@your_nick)")
+HH_TIMEOUT = float(os.getenv("HH_TIMEOUT", "15"))
+HH_POOL_MAX_CONNECTIONS = int(os.getenv("HH_POOL_MAX_CONNECTIONS", "100"))
+HH_POOL_MAX_KEEPALIVE = int(os.getenv("HH_POOL_MAX_KEEPALIVE", "20"))
+HH_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HH_POOL_KEEPALIVE_EXPIRY", "30"))
+HH_HTTP2 = os.getenv("HH_HTTP2", "0") == "1"
+HH_CACHE = os.getenv("HH_CACHE", "1") == "1"
+
+# HH отдаёт не больше 2000 вакансий на один поисковый запрос
+HH_SEARCH_DEPTH = 2000
+HH_SEARCH_CONCURRENCY = int(os.getenv("HH_SEARCH_CONCURRENCY", "4"))
+
+# Лимиты запросов к HH: общий на процесс и на каждый токен пользователя
+HH_RATE_LIMIT = float(os.getenv("HH_RATE_LIMIT", "10"))
+HH_RATE_BURST = float(os.getenv("HH_RATE_BURST", "20"))
+HH_USER_RATE_LIMIT = float(os.getenv("HH_USER_RATE_LIMIT", "3"))
+HH_USER_RATE_BURST = float(os.getenv("HH_USER_RATE_BURST", "5"))
+HH_MAX_RETRIES = int(os.getenv("HH_MAX_RETRIES", "3"))
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+limiter = FairLimiter(HH_RATE_LIMIT, HH_RATE_BURST, HH_USER_RATE_LIMIT, HH_USER_RATE_BURST)
+# ключ лимитера в extensions запроса httpx (читает LimitedTransport)
+LIMIT_KEY_EXTENSION = "hh_limit_key"
+# лимиты HH действуют на API; OAuth (hh.ru/oauth/token) через limiter не идёт
+LIMITED_HOST = "api.hh.ru"
+
+REQUEST_SECONDS = metrics.histogram(
+    "hh_request_seconds", "Время запросов к API HH (каждая попытка)", ("method", "endpoint", "status")
+)
+LIMITER_WAIT_SECONDS = metrics.histogram("hh_limiter_wait_seconds", "Ожидание в лимитере запросов HH")
+
+_http: httpx.AsyncClient | None = None
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx, пропускающий через limiter только запросы, которые
+    действительно уходят в сеть: стоит под CachingTransport, поэтому
+    ответы из кэша не тратят токены и не ждут паузы после 429.
+    Ключ справедливости берётся из extensions запроса (см. _request);
+    без ключа действует только общий лимит.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host != LIMITED_HOST:
+            return await self._inner.handle_async_request(request)
+        started = time.perf_counter()
+        await limiter.acquire(request.extensions.get(LIMIT_KEY_EXTENSION))
+        LIMITER_WAIT_SECONDS.observe(time.perf_counter() - started)
+        tracing.add_span("hh.limiter", started)
+        return await self._inner.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+def _build_http() -> httpx.AsyncClient:
+    http2 = HH_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        # HTTP/2 в httpx требует пакет h2 (pip install httpx[http2])
+        logger.warning("HH_HTTP2=1, но пакет h2 не установлен — работаем по HTTP/1.1")
+        http2 = False
+    transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HH_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=HH_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HH_POOL_KEEPALIVE_EXPIRY,
+        ),
+    )
+    transport = LimitedTransport(transport)
+    if HH_CACHE:
+        # GET-ответы кэшируются на диске с условной перепроверкой (ETag/Last-Modified)
+        transport = CachingTransport(transport)
+    return httpx.AsyncClient(
+        base_url=HHApiClient.BASE_URL,
+        headers={"User-Agent": USER_AGENT},
+        timeout=HH_TIMEOUT,
+        transport=transport,
+    )
+
+
+def _http_cache_stats() -> dict[str, int]:
+    transport = getattr(_http, "_transport", None)
+    if not isinstance(transport, CachingTransport):
+        return {}
+    return {"hit": transport.hits, "revalidated": transport.revalidated, "miss": transport.misses}
+
+
+metrics.observe_cache("hh_http", _http_cache_stats)
+
+
+def get_http() -> httpx.AsyncClient:
+    """Общий на процесс httpx-клиент (keep-alive пул к api.hh.ru)."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = _build_http()
+    return _http
+
+
+async def open_pool() -> None:
+    """Создаёт пул соединений; вызывается на старте приложения."""
+    get_http()
+
+
+async def close_pool() -> None:
+    """Закрывает пул соединений; вызывается при остановке приложения."""
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
 
 
 class HHApiClient:
@@ -10,17 +140,70 @@ class HHApiClient:
     TOKEN_URL = "https://hh.ru/oauth/token"
 
     def __init__(self, token: str | None = None):
-        """Базовая инициализация клиента HH API."""
-        self._headers = {
-            "User-Agent": os.getenv(
-                "HH_USER_AGENT", "HH HunterBot/1.0 (tg:@your_nick)"
-            )
-        }
+        """
+        Лёгкая обёртка над общим пулом: хранит только токен по умолчанию.
+        Токен можно передать и в каждый вызов (token=...).
+        """
+        self.token = token
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        token: str | None = None,
+        limit_key: Any = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        Выполняет запрос через общий пул, подставляя токен пользователя.
+        Ушедшие в сеть запросы проходят через limiter (LimitedTransport)
+        с ключом limit_key или токеном; на 429/503 уважается Retry-After,
+        идемпотентные запросы повторяются с джиттером.
+        """
+        token = token or self.token
         if token:
-            self._headers["Authorization"] = f"Bearer {token}"
-        self._client = httpx.AsyncClient(
-            base_url="https://api.hh.ru", headers=self._headers, timeout=15
-        )
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["Authorization"] = f"Bearer {token}"
+            kwargs["headers"] = headers
+        kwargs["extensions"] = {**(kwargs.get("extensions") or {}), LIMIT_KEY_EXTENSION: limit_key or token}
+        retry = method.upper() in IDEMPOTENT_METHODS
+        endpoint = metrics.endpoint_label(url)
+        attempt = 0
+        while True:
+            sent = time.perf_counter()
+            try:
+                resp = await get_http().request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - sent, method=method, endpoint=endpoint, status=type(e).__name__
+                )
+                tracing.add_span("hh.request", sent, method=method, endpoint=endpoint, error=type(e).__name__)
+                if not retry or attempt >= HH_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(backoff(attempt))
+                attempt += 1
+                continue
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - sent, method=method, endpoint=endpoint, status=resp.status_code
+            )
+            tracing.add_span("hh.request", sent, method=method, endpoint=endpoint, status=resp.status_code)
+            if resp.status_code not in (429, 503):
+                return resp
+            delay = parse_retry_after(resp.headers.get("retry-after"))
+            if resp.status_code == 429:
+                # HH просит притормозить — останавливаем всех, а не только этот запрос
+                limiter.pause(delay if delay is not None else backoff(attempt))
+            if not retry or attempt >= HH_MAX_RETRIES:
+                return resp
+            await resp.aclose()
+            await asyncio.sleep(delay if delay is not None else backoff(attempt))
+            attempt += 1
+
+    async def get(
+        self, url: str, token: str | None = None, limit_key: Any = None, **kwargs: Any
+    ) -> httpx.Response:
+        """Произвольный GET к API HH через общий пул и лимитер."""
+        return await self._request("GET", url, token=token, limit_key=limit_key, **kwargs)
 
     async def exchange_code_for_token(self, code: str) -> Dict[str, Any]:
         """Обменивает authorization code на пару токенов."""
@@ -31,44 +214,119 @@ class HHApiClient:
             "code": code,
             "redirect_uri": os.getenv("REDIRECT_URI"),
         }
-        resp = await self._client.post(self.TOKEN_URL, data=data)
+        resp = await self._request("POST", self.TOKEN_URL, data=data)
         if resp.status_code != 200:
             # Логируем код и тело ответа
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error("HH OAuth error %s: %s", resp.status_code, resp.text)
             resp.raise_for_status()
         return resp.json()
 
+    async def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
+        """Получает новую пару токенов по refresh_token."""
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        }
+        resp = await self._request("POST", self.TOKEN_URL, data=data)
+        if resp.status_code != 200:
+            logger.error("HH OAuth refresh error %s: %s", resp.status_code, resp.text)
+            resp.raise_for_status()
+        return resp.json()
+
     async def search_vacancies(
         self,
         text: str,
         per_page: int = 20,
+        token: str | None = None,
     ) -> List[Dict[str, Any]]:
         """
         Поиск вакансий по тексту.
         """
         params = {"text": text, "per_page": per_page}
-        resp = await self._client.get(
-            f"{self.BASE_URL}/vacancies",
-            params=params,
-        )
+        resp = await self._request("GET", "/vacancies", token=token, params=params)
         resp.raise_for_status()
         return resp.json().get("items", [])
 
-    async def list_resumes(self) -> List[Dict[str, Any]]:
+    async def search_page(
+        self,
+        params: Dict[str, Any],
+        page: int = 0,
+        token: str | None = None,
+        limit_key: Any = None,
+    ) -> Dict[str, Any]:
+        """
+        Одна страница поиска /vacancies целиком (items, found, pages).
+        """
+        resp = await self._request(
+            "GET", "/vacancies", token=token, limit_key=limit_key, params={**params, "page": page}
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def iter_vacancies(
+        self,
+        text: str | None = None,
+        per_page: int = 100,
+        token: str | None = None,
+        concurrency: int = HH_SEARCH_CONCURRENCY,
+        max_results: int = HH_SEARCH_DEPTH,
+        limit_key: Any = None,
+        **filters: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Асинхронно перебирает все страницы поиска (до лимита HH в 2000).
+        Первая страница сообщает число страниц, остальные запрашиваются
+        окном из concurrency запросов; вакансии отдаются в порядке выдачи
+        по мере прихода страниц, в памяти не больше окна.
+        limit_key — ключ лимитера для анонимного перебора (без token).
+        """
+        params = {"per_page": per_page, **filters}
+        if text:
+            params["text"] = text
+        limit = min(max_results, HH_SEARCH_DEPTH)
+        first = await self.search_page(params, 0, token, limit_key)
+        pages = min(first.get("pages") or 1, -(-limit // per_page))
+
+        emitted = 0
+        for item in first.get("items", []):
+            if emitted >= limit:
+                return
+            emitted += 1
+            yield item
+
+        window: deque[asyncio.Task] = deque()
+        next_page = 1
+        try:
+            while next_page < pages and len(window) < concurrency:
+                window.append(asyncio.create_task(self.search_page(params, next_page, token, limit_key)))
+                next_page += 1
+            while window:
+                data = await window.popleft()
+                if next_page < pages:
+                    window.append(asyncio.create_task(self.search_page(params, next_page, token, limit_key)))
+                    next_page += 1
+                for item in data.get("items", []):
+                    if emitted >= limit:
+                        return
+                    emitted += 1
+                    yield item
+        finally:
+            for task in window:
+                task.cancel()
+
+    async def list_resumes(self, token: str | None = None) -> List[Dict[str, Any]]:
         """
         Получение списка резюме пользователя.
         """
-        resp = await self._client.get(f"{self.BASE_URL}/resumes/mine")
+        resp = await self._request("GET", "/resumes/mine", token=token)
         resp.raise_for_status()
         return resp.json().get("items", [])
 
-    async def get_vacancy(self, vacancy_id: str) -> Dict[str, Any]:
+    async def get_vacancy(self, vacancy_id: str, token: str | None = None) -> Dict[str, Any]:
         """
         Получение детальной информации о вакансии по ID.
         """
-        resp = await self._client.get(f"{self.BASE_URL}/vacancies/{vacancy_id}")
+        resp = await self._request("GET", f"/vacancies/{vacancy_id}", token=token)
         resp.raise_for_status()
         return resp.json()
 
@@ -77,6 +335,7 @@ class HHApiClient:
         vacancy_id: str,
         resume_id: str,
         cover_letter: str,
+        token: str | None = None,
     ) -> Dict[str, Any]:
         """
         Отправка отклика на вакансию (создание переговоров).
@@ -86,60 +345,64 @@ class HHApiClient:
             "resume_id": resume_id,
             "cover_letter": cover_letter,
         }
-        resp = await self._client.post(
-            f"{self.BASE_URL}/negotiations",
-            json=payload,
-        )
+        resp = await self._request("POST", "/negotiations", token=token, json=payload)
         resp.raise_for_status()
         return resp.json()
 
     async def close(self):
         """
-        Закрывает HTTP-сессию.
+        Оставлена для совместимости: пул соединений общий и закрывается
+        через close_pool() при остановке приложения.
         """
-        await self._client.aclose()
 
 
-class AreaSuggestion:
-    def __init__(self, name: str, id: str):
-        # текстовое название региона и его внутренний идентификатор
-        self.name = name
-        self.id = id
+# анонимный клиент для публичных справочников
+_public = HHApiClient()
 
+
+@tracing.traced("hh.get_area_suggestions")
 async def get_area_suggestions(query: str) -> List[AreaSuggestion]:
     """
-    Делает запрос к HH API /suggests/areas?text=<query>
-    и возвращает список похожих локаций.
+    Возвращает список похожих локаций из локального справочника регионов.
+    Пока справочник не загружен, спрашивает HH /suggests/areas.
     """
-    url = "https://api.hh.ru/suggests/areas"
-    params = {"text": query}
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, params=params, timeout=5.0)
+    if len(areas.directory):
+        return areas.suggest(query)
+    try:
+        resp = await _public.get("/suggests/areas", params={"text": query}, timeout=5.0)
         resp.raise_for_status()
-        data = resp.json()
-    items = data.get("items", [])
+    except httpx.HTTPError as e:
+        logger.warning("HH suggests error: %s", e)
+        return []
+    items = resp.json().get("items", [])
     # из каждого элемента берём 'text' (имя) и 'id'
     return [AreaSuggestion(item["text"], item["id"]) for item in items]
 
 
-# общий клиент HH API для простых запросов
-_ua = os.getenv("HH_USER_AGENT", "HH HunterBot/1.0 (tg:@your_nick)")
-client = httpx.AsyncClient(
-    base_url="https://api.hh.ru", timeout=5.0, headers={"User-Agent": _ua}
-)
+async def fetch_area_tree() -> List[Dict[str, Any]]:
+    """Полное дерево регионов HH (GET /areas)."""
+    resp = await _public.get("/areas", timeout=30.0)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def fetch_dictionaries() -> Dict[str, Any]:
+    """Справочники HH (GET /dictionaries): графики, занятость, форматы работы."""
+    resp = await _public.get("/dictionaries", timeout=10.0)
+    resp.raise_for_status()
+    return resp.json()
+
 
+async def search_public(params: Dict[str, Any], page: int = 0, limit_key: Any = None) -> Dict[str, Any]:
+    """
+    Анонимная страница поиска: без токена выдача одинакова для всех.
+    limit_key (например, id пользователя Telegram) включает лимит на
+    ключ; без него запрос ограничен только общим лимитом.
+    """
+    return await _public.search_page(params, page, limit_key=limit_key)
 
+
+@tracing.traced("hh.area_name")
 async def area_name(area_id: str | int | None) -> str:
-    """Возвращает человекочитаемое название области HH."""
-    if not area_id:
-        return "—"
-    if not str(area_id).isdigit():
-        return str(area_id)
-    try:
-        async with client.get(f"/areas/{area_id}") as resp:
-            if resp.status_code == 200:
-                data = await resp.json()
-                return data.get("name") or str(area_id)
-    except Exception:
-        pass
-    return str(area_id)
\ No newline at end of file
+    """Возвращает человекочитаемое название области HH из локального справочника."""
+    return areas.area_name(area_id)
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
+
+import storage
+from hh_api import HHApiClient
+
+# Обновляем токен, если до истечения осталось меньше REFRESH_MARGIN секунд
+REFRESH_MARGIN = float(os.getenv("HH_TOKEN_REFRESH_MARGIN", "600"))
+REFRESH_INTERVAL = float(os.getenv("HH_TOKEN_REFRESH_INTERVAL", "60"))
+REFRESH_CONCURRENCY = int(os.getenv("HH_TOKEN_REFRESH_CONCURRENCY", "4"))
+REFRESH_BATCH = int(os.getenv("HH_TOKEN_REFRESH_BATCH", "200"))
+# токены, истёкшие раньше этого срока, фоновый цикл уже не трогает
+REFRESH_GIVE_UP_AFTER = float(os.getenv("HH_TOKEN_REFRESH_GIVE_UP", str(7 * 24 * 3600)))
+# пауза перед повторной фоновой попыткой после ошибки
+REFRESH_RETRY_DELAY = 300.0
+
+logger = logging.getLogger(__name__)
+
+hh_client = HHApiClient()
+
+_inflight: dict[int, asyncio.Task] = {}
+_retry_after: dict[int, float] = {}
+_refresher_task: asyncio.Task | None = None
+
+
+async def save_tokens(tg_user: int, tokens: Dict[str, Any], refresh_token: str | None = None) -> None:
+    """Сохраняет пару токенов из ответа HH OAuth."""
+    expires_at = int(time.time()) + tokens.get("expires_in", 0)
+    await storage.execute(
+        """
+        INSERT OR REPLACE INTO user_tokens
+            (tg_user, access_token, refresh_token, expires_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        (
+            tg_user,
+            tokens.get("access_token"),
+            tokens.get("refresh_token") or refresh_token,
+            expires_at,
+        ),
+    )
+
+
+async def _load(tg_user: int) -> Optional[tuple]:
+    return await storage.fetchone(
+        "SELECT access_token, refresh_token, expires_at FROM user_tokens WHERE tg_user = ?",
+        (tg_user,),
+    )
+
+
+async def get_user_token(tg_user: int) -> str | None:
+    """
+    Возвращает действующий access_token пользователя или None.
+    Если токен вот-вот истечёт, сначала обновляет его (один запрос
+    на пользователя, сколько бы корутин ни ждали одновременно).
+    """
+    row = await _load(tg_user)
+    if not row:
+        return None
+    access_token, _, expires_at = row
+    now = time.time()
+    if expires_at - now > REFRESH_MARGIN:
+        return access_token
+    if _retry_after.get(tg_user, 0) > now:
+        # недавняя попытка не удалась или HH ответил «token not expired» —
+        # не повторяем запрос на каждом обращении, даже если токен истёк
+        return access_token if expires_at > now else None
+    fresh = await refresh_user_token(tg_user)
+    if fresh:
+        return fresh
+    if await _load(tg_user) is None:
+        # HH отозвал пару — старый access_token тоже недействителен
+        return None
+    return access_token if expires_at > time.time() else None
+
+
+async def refresh_user_token(tg_user: int) -> str | None:
+    """Single-flight обновление токена пользователя."""
+    task = _inflight.get(tg_user)
+    if task is None:
+        task = asyncio.create_task(_refresh(tg_user))
+        _inflight[tg_user] = task
+        task.add_done_callback(lambda _: _inflight.pop(tg_user, None))
+    # shield: отмена одного ожидающего не должна обрывать общий запрос
+    return await asyncio.shield(task)
+
+
+async def _refresh(tg_user: int) -> str | None:
+    # перечитываем строку: токен мог обновить другой процесс
+    row = await _load(tg_user)
+    if not row:
+        return None
+    access_token, refresh_token, expires_at = row
+    now = time.time()
+    if expires_at - now > REFRESH_MARGIN:
+        return access_token
+    if _retry_after.get(tg_user, 0) > now:
+        return access_token if expires_at > now else None
+    try:
+        tokens = await hh_client.refresh_access_token(refresh_token)
+    except httpx.HTTPStatusError as e:
+        if "token not expired" in e.response.text:
+            # HH не выдаёт новую пару, пока старый access_token жив:
+            # следующая попытка — не раньше истечения
+            _retry_after[tg_user] = max(expires_at, time.time() + 1)
+            return access_token
+        if _is_invalid_grant(e.response):
+            # refresh_token отозван или уже использован — повтор не поможет,
+            # пользователю нужно заново пройти OAuth
+            await _forget_tokens(tg_user, refresh_token)
+            logger.warning("Refresh-токен %s отозван HH, токены удалены: %s", tg_user, e.response.text)
+            return None
+        _retry_after[tg_user] = time.time() + REFRESH_RETRY_DELAY
+        logger.warning("Не удалось обновить токен %s: %s", tg_user, e.response.text)
+        return None
+    except httpx.HTTPError as e:
+        _retry_after[tg_user] = time.time() + REFRESH_RETRY_DELAY
+        logger.warning("Сетевая ошибка при обновлении токена %s: %s", tg_user, e)
+        return None
+    await save_tokens(tg_user, tokens, refresh_token)
+    _retry_after.pop(tg_user, None)
+    return tokens.get("access_token")
+
+
+def _is_invalid_grant(response: httpx.Response) -> bool:
+    try:
+        return response.json().get("error") == "invalid_grant"
+    except ValueError:
+        return False
+
+
+async def _forget_tokens(tg_user: int, refresh_token: str | None) -> None:
+    """Удаляет пару токенов, если её не успел обновить другой процесс."""
+    await storage.execute(
+        "DELETE FROM user_tokens WHERE tg_user = ? AND refresh_token IS ?",
+        (tg_user, refresh_token),
+    )
+    _retry_after.pop(tg_user, None)
+
+
+def _prune_retry_after() -> None:
+    """Забывает истёкшие паузы, чтобы словарь не рос с числом пользователей."""
+    now = time.time()
+    for uid in [uid for uid, until in _retry_after.items() if until <= now]:
+        del _retry_after[uid]
+
+
+async def refresh_expiring_tokens(batch: int = REFRESH_BATCH) -> int:
+    """
+    Обновляет ближайшие к истечению токены (по индексу expires_at)
+    с ограниченной параллельностью; возвращает число обновлённых.
+    """
+    now = time.time()
+    rows = await storage.fetchall(
+        """
+        SELECT tg_user FROM user_tokens
+        WHERE expires_at < ? AND expires_at > ?
+        ORDER BY expires_at
+        LIMIT ?
+        """,
+        (now + REFRESH_MARGIN, now - REFRESH_GIVE_UP_AFTER, batch),
+    )
+    due = [uid for (uid,) in rows if _retry_after.get(uid, 0) <= now]
+    sem = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+    async def _one(uid: int) -> bool:
+        async with sem:
+            return bool(await refresh_user_token(uid))
+
+    results = await asyncio.gather(*(_one(uid) for uid in due))
+    return sum(results)
+
+
+async def _refresher_loop(interval: float) -> None:
+    while True:
+        _prune_retry_after()
+        try:
+            refreshed = await refresh_expiring_tokens()
+            if refreshed:
+                logger.info("Обновлено токенов HH: %d", refreshed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка фонового обновления токенов")
+        await asyncio.sleep(interval)
+
+
+def start_refresher(interval: float = REFRESH_INTERVAL) -> asyncio.Task:
+    """Запускает фоновое упреждающее обновление токенов."""
+    global _refresher_task
+    if _refresher_task is None or _refresher_task.done():
+        _refresher_task = asyncio.create_task(_refresher_loop(interval))
+    return _refresher_task
+
+
+async def stop_refresher() -> None:
+    global _refresher_task
+    if _refresher_task is None:
+        return
+    _refresher_task.cancel()
+    try:
+        await _refresher_task
+    except asyncio.CancelledError:
+        pass
+    _refresher_task = None
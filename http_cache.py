@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import aiosqlite
+import httpx
+
+# Дисковый кэш GET-ответов HH (отдельный файл, чтобы не нагружать основную БД)
+HH_CACHE_PATH = os.getenv("HH_CACHE_PATH", "hh_cache.db")
+HH_CACHE_MAX_BYTES = int(os.getenv("HH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+# заголовки, которые не хранятся: тело лежит в кэше уже распакованным
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+def _cache_control(headers: httpx.Headers) -> dict[str, Optional[str]]:
+    directives: dict[str, Optional[str]] = {}
+    for part in headers.get("cache-control", "").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        directives[name] = value.strip('"') or None
+    return directives
+
+
+def _freshness(headers: httpx.Headers, now: float) -> Optional[float]:
+    """
+    Момент, до которого ответ свежий; None — ответ нельзя хранить.
+    Возврат now означает «хранить, но каждый раз перепроверять».
+    """
+    cc = _cache_control(headers)
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return now
+    if cc.get("max-age"):
+        try:
+            return now + max(0, int(cc["max-age"]))
+        except ValueError:
+            pass
+    expires = headers.get("expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now
+    if "etag" in headers or "last-modified" in headers:
+        return now
+    return None
+
+
+def cache_key(request: httpx.Request) -> str:
+    """URL с упорядоченными параметрами + хэш токена для приватных ответов."""
+    url = request.url
+    params = sorted(url.params.multi_items())
+    key = f"{url.scheme}://{url.host}{url.path}?{httpx.QueryParams(params)}"
+    auth = request.headers.get("authorization")
+    if auth:
+        key += "#" + hashlib.sha256(auth.encode()).hexdigest()[:16]
+    return key
+
+
+class CacheStore:
+    """SQLite-хранилище ответов с LRU-вытеснением по суммарному размеру."""
+
+    def __init__(self, path: str = HH_CACHE_PATH, max_bytes: int = HH_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db: aiosqlite.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._size = 0
+
+    async def _conn(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.path, isolation_level=None)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=OFF")
+                    await db.execute("""
+                        CREATE TABLE IF NOT EXISTS http_cache (
+                            key         TEXT PRIMARY KEY,
+                            status      INTEGER NOT NULL,
+                            headers     TEXT    NOT NULL,
+                            body        BLOB    NOT NULL,
+                            expires_at  REAL    NOT NULL,
+                            accessed_at REAL    NOT NULL,
+                            size        INTEGER NOT NULL
+                        )
+                    """)
+                    await db.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_http_cache_accessed ON http_cache (accessed_at)"
+                    )
+                    async with db.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache") as cur:
+                        self._size = (await cur.fetchone())[0]
+                    self._db = db
+        return self._db
+
+    async def get(self, key: str) -> Optional[tuple]:
+        db = await self._conn()
+        async with db.execute(
+            "SELECT status, headers, body, expires_at FROM http_cache WHERE key = ?",
+            (key,),
+        ) as cur:
+            row = await cur.fetchone()
+        if row:
+            await db.execute(
+                "UPDATE http_cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return row
+
+    async def put(self, key: str, status: int, headers: list, body: bytes, expires_at: float) -> None:
+        db = await self._conn()
+        size = len(body) + len(key)
+        async with db.execute("SELECT size FROM http_cache WHERE key = ?", (key,)) as cur:
+            old = await cur.fetchone()
+        await db.execute(
+            "INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, status, json.dumps(headers), body, expires_at, time.time(), size),
+        )
+        self._size += size - (old[0] if old else 0)
+        if self._size > self.max_bytes:
+            await self._evict(db)
+
+    async def refresh(self, key: str, expires_at: float) -> None:
+        db = await self._conn()
+        await db.execute(
+            "UPDATE http_cache SET expires_at = ?, accessed_at = ? WHERE key = ?",
+            (expires_at, time.time(), key),
+        )
+
+    async def _evict(self, db: aiosqlite.Connection) -> None:
+        # освобождаем до 90% лимита, начиная с давно не читанных
+        target = int(self.max_bytes * 0.9)
+        async with db.execute(
+            "SELECT key, size FROM http_cache ORDER BY accessed_at"
+        ) as cur:
+            victims = []
+            async for key, size in cur:
+                if self._size <= target:
+                    break
+                victims.append((key,))
+                self._size -= size
+        await db.executemany("DELETE FROM http_cache WHERE key = ?", victims)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx с частным HTTP-кэшем для GET: свежий ответ отдаётся
+    без сети, устаревший перепроверяется через If-None-Match /
+    If-Modified-Since, и на 304 возвращается сохранённое тело.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, store: CacheStore | None = None):
+        self._inner = inner
+        self.store = store or CacheStore()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET" or "no-store" in request.headers.get("cache-control", ""):
+            return await self._inner.handle_async_request(request)
+
+        key = cache_key(request)
+        now = time.time()
+        try:
+            entry = await self.store.get(key)
+        except Exception as e:
+            logger.warning("HTTP cache read failed: %s", e)
+            entry = None
+
+        if entry:
+            status, raw_headers, body, expires_at = entry
+            headers = httpx.Headers(json.loads(raw_headers))
+            if expires_at > now:
+                self.hits += 1
+                return httpx.Response(status, headers=headers, content=body, request=request)
+            if "etag" in headers:
+                request.headers["If-None-Match"] = headers["etag"]
+            if "last-modified" in headers:
+                request.headers["If-Modified-Since"] = headers["last-modified"]
+
+        response = await self._inner.handle_async_request(request)
+
+        if entry and response.status_code == 304:
+            await response.aclose()
+            self.revalidated += 1
+            expires_at = _freshness(response.headers, now) or now
+            await self._safe(self.store.refresh(key, expires_at))
+            return httpx.Response(status, headers=headers, content=body, request=request)
+
+        self.misses += 1
+        if response.status_code != 200:
+            return response
+        expires_at = _freshness(response.headers, now)
+        if expires_at is None:
+            return response
+
+        # тело читаем целиком (уже распакованным): ответы HH — небольшие JSON
+        body = await response.aread()
+        stored = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _DROP_HEADERS]
+        await self._safe(self.store.put(key, response.status_code, stored, body, expires_at))
+        return httpx.Response(
+            response.status_code, headers=stored, content=body, request=request,
+            extensions=response.extensions,
+        )
+
+    async def _safe(self, op) -> None:
+        # кэш не должен ронять запрос к HH
+        try:
+            await op
+        except Exception as e:
+            logger.warning("HTTP cache write failed: %s", e)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+        await self.store.close()
@@ -0,0 +1,394 @@
+"""
+Нагрузочный тест вебхука бота: повторяет записанные апдейты (NDJSON из
+TG_CAPTURE_PATH, см. update_capture.py) или синтетические сценарии против
+локального tg_register.app, где Telegram и HH заменены заглушками
+(bench_fakes). Печатает p50/p95/p99 задержки, пропускную способность,
+долю ошибок и конкуренцию за SQLite (ожидание записи, глубина очереди
+писателя, ошибки «database is locked»).
+
+    python loadtest_webhook.py --synthetic 200 --rate 300
+    python loadtest_webhook.py --input updates.ndjson --multiple 10 --rate 500
+    python loadtest_webhook.py --input updates.ndjson --speed 5          # темп записи x5
+    python loadtest_webhook.py --synthetic 200 --rate 300 --competing-writers 2
+    python loadtest_webhook.py --input updates.ndjson --url http://127.0.0.1:8000 --token <TOKEN>
+
+Со --url апдейты уходят в уже запущенный uvicorn; заглушки и статистика
+SQLite тогда на стороне того процесса недоступны.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Iterator, Optional
+
+import httpx
+
+# Сдвиг id для копий при --multiple: псевдонимы update_capture занимают 48 бит
+COPY_USER_SHIFT = 1 << 48
+COPY_UPDATE_SHIFT = 1 << 40
+
+
+# ────────── апдейты ──────────
+
+def synthetic_script(multi_value: str) -> list[tuple[str, str]]:
+    """Типичный путь пользователя: меню, настройка фильтров, просмотр, подписка."""
+    return [
+        ("text", "/start"),
+        ("callback", "open_settings"),
+        ("callback", "filter_keyword"),
+        ("text", "python"),
+        ("callback", "filter_schedule"),
+        ("callback", f"schedule_suggest_{multi_value}"),
+        ("callback", "filter_salary"),
+        ("text", "150000"),
+        ("callback", "back_menu"),
+        ("callback", "show_filters"),
+        ("callback", "toggle_subscription"),
+        ("callback", "open_resumes"),
+    ]
+
+
+def synthetic_updates(users: int) -> list[dict]:
+    """Сценарии users пользователей, перемешанные по шагам (как в жизни)."""
+    from tg_updates import callback_update, text_update
+    import search_filters
+
+    script = synthetic_script(next(iter(search_filters.SCHEDULE_LABELS)))
+    updates = []
+    update_id = 1
+    for kind, value in script:
+        for uid in range(1, users + 1):
+            build = text_update if kind == "text" else callback_update
+            updates.append({"update": build(update_id, 10_000 + uid, value)})
+            update_id += 1
+    return updates
+
+
+def load_capture(path: str) -> list[dict]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
+
+
+def _shift_ids(value: Any, shift: int, parent: Optional[str] = None) -> Any:
+    if isinstance(value, list):
+        return [_shift_ids(v, shift, parent) for v in value]
+    if not isinstance(value, dict):
+        return value
+    out = {}
+    for key, item in value.items():
+        if key == "id" and parent in ("from", "chat", "user") and isinstance(item, int):
+            out[key] = item + shift
+        else:
+            out[key] = _shift_ids(item, shift, key)
+    return out
+
+
+def expand(records: list[dict], multiple: int) -> Iterator[tuple[float, dict]]:
+    """
+    (смещение от начала записи, апдейт); каждая запись повторяется
+    multiple раз от имени разных пользователей с другими update_id.
+    """
+    start = records[0].get("ts", 0) if records else 0
+    for record in records:
+        offset = record.get("ts", start) - start
+        for copy in range(multiple):
+            update = record["update"]
+            if copy:
+                update = _shift_ids(update, copy * COPY_USER_SHIFT)
+                update["update_id"] = update.get("update_id", 0) + copy * COPY_UPDATE_SHIFT
+            yield offset, update
+
+
+# ────────── конкуренция за SQLite ──────────
+
+class StorageProbe:
+    """
+    Оборачивает методы общего хранилища: время ожидания записи (очередь +
+    транзакция), глубина очереди писателя, ошибки «database is locked».
+    """
+
+    def __init__(self, storage_obj):
+        self.storage = storage_obj
+        self.write_waits: list[float] = []
+        self.locked = 0
+        self.write_errors = 0
+        self.max_queue = 0
+        self._write = storage_obj.write
+        self._fetchone = storage_obj.fetchone
+        self._fetchall = storage_obj.fetchall
+        storage_obj.write = self.write
+        storage_obj.fetchone = self._reader(self._fetchone)
+        storage_obj.fetchall = self._reader(self._fetchall)
+
+    def _note(self, e: Exception) -> None:
+        if "locked" in str(e) or "busy" in str(e):
+            self.locked += 1
+
+    async def write(self, fn):
+        queue = self.storage._queue
+        if queue is not None:
+            self.max_queue = max(self.max_queue, queue.qsize() + 1)
+        started = time.perf_counter()
+        try:
+            return await self._write(fn)
+        except Exception as e:
+            self.write_errors += 1
+            self._note(e)
+            raise
+        finally:
+            self.write_waits.append(time.perf_counter() - started)
+
+    def _reader(self, method):
+        async def wrapped(sql, params=()):
+            try:
+                return await method(sql, params)
+            except Exception as e:
+                self._note(e)
+                raise
+        return wrapped
+
+
+async def competing_writer(path: str, hold: float, interval: float, stop: asyncio.Event) -> int:
+    """
+    Отдельное соединение (как apply_worker или второй воркер uvicorn),
+    которое периодически держит блокировку записи hold секунд.
+    """
+    import aiosqlite
+
+    locked = 0
+    async with aiosqlite.connect(path, isolation_level=None) as db:
+        await db.execute("PRAGMA busy_timeout=5000")
+        while not stop.is_set():
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                await db.execute("UPDATE users SET settings_msg_id = settings_msg_id WHERE chat_id = -1")
+                await asyncio.sleep(hold)
+                await db.execute("COMMIT")
+            except Exception as e:
+                if "locked" in str(e):
+                    locked += 1
+                if db.in_transaction:
+                    await db.execute("ROLLBACK")
+            await asyncio.sleep(interval)
+    return locked
+
+
+# ────────── прогон ──────────
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+async def replay(
+    client: httpx.AsyncClient,
+    path: str,
+    plan: list[tuple[float, dict]],
+    rate: float,
+    speed: float,
+    concurrency: int,
+) -> tuple[list[float], int, dict[str, int], float]:
+    """
+    Отправляет апдейты по расписанию (открытая модель: задержка считается
+    от запланированного момента, а не от фактической отправки) или, при
+    rate=0 и speed=0, так быстро, как успевает concurrency клиентов.
+    """
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _send(due: float, update: dict) -> None:
+        try:
+            resp = await client.post(path, json=update)
+            if resp.status_code != 200:
+                errors[str(resp.status_code)] = errors.get(str(resp.status_code), 0) + 1
+        except Exception as e:
+            name = type(e).__name__
+            errors[name] = errors.get(name, 0) + 1
+        finally:
+            latencies.append(time.perf_counter() - due)
+            sem.release()
+
+    started = time.perf_counter()
+    tasks = []
+    for i, (offset, update) in enumerate(plan):
+        if rate > 0:
+            due = started + i / rate
+        elif speed > 0:
+            due = started + offset / speed
+        else:
+            due = None
+        if due is not None:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await sem.acquire()
+        tasks.append(asyncio.create_task(_send(due or time.perf_counter(), update)))
+    await asyncio.gather(*tasks)
+    return latencies, len(plan), errors, time.perf_counter() - started
+
+
+def configure_env(args) -> None:
+    """Переменные, которые модули бота читают при импорте."""
+    if not args.db:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="hh-load-"), "load.db")
+    os.environ["TG_DB_PATH"] = args.db
+    os.environ.setdefault("TG_BOT_TOKEN", "1:loadtest")
+    os.environ.setdefault("HH_AREAS_CACHE", os.path.join(os.path.dirname(args.db), "areas.json"))
+    os.environ["HH_CACHE"] = "0"
+    os.environ["SUBSCRIPTIONS"] = "0"
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ.pop("TG_CAPTURE_PATH", None)
+    os.environ["WEBHOOK_ASYNC"] = "1" if args.async_webhook else "0"
+    os.environ["WEBHOOK_WORKERS"] = str(args.workers)
+    os.environ["WEBHOOK_QUEUE_SIZE"] = str(max(1000, args.concurrency))
+    # лимиты HH ограничивали бы тест, а не бота: заглушка их не требует
+    for name in ("HH_RATE_LIMIT", "HH_RATE_BURST", "HH_USER_RATE_LIMIT", "HH_USER_RATE_BURST"):
+        os.environ.setdefault(name, "1000000")
+
+
+async def run(args) -> dict:
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    probe = None
+    writers: list[asyncio.Task] = []
+    stop = asyncio.Event()
+
+    if args.url:
+        token = args.token or os.getenv("TG_BOT_TOKEN", "")
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        records = load_capture(args.input) if args.input else synthetic_updates(args.synthetic)
+    else:
+        configure_env(args)
+        # модули бота импортируются после настройки окружения
+        import hh_api
+        import storage
+        import tg_register
+        from bench_fakes import FakeHH, FakeTelegramSession
+
+        logging.getLogger().setLevel(logging.WARNING)
+        fake_hh = FakeHH(latency=args.hh_latency / 1000)
+        hh_api._http = httpx.AsyncClient(base_url=hh_api.HHApiClient.BASE_URL, transport=fake_hh.transport())
+        tg_register.bot.session = FakeTelegramSession(latency=args.tg_latency / 1000)
+        await tg_register._startup()
+        probe = StorageProbe(storage.storage)
+        for _ in range(args.competing_writers):
+            writers.append(asyncio.create_task(
+                competing_writer(args.db, args.hold / 1000, args.interval / 1000, stop)
+            ))
+        token = tg_register.BOT_TOKEN
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=tg_register.app, raise_app_exceptions=False),
+            base_url="http://loadtest",
+            timeout=args.timeout,
+        )
+        records = load_capture(args.input) if args.input else synthetic_updates(args.synthetic)
+
+    plan = list(expand(records, args.multiple))
+    if args.limit:
+        plan = plan[:args.limit]
+    try:
+        latencies, sent, errors, elapsed = await replay(
+            client, f"/bot{token}", plan, args.rate, args.speed, args.concurrency
+        )
+    finally:
+        await client.aclose()
+        stop.set()
+        external_locked = sum(await asyncio.gather(*writers)) if writers else 0
+        if not args.url:
+            await tg_register._shutdown()
+
+    report: dict[str, Any] = {
+        "updates": sent,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(sent / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        "error_rate": round(sum(errors.values()) / sent, 4) if sent else 0.0,
+        "errors": errors,
+    }
+    if probe is not None:
+        report["sqlite"] = {
+            "writes": len(probe.write_waits),
+            "write_wait_p50_ms": round(percentile(probe.write_waits, 50) * 1000, 2),
+            "write_wait_p99_ms": round(percentile(probe.write_waits, 99) * 1000, 2),
+            "writer_queue_max": probe.max_queue,
+            "write_errors": probe.write_errors,
+            "locked_errors": probe.locked,
+            "competing_writer_locked": external_locked,
+        }
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"updates         {report['updates']} за {report['elapsed_s']} с",
+        f"throughput      {report['throughput_rps']} апдейтов/с",
+        f"latency ms      p50 {report['p50_ms']}  p95 {report['p95_ms']}  "
+        f"p99 {report['p99_ms']}  max {report['max_ms']}",
+        f"error rate      {report['error_rate']:.2%} {report['errors'] or ''}",
+    ]
+    db = report.get("sqlite")
+    if db:
+        lines += [
+            f"sqlite writes   {db['writes']}, ожидание p50 {db['write_wait_p50_ms']} мс, "
+            f"p99 {db['write_wait_p99_ms']} мс, очередь писателя до {db['writer_queue_max']}",
+            f"sqlite locked   {db['locked_errors']} (ошибок записи {db['write_errors']}, "
+            f"у конкурирующих писателей {db['competing_writer_locked']})",
+        ]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="NDJSON с записанными апдейтами")
+    source.add_argument("--synthetic", type=int, metavar="USERS",
+                        help="синтетические сценарии для USERS пользователей")
+    parser.add_argument("--multiple", type=int, default=1, help="повторить каждый апдейт от N пользователей")
+    parser.add_argument("--rate", type=float, default=0.0, help="апдейтов в секунду (0 — см. --speed)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="темп записи, ускоренный в N раз (0 и --rate 0 — без пауз)")
+    parser.add_argument("--concurrency", type=int, default=256, help="максимум запросов в полёте")
+    parser.add_argument("--limit", type=int, default=0, help="не больше N апдейтов")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEBHOOK_WORKERS", "8")),
+                        help="WEBHOOK_WORKERS локального бота")
+    parser.add_argument("--async-webhook", action="store_true", help="WEBHOOK_ASYNC=1: ответ до обработки")
+    parser.add_argument("--tg-latency", type=float, default=30.0, help="задержка заглушки Telegram, мс")
+    parser.add_argument("--hh-latency", type=float, default=50.0, help="задержка заглушки HH, мс")
+    parser.add_argument("--db", help="файл SQLite (по умолчанию — новый во временном каталоге)")
+    parser.add_argument("--competing-writers", type=int, default=0,
+                        help="сторонних соединений, периодически держащих блокировку записи")
+    parser.add_argument("--hold", type=float, default=50.0, help="сколько держать блокировку, мс")
+    parser.add_argument("--interval", type=float, default=100.0, help="пауза между блокировками, мс")
+    parser.add_argument("--url", help="адрес запущенного бота вместо локального приложения")
+    parser.add_argument("--token", help="токен в пути вебхука для --url")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,35 @@
 import os
 from dotenv import load_dotenv
 load_dotenv()
+import asyncio
 import logging
-import time
-import aiosqlite
-from fastapi import FastAPI, Request, HTTPException
+import json
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import StreamingResponse
+import hh_api
 from hh_api import HHApiClient
-from chatgpt_client import ChatGPTClient
 from aiogram import Bot
+import storage
+import metrics
+import tracing
+import migrate_settings
+import sessions
+import hh_tokens
+import apply_worker
+import search_filters
+from settings_utils import get_user_setting, get_user_settings
+import cover_letters
+import resume_utils
+import httpx
+from hh_tokens import get_user_token
 
 # Настройки из переменных окружения
 CLIENT_ID = os.getenv("HH_CLIENT_ID")
 CLIENT_SECRET = os.getenv("HH_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
+# Что искать, если ни в запросе, ни в настройках нет ключевого слова
+SEARCH_DEFAULT_TEXT = os.getenv("SEARCH_DEFAULT_TEXT", "python")
 
 # Логирование
 logging.basicConfig(level=logging.INFO)
@@ -21,21 +37,42 @@ logger = logging.getLogger(__name__)
 
 # Инициализация FastAPI и клиентов
 app = FastAPI()
+metrics.instrument_app(app, "api")
 hh_client = HHApiClient()
-chatgpt_client = ChatGPTClient()
 
-# Путь к SQLite
-DB_PATH = "tg_users.db"
 
-async def get_user_token(tg_user: int) -> str | None:
-    """Возвращает access_token для указанного tg_user из БД или None."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT access_token FROM user_tokens WHERE tg_user = ?",
-            (tg_user,),
+@app.on_event("startup")
+async def _startup():
+    await storage.init_db()
+    await migrate_settings.migrate()
+    await hh_api.open_pool()
+    # настройки пишет бот; здесь они только читаются — без устаревшего кэша
+    sessions.read_through()
+    if os.getenv("HH_TOKEN_REFRESHER", "1") == "1":
+        hh_tokens.start_refresher()
+    if os.getenv("APPLY_WORKER", "1") == "1":
+        apply_worker.start_worker()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await apply_worker.stop_worker()
+    await hh_tokens.stop_refresher()
+    await hh_api.close_pool()
+    await storage.close_db()
+
+
+def _hh_error(e: Exception, detail: str) -> HTTPException:
+    """429 от HH отдаём клиенту как есть (с Retry-After), остальное — 500."""
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+        retry_after = e.response.headers.get("retry-after")
+        return HTTPException(
+            429,
+            "HH API rate limit",
+            headers={"Retry-After": retry_after} if retry_after else None,
         )
-        row = await cur.fetchone()
-    return row[0] if row else None
+    return HTTPException(500, detail)
+
 
 @app.get("/")
 async def root(tg_user: int):
@@ -59,25 +96,13 @@ async def callback(code: str, state: str):
         raise HTTPException(500, "Failed to exchange code for token")
 
     tg_user = int(state)
-    expires_at = int(time.time()) + tokens.get("expires_in", 0)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT OR REPLACE INTO user_tokens
-                (tg_user, access_token, refresh_token, expires_at)
-            VALUES (?, ?, ?, ?)
-            """,
-            (
-                tg_user,
-                tokens.get("access_token"),
-                tokens.get("refresh_token"),
-                expires_at,
-            ),
-        )
-        await db.commit()
+    await hh_tokens.save_tokens(tg_user, tokens)
+    # новый вход (возможно, другой аккаунт): меню резюме откроется уже из кэша
+    await resume_utils.warm_resumes(tg_user, tokens.get("access_token"))
 
     # Уведомление пользователя в Telegram
     bot = Bot(token=BOT_TOKEN)
+    metrics.instrument_bot(bot)
     try:
         await bot.send_message(
             tg_user,
@@ -91,20 +116,72 @@ async def callback(code: str, state: str):
     return {"ok": True}
 
 @app.get("/search")
-async def search(tg_user: int, text: str = "python", per_page: int = 10):
-    """Ищет вакансии через HH API для указанного пользователя."""
+async def search(
+    tg_user: int,
+    text: str | None = None,
+    per_page: int = 10,
+    page: int = 0,
+    stream: bool = False,
+):
+    """
+    Ищет вакансии через HH API по фильтрам пользователя из бота
+    (text, если передан, заменяет ключевое слово из настроек; без
+    ключевого слова ищется SEARCH_DEFAULT_TEXT, а не вся выдача HH).
+    Одинаковые фильтры разных пользователей обслуживает общий кэш.
+    С stream=true проходит все страницы и отдаёт NDJSON по мере загрузки.
+
+    Оба режима ищут анонимно (выдача не зависит от токена, лимит HH —
+    по tg_user); сохранённый токен нужен только как признак подключения.
+    Настройки, которым нет значения HH, в поиске не участвуют: они
+    пишутся в лог и возвращаются в skipped_filters (кроме потока).
+    """
     token = await get_user_token(tg_user)
     if not token:
         raise HTTPException(401, "No token stored for user")
-    client = HHApiClient(token)
+    skipped: list[str] = []
+    params = await search_filters.compile_filters(await get_user_settings(tg_user), text, skipped)
+    params.setdefault("text", SEARCH_DEFAULT_TEXT)
+    if stream:
+        return await _search_stream(params, tg_user)
     try:
-        vacancies = await client.search_vacancies(text=text, per_page=per_page)
+        data = await search_filters.search(params, page=page, per_page=per_page, limit_key=tg_user)
     except Exception as e:
         logger.error("HH API error при поиске: %s", e)
-        raise HTTPException(500, "HH API error")
-    finally:
-        await client.close()
-    return {"vacancies": vacancies}
+        raise _hh_error(e, "HH API error")
+    return {
+        "vacancies": data.get("items", []),
+        "found": data.get("found", 0),
+        "skipped_filters": skipped,
+    }
+
+async def _search_stream(params: dict, tg_user: int) -> StreamingResponse:
+    """NDJSON-ответ: одна вакансия на строку, страницы идут параллельно."""
+    filters = dict(params)
+    text = filters.pop("text", None)
+    vacancies = hh_client.iter_vacancies(text=text, limit_key=tg_user, **filters)
+    # первую страницу ждём до ответа, чтобы ошибка HH стала обычным HTTP-статусом
+    try:
+        first = await anext(vacancies)
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        logger.error("HH API error при поиске: %s", e)
+        raise _hh_error(e, "HH API error")
+
+    async def lines():
+        try:
+            if first is None:
+                return
+            yield json.dumps(first, ensure_ascii=False) + "\n"
+            async for vacancy in vacancies:
+                yield json.dumps(vacancy, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error("HH API error при потоковом поиске: %s", e)
+            yield json.dumps({"error": "HH API error"}) + "\n"
+        finally:
+            await vacancies.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.get("/resumes")
 async def resumes(tg_user: int):
@@ -112,35 +189,71 @@ async def resumes(tg_user: int):
     token = await get_user_token(tg_user)
     if not token:
         raise HTTPException(401, "No token stored for user")
-    client = HHApiClient(token)
     try:
-        resumes = await client.list_resumes()
+        resumes = await hh_client.list_resumes(token=token)
     except Exception as e:
         logger.error("HH API error при получении резюме: %s", e)
-        raise HTTPException(500, "HH API error on resumes")
-    finally:
-        await client.close()
+        raise _hh_error(e, "HH API error on resumes")
     return {"resumes": resumes}
 
 @app.post("/auto_reply")
 async def auto_reply(tg_user: int, vacancy_id: str, resume_id: str):
-    """Генерирует сопроводительное письмо через ChatGPT и отправляет отклик."""
+    """Генерирует (или берёт готовое) сопроводительное письмо и отправляет отклик."""
     token = await get_user_token(tg_user)
     if not token:
         raise HTTPException(401, "No token stored for user")
+    prompt = await get_user_setting(tg_user, "prompt")
     try:
-        cover_letter = await chatgpt_client.generate_cover_letter(vacancy_id, resume_id)
+        cover_letter = await cover_letters.get_cover_letter(
+            vacancy_id, resume_id, prompt, token=token
+        )
     except Exception as e:
         logger.error("ChatGPT error при генерации сопроводительного письма: %s", e)
         raise HTTPException(500, "ChatGPT generation error")
-    client = HHApiClient(token)
     try:
-        result = await client.respond_to_vacancy(
-            vacancy_id, resume_id, cover_letter
+        result = await hh_client.respond_to_vacancy(
+            vacancy_id, resume_id, cover_letter, token=token
         )
     except Exception as e:
         logger.error("HH API error при отправке отклика: %s", e)
-        raise HTTPException(500, "HH API respond error")
-    finally:
-        await client.close()
-    return {"result": result}
\ No newline at end of file
+        raise _hh_error(e, "HH API respond error")
+    return {"result": result}
+
+@app.post("/queue")
+async def queue_applications(
+    tg_user: int,
+    vacancy_ids: list[str] = Query(...),
+    resume_id: str | None = None,
+):
+    """Ставит вакансии в очередь автооткликов; их обработает apply_worker."""
+    token = await get_user_token(tg_user)
+    if not token:
+        raise HTTPException(401, "No token stored for user")
+    queued = await apply_worker.enqueue(tg_user, vacancy_ids, resume_id)
+    # письма генерируются заранее и параллельно — воркер возьмёт готовые
+    _warm_letters(tg_user, vacancy_ids, resume_id, token)
+    return {"queued": queued}
+
+
+# ссылки на фоновые задачи, чтобы их не собрал GC
+_background: set[asyncio.Task] = set()
+
+
+def _background_done(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.exception("Ошибка фоновой генерации писем", exc_info=task.exception())
+
+
+def _warm_letters(tg_user: int, vacancy_ids: list[str], resume_id: str | None, token: str) -> None:
+    async def _warm():
+        resume = resume_id or await get_user_setting(tg_user, "resume")
+        if not resume:
+            return
+        prompt = await get_user_setting(tg_user, "prompt")
+        await cover_letters.generate_batch(vacancy_ids, resume, prompt, token=token)
+
+    with tracing.detached():
+        task = asyncio.create_task(_warm())
+    _background.add(task)
+    task.add_done_callback(_background_done)
@@ -0,0 +1,345 @@
+import os
+import re
+import time
+import bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+# Если задан — /metrics требует заголовок Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# значения меток в порядке, заданном при создании метрики
+LabelValues = tuple[str, ...]
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# ────────── метрики ──────────
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Mapping[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонный счётчик с метками: counter.inc(method="GET")."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Текущее значение: gauge.set(3)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма в формате Prometheus: накопительные корзины, _sum и _count.
+    histogram.observe(0.12, endpoint="/vacancies")
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._values: dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric(_Metric):
+    """
+    Значения читаются в момент выдачи /metrics из функций-источников —
+    для счётчиков, которые модули уже ведут сами (hits/misses кэшей).
+    Источник возвращает число или {значения меток: число}.
+    """
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self._sources: list[Callable[[], Any]] = []
+
+    def add_source(self, fn: Callable[[], Any]) -> None:
+        self._sources.append(fn)
+
+    def samples(self) -> Iterator[str]:
+        for fn in self._sources:
+            try:
+                values = fn()
+            except Exception:
+                continue
+            if not isinstance(values, Mapping):
+                values = {(): values}
+            for key, value in values.items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def get_or_create(self, cls, name: str, *args, **kwargs):
+        # повторный импорт модуля (тесты, reload) получает ту же метрику
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+    return REGISTRY.get_or_create(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+    return REGISTRY.get_or_create(Gauge, name, help, labels)
+
+
+def histogram(name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.get_or_create(Histogram, name, help, labels, buckets)
+
+
+def callback(name: str, help: str, fn: Callable[[], Any], labels: Iterable[str] = (), kind: str = "gauge") -> CallbackMetric:
+    metric = REGISTRY.get_or_create(CallbackMetric, name, help, labels, kind)
+    metric.add_source(fn)
+    return metric
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ────────── кэши ──────────
+
+CACHE_REQUESTS = REGISTRY.get_or_create(
+    CallbackMetric, "cache_requests_total", "Обращения к кэшам по результату", ("cache", "result"), "counter"
+)
+
+
+def observe_cache(cache: str, fn: Callable[[], Mapping[str, float]]) -> None:
+    """Регистрирует кэш: fn() -> {"hit": n, "miss": m, ...} — накопленные счётчики модуля."""
+    CACHE_REQUESTS.add_source(lambda: {(cache, result): n for result, n in fn().items()})
+
+
+# ────────── SQLite ──────────
+
+SQLITE_SECONDS = histogram(
+    "sqlite_query_seconds", "Время обращений к SQLite (запись — с ожиданием очереди писателя)", ("op",)
+)
+# число обращений к SQLite в текущем апдейте (см. count_queries)
+_queries: ContextVar[Optional[list]] = ContextVar("metrics_queries", default=None)
+
+
+def observe_query(op: str, seconds: float) -> None:
+    SQLITE_SECONDS.observe(seconds, op=op)
+    box = _queries.get()
+    if box is not None:
+        box[0] += 1
+
+
+@contextmanager
+def count_queries() -> Iterator[list]:
+    """Считает обращения к SQLite внутри блока (в этой задаче): box[0]."""
+    box = [0]
+    token = _queries.set(box)
+    try:
+        yield box
+    finally:
+        _queries.reset(token)
+
+
+# ────────── HH ──────────
+
+def endpoint_label(url: str) -> str:
+    """Путь запроса без хоста и id: /vacancies/123 -> /vacancies/{id}."""
+    path = url.split("://", 1)[1].split("/", 1)[-1] if "://" in url else url.lstrip("/")
+    path = "/" + path.split("?", 1)[0]
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+# ────────── Telegram ──────────
+
+TELEGRAM_SECONDS = histogram(
+    "telegram_request_seconds", "Время запросов к Telegram Bot API", ("method", "result")
+)
+TELEGRAM_FLOOD = counter(
+    "telegram_flood_wait_total", "Ответы Telegram с flood control (RetryAfter)", ("method",)
+)
+TELEGRAM_FLOOD_SECONDS = counter(
+    "telegram_flood_wait_seconds_total", "Сколько секунд ожидания запросил Telegram", ("method",)
+)
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Middleware сессии aiogram: время и исход каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        result = "ok"
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            result = "flood"
+            TELEGRAM_FLOOD.inc(method=name)
+            TELEGRAM_FLOOD_SECONDS.inc(e.retry_after, method=name)
+            raise
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=name, result=result)
+
+
+def instrument_bot(bot) -> None:
+    """Подключает TelegramMetrics к сессии бота (один раз)."""
+    if not any(isinstance(m, TelegramMetrics) for m in bot.session.middleware):
+        bot.session.middleware(TelegramMetrics())
+
+
+# ────────── HTTP ──────────
+
+HTTP_SECONDS = histogram(
+    "http_request_seconds", "Время обработки HTTP-запросов приложением", ("app", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время запроса по имени обработчика, а не по пути —
+    в пути вебхука токен бота, а в путях бывают id.
+    """
+
+    def __init__(self, app, app_name: str):
+        self.app = app
+        self.app_name = app_name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        started = time.perf_counter()
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - started, app=self.app_name, route=route, status=status)
+
+
+def instrument_app(app: FastAPI, app_name: str) -> None:
+    """Добавляет приложению замер запросов и эндпоинт /metrics."""
+    app.add_middleware(MetricsMiddleware, app_name=app_name)
+
+    async def metrics_endpoint(request: Request) -> PlainTextResponse:
+        if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+            raise HTTPException(status_code=403, detail="Invalid token")
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
@@ -1,13 +1,29 @@
 import asyncio
+import logging
+from typing import Awaitable, Callable
+
 import aiosqlite
 
-# Путь к файлу базы данных
-DB_PATH = "tg_users.db"
+import storage
 
-async def upgrade(db: aiosqlite.Connection):
-    """
-    Создаёт таблицы users, user_tokens, queues и user_settings, если они не существуют.
-    """
+logger = logging.getLogger(__name__)
+
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, decl: str):
+    """Добавляет колонку, если её ещё нет (ALTER TABLE не знает IF NOT EXISTS)."""
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        columns = {row[1] for row in await cur.fetchall()}
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Миграции идемпотентны (IF NOT EXISTS / _add_column): базы, созданные
+# до появления user_version, могут уже содержать часть схемы.
+
+async def _m001_base(db: aiosqlite.Connection):
+    """Таблицы users, user_tokens, queues и user_settings."""
     # Таблица пользователей Telegram
     await db.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -45,14 +61,187 @@ async def upgrade(db: aiosqlite.Connection):
         );
     """)
 
-    # Сохраняем изменения
-    await db.commit()
+
+async def _m002_settings_msg_id(db: aiosqlite.Connection):
+    """id сообщения с меню/настройками, которое бот редактирует."""
+    await _add_column(db, "users", "settings_msg_id", "INTEGER")
+
+
+async def _m003_queue_leases(db: aiosqlite.Connection):
+    """Состояние откликов: lease/ack для воркера apply_worker."""
+    await _add_column(db, "queues", "resume_id", "TEXT")
+    await _add_column(db, "queues", "status", "TEXT NOT NULL DEFAULT 'pending'")
+    await _add_column(db, "queues", "attempts", "INTEGER NOT NULL DEFAULT 0")
+    await _add_column(db, "queues", "available_at", "INTEGER NOT NULL DEFAULT 0")
+    await _add_column(db, "queues", "lease_owner", "TEXT")
+    await _add_column(db, "queues", "lease_until", "INTEGER")
+    await _add_column(db, "queues", "last_error", "TEXT")
+    await _add_column(db, "queues", "updated_at", "INTEGER")
+
+
+async def _m004_broadcasts(db: aiosqlite.Connection):
+    """Рассылки tg_bridge с курсором прогресса."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            text         TEXT    NOT NULL,
+            created_at   INTEGER NOT NULL,
+            last_chat_id INTEGER NOT NULL DEFAULT 0,
+            sent         INTEGER NOT NULL DEFAULT 0,
+            failed       INTEGER NOT NULL DEFAULT 0,
+            finished_at  INTEGER
+        );
+    """)
+
+
+async def _m005_seen_updates(db: aiosqlite.Connection):
+    """update_id, уже принятые вебхуком (дедупликация между воркерами)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS seen_updates (
+            update_id INTEGER PRIMARY KEY,
+            seen_at   INTEGER NOT NULL
+        );
+    """)
+
+
+async def _m006_indexes(db: aiosqlite.Connection):
+    """Индексы под горячие запросы."""
+    # Фоновое обновление токенов выбирает их по сроку истечения
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_tokens_expires_at
+            ON user_tokens (expires_at);
+    """)
+    # claim() воркера: ожидающие по available_at и просроченные аренды
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_queues_status_available
+            ON queues (status, available_at);
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_queues_status_lease
+            ON queues (status, lease_until);
+    """)
+    # очередь конкретного пользователя в порядке добавления
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_queues_user_created
+            ON queues (tg_user, created_at);
+    """)
+    # чистка seen_updates по возрасту
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_seen_updates_seen_at
+            ON seen_updates (seen_at);
+    """)
+
+
+async def _m007_subscriptions(db: aiosqlite.Connection):
+    """Подписки на новые вакансии и уже отправленные пользователю вакансии."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            tg_user      INTEGER PRIMARY KEY,
+            created_at   INTEGER NOT NULL,
+            last_checked INTEGER NOT NULL
+        );
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS subscription_seen (
+            tg_user    INTEGER NOT NULL,
+            vacancy_id INTEGER NOT NULL,
+            seen_at    INTEGER NOT NULL,
+            PRIMARY KEY (tg_user, vacancy_id)
+        ) WITHOUT ROWID;
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_subscription_seen_seen_at
+            ON subscription_seen (seen_at);
+    """)
+
+
+async def _m008_cover_letters(db: aiosqlite.Connection):
+    """Сгенерированные сопроводительные письма (ключ — хэш вакансии, резюме и промпта)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS cover_letters (
+            key        TEXT PRIMARY KEY,
+            letter     TEXT    NOT NULL,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cover_letters_created_at
+            ON cover_letters (created_at);
+    """)
+
+
+async def _m009_resume_cache(db: aiosqlite.Connection):
+    """Кэш списка резюме пользователя (общий для бота и OAuth-сервиса)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS resume_cache (
+            tg_user    INTEGER PRIMARY KEY,
+            token_hash TEXT    NOT NULL,
+            resumes    TEXT    NOT NULL,
+            fetched_at INTEGER NOT NULL
+        );
+    """)
+
+
+async def _m010_job_leases(db: aiosqlite.Connection):
+    """Аренды периодических задач: один исполнитель на все процессы."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS job_leases (
+            name        TEXT PRIMARY KEY,
+            owner       TEXT    NOT NULL,
+            lease_until INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """)
+
+
+# Порядок менять нельзя: номер версии = позиция в списке.
+# Новые изменения схемы — только новыми функциями в конце.
+MIGRATIONS: list[Migration] = [
+    _m001_base,
+    _m002_settings_msg_id,
+    _m003_queue_leases,
+    _m004_broadcasts,
+    _m005_seen_updates,
+    _m006_indexes,
+    _m007_subscriptions,
+    _m008_cover_letters,
+    _m009_resume_cache,
+    _m010_job_leases,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def upgrade(db: aiosqlite.Connection) -> int:
+    """
+    Применяет миграции новее PRAGMA user_version и возвращает итоговую версию.
+    Не коммитит: транзакцией владеет вызывающий (storage.write).
+    """
+    async with db.execute("PRAGMA user_version") as cur:
+        (version,) = await cur.fetchone()
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Миграция %d: %s", number, migration.__doc__)
+        await migration(db)
+        await db.execute(f"PRAGMA user_version = {number}")
+    return max(version, SCHEMA_VERSION)
+
+
+async def migrate() -> int:
+    """
+    Приводит схему к актуальной версии через общий storage; вызывается
+    на старте приложений. Версия перечитывается внутри транзакции писателя,
+    поэтому одновременный старт нескольких процессов безопасен.
+    """
+    return await storage.write(upgrade)
+
 
 async def main():
     # Подключаемся и выполняем миграцию
-    async with aiosqlite.connect(DB_PATH) as db:
-        await upgrade(db)
-    print("Миграция успешно выполнена.")
+    await storage.init_db()
+    try:
+        version = await migrate()
+    finally:
+        await storage.close_db()
+    print(f"Миграция успешно выполнена (версия схемы {version}).")
 
 if __name__ == "__main__":
     asyncio.run(main())
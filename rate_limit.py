@@ -0,0 +1,144 @@
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """Классическое ведро токенов: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """Забирает токен; иначе возвращает, сколько секунд подождать."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give_back(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (например, после 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self.try_take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class FairLimiter:
+    """
+    Общий лимит запросов плюс лимит на каждый ключ (токен пользователя).
+    Ожидающие глобального токена обслуживаются по кругу между ключами,
+    поэтому пользователь с сотней запросов в очереди не задерживает
+    пользователя с одним.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        per_key_rate: float,
+        per_key_burst: float,
+        max_keys: int = 10000,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._waiters: "OrderedDict[Hashable, deque[asyncio.Future]]" = OrderedDict()
+        self._pump_task: asyncio.Task | None = None
+
+    def _key_bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._keys.get(key)
+        if bucket is None:
+            bucket = self._keys[key] = TokenBucket(self.per_key_rate, self.per_key_burst)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(key)
+        return bucket
+
+    async def acquire(self, key: Optional[Hashable] = None) -> None:
+        """key=None — только общий лимит (анонимные запросы)."""
+        if key is not None:
+            await self._key_bucket(key).acquire()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(fut)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # токены ушли бы впустую: ключевой возвращаем сразу, общий —
+            # тоже, если _pump успел его выдать (иначе вернёт сам _pump)
+            if key is not None:
+                self._key_bucket(key).give_back()
+            if fut.done() and not fut.cancelled():
+                self.bucket.give_back()
+            raise
+
+    async def _pump(self) -> None:
+        while self._waiters:
+            wait = self.bucket.try_take()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            key, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if fut.done():
+                # ожидающего отменили — токен возвращаем
+                self.bucket.give_back()
+                continue
+            fut.set_result(None)
+
+    def pause(self, seconds: float, key: Optional[Hashable] = None) -> None:
+        """Приостанавливает выдачу глобально или для одного ключа."""
+        if key is None:
+            self.bucket.pause(seconds)
+        else:
+            self._key_bucket(key).pause(seconds)
+
+
+def parse_retry_after(value: str | None) -> Optional[float]:
+    """Retry-After в секундах или HTTP-датой."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Экспоненциальная пауза с полным джиттером."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
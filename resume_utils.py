@@ -1,11 +1,41 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List
+
 import httpx
-import aiosqlite
+import storage
+import metrics
+import tracing
 from hh_api import HHApiClient
+from hh_tokens import get_user_token
 from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-DB_PATH = "tg_users.db"
+
+# клиент поверх общего пула соединений; токен передаётся в каждый вызов
+hh_client = HHApiClient()
+
+# Список резюме свежий RESUME_CACHE_TTL секунд; после — отдаётся сразу,
+# а обновляется в фоне (stale-while-revalidate), но не дольше RESUME_CACHE_MAX_STALE
+RESUME_CACHE_TTL = float(os.getenv("RESUME_CACHE_TTL", "300"))
+RESUME_CACHE_MAX_STALE = float(os.getenv("RESUME_CACHE_MAX_STALE", str(7 * 86400)))
+RESUME_CACHE_SIZE = int(os.getenv("RESUME_CACHE_SIZE", "4096"))
+
+logger = logging.getLogger(__name__)
+
+# tg_user -> (хэш токена, время загрузки, резюме)
+_cache: "OrderedDict[int, tuple[str, float, List[Dict[str, Any]]]]" = OrderedDict()
+_inflight: dict[int, asyncio.Task] = {}
+# ссылки на фоновые обновления, чтобы их не собрал GC
+_background: set[asyncio.Task] = set()
+hits = 0
+stale = 0
+misses = 0
 
 
 def build_oauth_url(tg_user: int) -> str:
@@ -16,16 +46,113 @@ def build_oauth_url(tg_user: int) -> str:
         f"&state={tg_user}"
     )
 
-async def get_user_token(tg_user: int) -> str | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT access_token FROM user_tokens WHERE tg_user = ?",
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def _remember(tg_user: int, entry: tuple) -> None:
+    _cache[tg_user] = entry
+    _cache.move_to_end(tg_user)
+    while len(_cache) > RESUME_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+@tracing.traced("resumes.fetch")
+async def _fetch(tg_user: int, token: str) -> List[Dict[str, Any]]:
+    resumes = await hh_client.list_resumes(token=token)
+    entry = (_token_hash(token), time.time(), resumes)
+    _remember(tg_user, entry)
+    await storage.execute(
+        "INSERT OR REPLACE INTO resume_cache (tg_user, token_hash, resumes, fetched_at) VALUES (?, ?, ?, ?)",
+        (tg_user, entry[0], json.dumps(resumes, ensure_ascii=False), int(entry[1])),
+    )
+    return resumes
+
+
+def _fetch_once(tg_user: int, token: str) -> "asyncio.Task[List[Dict[str, Any]]]":
+    task = _inflight.get(tg_user)
+    if task is None:
+        task = asyncio.create_task(_fetch(tg_user, token))
+        _inflight[tg_user] = task
+        task.add_done_callback(lambda _: _inflight.pop(tg_user, None))
+    return task
+
+
+def _revalidate(tg_user: int, token: str) -> None:
+    async def _run():
+        try:
+            await _fetch_once(tg_user, token)
+        except Exception as e:
+            logger.warning("Не удалось обновить резюме %s: %s", tg_user, e)
+
+    with tracing.detached():
+        task = asyncio.create_task(_run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+@tracing.traced("resumes.get_resumes")
+async def get_resumes(tg_user: int, token: str) -> List[Dict[str, Any]]:
+    """
+    Список резюме пользователя из памяти, затем из таблицы resume_cache
+    (её заполняет и OAuth-сервис сразу после входа). Устаревший список
+    отдаётся сразу и обновляется в фоне.
+
+    Запись под другим токеном: если строка в БД есть — это обновление
+    токена того же аккаунта, отдаём и перепроверяем; если строки нет —
+    её удалил повторный вход, и список загружается заново.
+    """
+    global hits, stale, misses
+    current = _token_hash(token)
+    entry = _cache.get(tg_user)
+    if entry is None or entry[0] != current:
+        row = await storage.fetchone(
+            "SELECT token_hash, fetched_at, resumes FROM resume_cache WHERE tg_user = ?",
             (tg_user,),
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
+        )
+        entry = (row[0], float(row[1]), json.loads(row[2])) if row else None
+        if entry is not None:
+            _remember(tg_user, entry)
+    if entry is None:
+        misses += 1
+        return await asyncio.shield(_fetch_once(tg_user, token))
+
+    _cache.move_to_end(tg_user)
+    token_hash, fetched_at, resumes = entry
+    age = time.time() - fetched_at
+    if age > RESUME_CACHE_MAX_STALE:
+        misses += 1
+        return await asyncio.shield(_fetch_once(tg_user, token))
+    if age > RESUME_CACHE_TTL or token_hash != current:
+        stale += 1
+        _revalidate(tg_user, token)
+    else:
+        hits += 1
+    return resumes
+
 
+async def invalidate_resumes(tg_user: int) -> None:
+    """Забывает список резюме (повторная авторизация, смена аккаунта)."""
+    _cache.pop(tg_user, None)
+    await storage.execute("DELETE FROM resume_cache WHERE tg_user = ?", (tg_user,))
 
+
+@tracing.traced("resumes.warm_resumes")
+async def warm_resumes(tg_user: int, token: str) -> None:
+    """Загружает список резюме заранее — сразу после входа через OAuth."""
+    await invalidate_resumes(tg_user)
+    try:
+        # не через _fetch_once: фоновое обновление могло идти со старым токеном
+        await _fetch(tg_user, token)
+    except httpx.HTTPError as e:
+        logger.warning("Не удалось заранее загрузить резюме %s: %s", tg_user, e)
+
+
+metrics.observe_cache("resumes", lambda: {"hit": hits, "stale": stale, "miss": misses})
+
+
+@tracing.traced("resumes.build_resume_keyboard")
 async def build_resume_keyboard(uid: int) -> types.InlineKeyboardMarkup:
     token = await get_user_token(uid)
     if not token:
@@ -36,11 +163,7 @@ async def build_resume_keyboard(uid: int) -> types.InlineKeyboardMarkup:
             )]]
         )
 
-    client = HHApiClient(token)
-    try:
-        resumes = await client.list_resumes()      # 200 OK мы уже видели
-    finally:
-        await client.close()
+    resumes = await get_resumes(uid, token)
 
     builder = InlineKeyboardBuilder()
     for r in resumes:
@@ -51,4 +174,4 @@ async def build_resume_keyboard(uid: int) -> types.InlineKeyboardMarkup:
 
     builder.button(text="⬅️ В меню", callback_data="back_menu")
     builder.adjust(1)               # каждая кнопка в своей строке
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
@@ -0,0 +1,247 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+import areas
+import hh_api
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Справочники HH меняются редко; при ошибке загрузки повторяем раньше
+HH_DICTIONARIES_TTL = float(os.getenv("HH_DICTIONARIES_TTL", "86400"))
+HH_DICTIONARIES_RETRY = 300.0
+# Общий кэш результатов поиска: одинаковые фильтры — один запрос к HH
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "120"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+
+# Подписи кнопок бота -> id справочника HH (запасной вариант, если
+# /dictionaries недоступен или подпись не совпала с названием в нём)
+SCHEDULE_LABELS = {
+    "полный день": "fullDay",
+    "гибкий график": "flexible",
+    "сменный график": "shift",
+}
+WORK_FORMAT_LABELS = {
+    "дистанционно": "REMOTE",
+    "офис": "ON_SITE",
+    "гибрид": "HYBRID",
+}
+EMPLOYMENT_LABELS = {
+    "полная": "full",
+    "частичная": "part",
+    "проектная": "project",
+    "стажировка": "probation",
+}
+
+# ключ в user_settings -> (параметр /vacancies, справочник /dictionaries, подписи)
+MULTI_FILTERS = {
+    "schedule": ("schedule", "schedule", SCHEDULE_LABELS),
+    "work_format": ("work_format", "work_format", WORK_FORMAT_LABELS),
+    "employment_type": ("employment", "employment", EMPLOYMENT_LABELS),
+}
+
+# ключ в user_settings -> {подпись: id или None, если HH такого не знает}
+LabelMap = Dict[str, Dict[str, Optional[str]]]
+
+_label_map: LabelMap | None = None
+_label_map_expires = 0.0
+_label_map_task: asyncio.Task | None = None
+
+_results: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+_inflight: dict[str, asyncio.Task] = {}
+hits = 0
+misses = 0
+
+
+# ────────── справочники ──────────
+
+def _match(label: str, items: list[dict]) -> Optional[str]:
+    """id элемента справочника, чьё название совпадает с подписью или начинается с неё."""
+    norm = areas.normalize(label)
+    for item in items:
+        name = areas.normalize(item.get("name", ""))
+        if name == norm or name.startswith(norm + " "):
+            return item.get("id")
+    return None
+
+
+def build_label_map(dictionaries: Dict[str, Any] | None) -> LabelMap:
+    """Сопоставляет подписи бота с id из ответа /dictionaries."""
+    mapping: LabelMap = {}
+    for setting, (_, dictionary, labels) in MULTI_FILTERS.items():
+        items = (dictionaries or {}).get(dictionary)
+        known = {item.get("id") for item in items} if items else None
+        mapping[setting] = {}
+        for label, fallback in labels.items():
+            value = _match(label, items) if items else None
+            if value is None and (known is None or fallback in known):
+                value = fallback
+            if value is None:
+                logger.warning("Нет значения HH для %s=%r", setting, label)
+            mapping[setting][label] = value
+    return mapping
+
+
+async def _load_label_map() -> LabelMap:
+    global _label_map, _label_map_expires
+    try:
+        dictionaries = await hh_api.fetch_dictionaries()
+        ttl = HH_DICTIONARIES_TTL
+    except Exception as e:
+        logger.warning("Справочники HH недоступны, используем встроенные: %s", e)
+        dictionaries = None
+        ttl = HH_DICTIONARIES_RETRY
+    _label_map = build_label_map(dictionaries)
+    _label_map_expires = time.monotonic() + ttl
+    return _label_map
+
+
+async def get_label_map() -> LabelMap:
+    global _label_map_task
+    if _label_map is not None and time.monotonic() < _label_map_expires:
+        return _label_map
+    if _label_map_task is None or _label_map_task.done():
+        _label_map_task = asyncio.create_task(_load_label_map())
+    return await asyncio.shield(_label_map_task)
+
+
+# ────────── компиляция фильтров ──────────
+
+def _split(value: Optional[str]) -> list[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def _skip(skipped: Optional[list[str]], setting: str, value: str) -> None:
+    logger.info("Фильтр %s=%r не сопоставлен с HH и пропущен", setting, value)
+    if skipped is not None:
+        skipped.append(f"{setting}={value}")
+
+
+def _area_id(region: Optional[str]) -> Optional[str]:
+    """region хранит id HH, либо текст, если подсказок не нашлось."""
+    if not region:
+        return None
+    if region.isdigit():
+        return region
+    found = areas.suggest(region, limit=1)
+    return found[0].id if found else None
+
+
+async def compile_filters(
+    settings: Dict[str, Optional[str]],
+    text: str | None = None,
+    skipped: Optional[list[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Переводит настройки пользователя в параметры GET /vacancies.
+    Значения нормализованы (мультизначения — отсортированные списки),
+    так что одинаковые фильтры дают одинаковые параметры.
+    Регион и подписи, которым нет значения HH, в запрос не попадают:
+    они пишутся в лог и, если передан skipped, добавляются туда
+    строками «настройка=значение».
+    """
+    params: Dict[str, Any] = {}
+    text = (text or settings.get("keyword") or "").strip()
+    if text:
+        params["text"] = text
+    region = settings.get("region")
+    area = _area_id(region)
+    if area:
+        params["area"] = area
+    elif region:
+        _skip(skipped, "region", region)
+    salary = (settings.get("salary") or "").strip()
+    if salary.isdigit():
+        params["salary"] = int(salary)
+
+    label_map = await get_label_map()
+    for setting, (param, _, _) in MULTI_FILTERS.items():
+        labels = label_map[setting]
+        ids = set()
+        for label in _split(settings.get(setting)):
+            value = labels.get(label)
+            if value is None:
+                _skip(skipped, setting, label)
+            else:
+                ids.add(value)
+        if ids:
+            params[param] = sorted(ids)
+    return params
+
+
+def canonical_key(params: Dict[str, Any]) -> str:
+    """Ключ кэша: отсортированная строка запроса."""
+    pairs = []
+    for key, value in params.items():
+        for v in (value if isinstance(value, (list, tuple)) else [value]):
+            pairs.append((key, str(v)))
+    return urlencode(sorted(pairs))
+
+
+# ────────── общий кэш результатов ──────────
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _results.get(key)
+    if entry is None:
+        return None
+    expires, data = entry
+    if time.monotonic() > expires:
+        del _results[key]
+        return None
+    _results.move_to_end(key)
+    return data
+
+
+def _cache_put(key: str, data: Dict[str, Any]) -> None:
+    _results[key] = (time.monotonic() + SEARCH_CACHE_TTL, data)
+    _results.move_to_end(key)
+    while len(_results) > SEARCH_CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+async def _fetch(key: str, params: Dict[str, Any], page: int, limit_key: Any) -> Dict[str, Any]:
+    data = await hh_api.search_public(params, page, limit_key=limit_key)
+    _cache_put(key, data)
+    return data
+
+
+async def search(
+    params: Dict[str, Any],
+    page: int = 0,
+    per_page: int = 20,
+    limit_key: Any = None,
+) -> Dict[str, Any]:
+    """
+    Страница поиска по скомпилированным фильтрам (items, found, pages).
+    Запрос анонимный, поэтому результат общий для всех пользователей:
+    повторы берутся из кэша, одновременные промахи ждут один запрос.
+    limit_key (id пользователя) — ключ лимитера HH для промаха.
+    Возвращаемый словарь общий — изменять его нельзя.
+    """
+    global hits, misses
+    query = {**params, "per_page": per_page}
+    key = canonical_key({**query, "page": page})
+    data = _cache_get(key)
+    if data is not None:
+        hits += 1
+        return data
+    misses += 1
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch(key, query, page, limit_key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: отмена одного ожидающего не должна обрывать общий запрос
+    return await asyncio.shield(task)
+
+
+def clear_cache() -> None:
+    _results.clear()
+
+
+metrics.observe_cache("search", lambda: {"hit": hits, "miss": misses})
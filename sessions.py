@@ -0,0 +1,328 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import aiosqlite
+
+import storage
+import metrics
+import tracing
+
+# Сколько держать в памяти сессию пользователя без обращений
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "300"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+# Сессия без несохранённых изменений перечитывается не реже этого
+# (процессы, которые только читают настройки, используют read_through())
+SESSION_MAX_AGE = float(os.getenv("SESSION_MAX_AGE", "300"))
+# Как часто изменения сессий сбрасываются в БД: при падении процесса
+# теряется не больше этого интервала
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+# Сессии бота живут в памяти одного процесса: второй бот-процесс терял бы
+# чужие изменения, поэтому владелец держит аренду job_leases
+SESSION_LEASE = "bot-sessions"
+SESSION_LEASE_TTL = float(os.getenv("SESSION_LEASE_TTL", "60"))
+SESSION_OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    Состояние разговора с пользователем: настройки из user_settings
+    (включая pending), settings_msg_id и признак наличия в users.
+    Изменения копятся в памяти и уходят в БД пачкой (write-behind).
+    """
+
+    __slots__ = ("tg_user", "settings", "settings_msg_id", "known", "used_at",
+                 "loaded_at", "dirty_keys", "dirty_user", "flushing", "version", "_store")
+
+    def __init__(self, store: "SessionStore", tg_user: int):
+        self._store = store
+        self.tg_user = tg_user
+        self.settings: dict[str, Optional[str]] = {}
+        self.settings_msg_id: Optional[int] = None
+        self.known = False
+        self.used_at = self.loaded_at = time.monotonic()
+        self.dirty_keys: set[str] = set()
+        self.dirty_user = False
+        # идёт запись в БД / счётчик изменений — для безопасного перечитывания
+        self.flushing = False
+        self.version = 0
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.dirty_keys) or self.dirty_user
+
+    def get(self, key: str) -> Optional[str]:
+        return self.settings.get(key)
+
+    def set(self, key: str, value) -> None:
+        # в колонке TEXT число хранится строкой — сессия повторяет это
+        self.settings[key] = None if value is None else str(value)
+        self.dirty_keys.add(key)
+        self._changed()
+
+    def set_settings_msg_id(self, msg_id: Optional[int]) -> None:
+        self.settings_msg_id = msg_id
+        self.known = True
+        self.dirty_user = True
+        self._changed()
+
+    def remember_user(self) -> None:
+        """Аналог INSERT OR IGNORE INTO users: пишет только для новых."""
+        if not self.known:
+            self.known = True
+            self.dirty_user = True
+            self._changed()
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._store._mark(self)
+
+
+class SessionStore:
+    """
+    Сессии активных пользователей в памяти (LRU с вытеснением по простою).
+
+    Сессия загружается из БД один раз; дальше обновление пользователя
+    читает и пишет только память, а фоновая задача раз в flush_interval
+    записывает все изменённые сессии одной транзакцией. Вытесняются
+    только уже сброшенные сессии.
+
+    Ограничение: писать сессии может только один процесс. Кэш и отложенная
+    запись не согласуются между процессами — у второго воркера бота pending
+    терялся бы или срабатывал повторно, а чтение-изменение-запись (например,
+    toggle_multi_value) затирало бы чужие значения. Бот-процесс берёт
+    аренду через hold_ownership(), остальные процессы только читают
+    (read_through()).
+    """
+
+    def __init__(
+        self,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_sessions: int = SESSION_MAX,
+        flush_interval: float = SESSION_FLUSH_INTERVAL,
+        max_age: float = SESSION_MAX_AGE,
+    ):
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._loading: dict[int, asyncio.Task] = {}
+        self._dirty: dict[int, Session] = {}
+        self._flusher: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, tg_user: int) -> Session:
+        session = self._sessions.get(tg_user)
+        if session is not None:
+            self._sessions.move_to_end(tg_user)
+            session.used_at = time.monotonic()
+            if session.used_at - session.loaded_at <= self.max_age:
+                self.hits += 1
+                return session
+        self.misses += 1
+        # параллельные апдейты одного пользователя ждут одну загрузку
+        task = self._loading.get(tg_user)
+        if task is None:
+            task = asyncio.create_task(self._load(tg_user, session))
+            self._loading[tg_user] = task
+            task.add_done_callback(lambda _: self._loading.pop(tg_user, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, tg_user: int, session: Optional[Session] = None) -> Session:
+        """
+        Загружает сессию; устаревшую перечитывает на месте, чтобы ссылки
+        обработчиков оставались живыми. Сессию с изменениями, ещё не
+        записанными в БД, не трогаем — перечитаем при следующем обращении.
+        """
+        if session is not None and (session.dirty or session.flushing):
+            return session
+        version = session.version if session is not None else 0
+        rows = await storage.fetchall(
+            "SELECT key, value FROM user_settings WHERE tg_user = ?",
+            (tg_user,),
+        )
+        row = await storage.fetchone(
+            "SELECT settings_msg_id FROM users WHERE chat_id = ?",
+            (tg_user,),
+        )
+        if session is None:
+            session = Session(self, tg_user)
+        elif session.version != version or session.flushing:
+            # пока читали, сессию изменили — прочитанное уже устарело
+            return session
+        session.settings = {key: value for key, value in rows}
+        session.known = row is not None
+        session.settings_msg_id = row[0] if row is not None else None
+        session.loaded_at = time.monotonic()
+        self._sessions[tg_user] = session
+        self._evict()
+        return session
+
+    def _mark(self, session: Session) -> None:
+        self._dirty[session.tg_user] = session
+        if self._flusher is None or self._flusher.done():
+            with tracing.detached():
+                self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _evict(self) -> None:
+        """Убирает простаивающие и лишние сессии, кроме несброшенных."""
+        deadline = time.monotonic() - self.idle_ttl
+        excess = len(self._sessions) - self.max_sessions
+        for tg_user, session in list(self._sessions.items()):
+            if excess <= 0 and session.used_at > deadline:
+                # дальше по LRU только более свежие
+                break
+            if session.dirty:
+                continue
+            del self._sessions[tg_user]
+            excess -= 1
+
+    def invalidate(self, tg_user: int | None = None) -> None:
+        """Забывает сессию (или все), чтобы перечитать её из БД; несброшенные остаются."""
+        users = list(self._sessions) if tg_user is None else [tg_user]
+        for uid in users:
+            session = self._sessions.get(uid)
+            if session is not None and not session.dirty:
+                del self._sessions[uid]
+
+    async def flush(self) -> None:
+        """Записывает все изменённые сессии одной транзакцией."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        users: list[tuple] = []
+        settings: list[tuple] = []
+        for session in batch.values():
+            if session.dirty_user:
+                users.append((session.tg_user, session.settings_msg_id))
+            for key in session.dirty_keys:
+                settings.append((session.tg_user, key, session.settings.get(key)))
+            session.dirty_user = False
+            session.dirty_keys = set()
+            session.flushing = True
+
+        async def _write(db: aiosqlite.Connection) -> None:
+            if users:
+                await db.executemany(
+                    """
+                    INSERT INTO users (chat_id, settings_msg_id) VALUES (?, ?)
+                    ON CONFLICT (chat_id) DO UPDATE SET settings_msg_id = excluded.settings_msg_id
+                    """,
+                    users,
+                )
+            if settings:
+                await db.executemany(
+                    "INSERT OR REPLACE INTO user_settings (tg_user, key, value) VALUES (?, ?, ?)",
+                    settings,
+                )
+
+        try:
+            await storage.write(_write)
+        except BaseException:
+            # вернём изменения в очередь: запишутся при следующем сбросе
+            for tg_user, session in batch.items():
+                session.dirty_user = session.dirty_user or any(u[0] == tg_user for u in users)
+                session.dirty_keys.update(k for u, k, _ in settings if u == tg_user)
+                self._dirty.setdefault(tg_user, session)
+            raise
+        finally:
+            for session in batch.values():
+                session.flushing = False
+
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось сохранить сессии")
+            self._evict()
+
+    async def close(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток (остановка приложения)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+
+# общий экземпляр на процесс
+store = SessionStore()
+metrics.observe_cache("sessions", lambda: {"hit": store.hits, "miss": store.misses})
+metrics.callback("sessions_loaded", "Сессий в памяти", lambda: len(store._sessions))
+metrics.callback("sessions_dirty", "Сессий с несохранёнными изменениями", lambda: len(store._dirty))
+
+
+_owner_task: asyncio.Task | None = None
+
+
+async def hold_ownership(wait: float = SESSION_LEASE_TTL) -> None:
+    """
+    Делает процесс единственным владельцем сессий бота. Аренду упавшего
+    процесса ждёт до wait секунд, дальше — RuntimeError: второй воркер
+    бота запускать нельзя (см. SessionStore). Аренда продлевается в фоне
+    и отдаётся в close().
+    """
+    global _owner_task
+    deadline = time.monotonic() + wait
+    while not await storage.claim_lease(SESSION_LEASE, SESSION_OWNER_ID, SESSION_LEASE_TTL):
+        if time.monotonic() >= deadline:
+            raise RuntimeError(
+                "Сессии бота уже ведёт другой процесс: бот запускается в одном воркере"
+            )
+        await asyncio.sleep(1.0)
+    if _owner_task is None or _owner_task.done():
+        with tracing.detached():
+            _owner_task = asyncio.create_task(_renew_ownership())
+
+
+async def _renew_ownership() -> None:
+    while True:
+        await asyncio.sleep(SESSION_LEASE_TTL / 3)
+        try:
+            if not await storage.claim_lease(SESSION_LEASE, SESSION_OWNER_ID, SESSION_LEASE_TTL):
+                logger.error("Аренду сессий бота забрал другой процесс")
+        except Exception:
+            logger.exception("Не удалось продлить аренду сессий бота")
+
+
+def read_through() -> None:
+    """
+    Для процессов, которые настройки только читают (API, воркер откликов):
+    каждое обращение перечитывает сессию из БД, чтобы выбор резюме в боте
+    был виден сразу, а не через SESSION_MAX_AGE.
+    """
+    store.max_age = 0
+
+
+async def get_session(tg_user: int) -> Session:
+    return await store.get(tg_user)
+
+
+async def flush() -> None:
+    await store.flush()
+
+
+async def close() -> None:
+    global _owner_task
+    await store.close()
+    if _owner_task is not None:
+        _owner_task.cancel()
+        try:
+            await _owner_task
+        except asyncio.CancelledError:
+            pass
+        _owner_task = None
+        await storage.release_lease(SESSION_LEASE, SESSION_OWNER_ID)
@@ -1,63 +1,65 @@
-import aiosqlite
 from aiogram import types
 from typing import Optional
 
-# Путь к SQLite базе
-DB_PATH = "tg_users.db"
+import sessions
+import tracing
 
-# Путь к SQLite базе\ DB_PATH = "tg_users.db"
+# Ключи, которые читают другие процессы (API, воркер откликов): пишутся
+# в БД сразу, а не фоновым сбросом сессий
+SHARED_KEYS = {"resume", "prompt"}
 
+
+def invalidate_user_settings(tg_user: int | None = None) -> None:
+    """Перечитать настройки пользователя (или всех) из БД при следующем обращении."""
+    sessions.store.invalidate(tg_user)
+
+
+@tracing.traced("settings.get_user_settings")
+async def get_user_settings(tg_user: int) -> dict[str, Optional[str]]:
+    """
+    Возвращает все настройки пользователя. Читаются из сессии
+    (sessions), которая загружается из БД один раз.
+    """
+    return dict((await sessions.get_session(tg_user)).settings)
+
+
+@tracing.traced("settings.set_pending")
 async def set_pending(tg_user: int, field: Optional[str]):
     """
     Помечаем, что для пользователя tg_user сейчас ожидается ввод для поля field.
     Для сброса передайте field=None.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO user_settings (tg_user, key, value) VALUES (?, ?, ?)",
-            (tg_user, "pending", field)
-        )
-        await db.commit()
+    (await sessions.get_session(tg_user)).set("pending", field)
 
+@tracing.traced("settings.get_pending")
 async def get_pending(tg_user: int) -> Optional[str]:
     """
     Возвращает текущее pending-поле для пользователя или None, если ожидание не установлено.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT value FROM user_settings WHERE tg_user = ? AND key = 'pending'",
-            (tg_user,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+    return (await sessions.get_session(tg_user)).get("pending")
 
+@tracing.traced("settings.save_user_setting")
 async def save_user_setting(tg_user: int, key: str, value: str):
     """
     Сохраняет любое пользовательское значение (фильтр) по ключу key.
     Пример key: 'region', 'salary', 'work_format', 'employment_type', 'keyword', 'prompt'.
+    В БД значение попадает при ближайшем сбросе сессий, а для SHARED_KEYS —
+    до возврата из функции.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO user_settings (tg_user, key, value) VALUES (?, ?, ?)",
-            (tg_user, key, value)
-        )
-        await db.commit()
+    (await sessions.get_session(tg_user)).set(key, value)
+    if key in SHARED_KEYS:
+        await sessions.flush()
 
+@tracing.traced("settings.get_user_setting")
 async def get_user_setting(tg_user: int, key: str) -> Optional[str]:
     """
     Получает сохранённое значение пользователя по ключу key.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT value FROM user_settings WHERE tg_user = ? AND key = ?",
-            (tg_user, key)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+    return (await sessions.get_session(tg_user)).get(key)
 
 
-def build_main_menu_keyboard() -> types.InlineKeyboardMarkup:
-    """Главное меню бота."""
+def build_main_menu_keyboard(subscribed: bool = False) -> types.InlineKeyboardMarkup:
+    """Главное меню бота; subscribed — включены ли уведомления о вакансиях."""
     rows = [
         [
             types.InlineKeyboardButton(
@@ -74,6 +76,12 @@ def build_main_menu_keyboard() -> types.InlineKeyboardMarkup:
                 text="👁️ Просмотр фильтров", callback_data="show_filters"
             )
         ],
+        [
+            types.InlineKeyboardButton(
+                text="🔔 Новые вакансии: вкл" if subscribed else "🔕 Новые вакансии: выкл",
+                callback_data="toggle_subscription",
+            )
+        ],
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=rows)
 
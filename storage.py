@@ -0,0 +1,286 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import aiosqlite
+
+import metrics
+import tracing
+
+# Путь к SQLite базе (общий для бота, OAuth-сервиса и рассылки)
+DB_PATH = os.getenv("TG_DB_PATH", "tg_users.db")
+
+# Размер пула читающих соединений и максимум операций в одной транзакции писателя
+READ_POOL_SIZE = int(os.getenv("TG_DB_READERS", "4"))
+WRITE_BATCH = int(os.getenv("TG_DB_WRITE_BATCH", "64"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA foreign_keys=ON",
+)
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = metrics.histogram(
+    "sqlite_write_batch_size", "Операций в одной транзакции писателя", buckets=metrics.COUNT_BUCKETS
+)
+TRANSACTION_SECONDS = metrics.histogram("sqlite_transaction_seconds", "Длительность транзакций писателя")
+LOCKED = metrics.counter("sqlite_locked_total", "Ошибки database is locked/busy")
+
+WriteFn = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class Storage:
+    """
+    Долгоживущий доступ к SQLite: пул читателей и один писатель.
+
+    Все записи проходят через очередь единственного писателя и
+    группируются в одну транзакцию, поэтому в процессе нет конкуренции
+    за блокировку записи. Чтения идут параллельно через пул (WAL).
+    Подготовленные выражения кэширует sqlite3 (cached_statements).
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = READ_POOL_SIZE):
+        self.path = path
+        self.readers = max(1, readers)
+        self._pool: asyncio.Queue[aiosqlite.Connection] | None = None
+        self._all: list[aiosqlite.Connection] = []
+        self._writer: aiosqlite.Connection | None = None
+        self._queue: asyncio.Queue | None = None
+        self._writer_task: asyncio.Task | None = None
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path, cached_statements=256)
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def open(self) -> None:
+        """Открывает соединения и запускает писателя (идемпотентно)."""
+        async with self._open_lock:
+            if self.is_open:
+                return
+            self._writer = await self._connect()
+            self._pool = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._connect()
+                self._all.append(conn)
+                self._pool.put_nowait(conn)
+            self._queue = asyncio.Queue()
+            with tracing.detached():
+                self._writer_task = asyncio.create_task(self._write_loop())
+            logger.info("SQLite storage opened: %s (%d readers)", self.path, self.readers)
+
+    async def close(self) -> None:
+        """Дожидается очереди записи и закрывает все соединения."""
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            await self._queue.put(None)
+            await self._writer_task
+            for conn in self._all:
+                await conn.close()
+            await self._writer.close()
+            self._writer = None
+            self._writer_task = None
+            self._all.clear()
+            self._pool = None
+            self._queue = None
+
+    async def _ensure_open(self) -> None:
+        if not self.is_open:
+            await self.open()
+
+    # ────────── чтение ──────────
+    async def fetchone(self, sql: str, params: Iterable[Any] = ()) -> Optional[tuple]:
+        await self._ensure_open()
+        started = time.perf_counter()
+        conn = await self._pool.get()
+        try:
+            async with conn.execute(sql, tuple(params)) as cur:
+                return await cur.fetchone()
+        finally:
+            self._pool.put_nowait(conn)
+            metrics.observe_query("fetchone", time.perf_counter() - started)
+            tracing.add_span("sqlite.fetchone", started, sql=sql[:80])
+
+    async def fetchall(self, sql: str, params: Iterable[Any] = ()) -> list[tuple]:
+        await self._ensure_open()
+        started = time.perf_counter()
+        conn = await self._pool.get()
+        try:
+            async with conn.execute(sql, tuple(params)) as cur:
+                return list(await cur.fetchall())
+        finally:
+            self._pool.put_nowait(conn)
+            metrics.observe_query("fetchall", time.perf_counter() - started)
+            tracing.add_span("sqlite.fetchall", started, sql=sql[:80])
+
+    # ────────── запись ──────────
+    async def write(self, fn: WriteFn) -> Any:
+        """
+        Выполняет fn(conn) на соединении писателя внутри общей транзакции
+        и возвращает её результат после COMMIT. fn не должна сама вызывать
+        commit/rollback — транзакцией управляет писатель.
+        """
+        await self._ensure_open()
+        started = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, fut))
+        try:
+            return await fut
+        finally:
+            metrics.observe_query("write", time.perf_counter() - started)
+            tracing.add_span("sqlite.write", started, op=getattr(fn, "__qualname__", "?"))
+
+    async def execute(self, sql: str, params: Iterable[Any] = ()) -> int:
+        """Выполняет одно изменяющее выражение; возвращает rowcount."""
+        params = tuple(params)
+
+        async def _run(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(sql, params)
+            return cur.rowcount
+
+        return await self.write(_run)
+
+    async def executemany(self, sql: str, rows: Iterable[Iterable[Any]]) -> None:
+        rows = [tuple(r) for r in rows]
+        if not rows:
+            return
+
+        async def _run(db: aiosqlite.Connection) -> None:
+            await db.executemany(sql, rows)
+
+        await self.write(_run)
+
+    async def _write_loop(self) -> None:
+        db = self._writer
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < WRITE_BATCH and not self._queue.empty():
+                nxt = self._queue.get_nowait()
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            results = await self._run_batch(db, batch)
+            for fut, res, err in results:
+                if fut.done():
+                    continue
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(res)
+            if stop:
+                return
+
+    async def _run_batch(self, db: aiosqlite.Connection, batch: list) -> list:
+        results = []
+        WRITE_BATCH_SIZE.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for fn, fut in batch:
+                # SAVEPOINT изолирует ошибку одной операции от остальных в пачке
+                await db.execute("SAVEPOINT op")
+                try:
+                    res = await fn(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO op")
+                    await db.execute("RELEASE op")
+                    results.append((fut, None, e))
+                else:
+                    await db.execute("RELEASE op")
+                    results.append((fut, res, None))
+            await db.commit()
+        except Exception as e:
+            if "locked" in str(e) or "busy" in str(e):
+                LOCKED.inc()
+            logger.exception("SQLite write batch failed")
+            try:
+                await db.rollback()
+            except Exception:
+                pass
+            done = {id(fut): err for fut, _, err in results}
+            results = [(fut, None, done.get(id(fut)) or e) for _, fut in batch]
+        TRANSACTION_SECONDS.observe(time.perf_counter() - started)
+        return results
+
+
+# общий экземпляр на процесс
+storage = Storage()
+metrics.callback(
+    "sqlite_writer_queue", "Операций в очереди писателя",
+    lambda: storage._queue.qsize() if storage._queue is not None else 0,
+)
+
+
+async def init_db() -> None:
+    """Открывает общее хранилище; вызывается на старте приложения."""
+    await storage.open()
+
+
+async def close_db() -> None:
+    await storage.close()
+
+
+async def fetchone(sql: str, params: Iterable[Any] = ()) -> Optional[tuple]:
+    return await storage.fetchone(sql, params)
+
+
+async def fetchall(sql: str, params: Iterable[Any] = ()) -> list[tuple]:
+    return await storage.fetchall(sql, params)
+
+
+async def execute(sql: str, params: Iterable[Any] = ()) -> int:
+    return await storage.execute(sql, params)
+
+
+async def executemany(sql: str, rows: Iterable[Iterable[Any]]) -> None:
+    await storage.executemany(sql, rows)
+
+
+async def write(fn: WriteFn) -> Any:
+    return await storage.write(fn)
+
+
+# ────────── аренды job_leases ──────────
+
+async def claim_lease(name: str, owner: str, duration: float) -> bool:
+    """
+    Берёт (или продлевает свою) аренду name на duration секунд.
+    Чужая действующая аренда — False.
+    """
+    now = int(time.time())
+    claimed = await execute(
+        """
+        INSERT INTO job_leases (name, owner, lease_until) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE
+           SET owner = excluded.owner, lease_until = excluded.lease_until
+         WHERE job_leases.owner = excluded.owner OR job_leases.lease_until <= ?
+        """,
+        (name, owner, now + int(duration), now),
+    )
+    return claimed > 0
+
+
+async def release_lease(name: str, owner: str) -> None:
+    """Отдаёт свою аренду досрочно (остановка процесса)."""
+    await execute("DELETE FROM job_leases WHERE name = ? AND owner = ?", (name, owner))
@@ -0,0 +1,352 @@
+import os
+import sys
+import html
+import time
+import socket
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+
+import storage
+import migrate_settings
+import hh_api
+import search_filters
+from rate_limit import TokenBucket
+from tg_bridge import BROADCAST_RATE, send_text
+
+# Как часто опрашивать HH по подпискам
+SUBSCRIPTION_INTERVAL = float(os.getenv("SUBSCRIPTION_INTERVAL", "600"))
+SUBSCRIPTION_CONCURRENCY = int(os.getenv("SUBSCRIPTION_CONCURRENCY", "4"))
+# Аренда прохода берётся на интервал плюс запас и продлевается между группами
+SUBSCRIPTION_LEASE_MARGIN = float(os.getenv("SUBSCRIPTION_LEASE_MARGIN", "300"))
+# Не больше стольких страниц по 100 вакансий на группу за один опрос
+SUBSCRIPTION_MAX_PAGES = int(os.getenv("SUBSCRIPTION_MAX_PAGES", "2"))
+# Окна опроса перекрываются: вакансия попадает в поиск HH с задержкой
+SUBSCRIPTION_OVERLAP = int(os.getenv("SUBSCRIPTION_OVERLAP", "300"))
+# Сколько помнить отправленные вакансии (хватает с запасом на перекрытие)
+SUBSCRIPTION_SEEN_TTL = int(os.getenv("SUBSCRIPTION_SEEN_TTL", str(2 * 86400)))
+SUBSCRIPTION_PAGE = 500
+# Вакансий в одном сообщении
+DIGEST_LIMIT = 10
+
+# владелец аренды планировщика: из нескольких процессов опрос ведёт один
+SCHEDULER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_NAME = "subscriptions"
+
+logger = logging.getLogger(__name__)
+
+_scheduler_task: asyncio.Task | None = None
+
+
+# ────────── подписка пользователя ──────────
+
+async def is_subscribed(tg_user: int) -> bool:
+    row = await storage.fetchone(
+        "SELECT 1 FROM subscriptions WHERE tg_user = ?", (tg_user,)
+    )
+    return row is not None
+
+
+async def subscribe(tg_user: int) -> None:
+    """Присылать вакансии, опубликованные после подписки."""
+    now = int(time.time())
+    await storage.execute(
+        "INSERT OR IGNORE INTO subscriptions (tg_user, created_at, last_checked) VALUES (?, ?, ?)",
+        (tg_user, now, now),
+    )
+
+
+async def unsubscribe(tg_user: int) -> None:
+    async def _delete(db) -> None:
+        await db.execute("DELETE FROM subscriptions WHERE tg_user = ?", (tg_user,))
+        await db.execute("DELETE FROM subscription_seen WHERE tg_user = ?", (tg_user,))
+
+    await storage.write(_delete)
+
+
+async def toggle(tg_user: int) -> bool:
+    """Переключает подписку; возвращает новое состояние."""
+    if await is_subscribed(tg_user):
+        await unsubscribe(tg_user)
+        return False
+    await subscribe(tg_user)
+    return True
+
+
+# ────────── группировка ──────────
+
+class Group:
+    """Подписчики с одинаковыми фильтрами: один запрос к HH на всех."""
+
+    __slots__ = ("params", "members")
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        # tg_user -> last_checked
+        self.members: dict[int, int] = {}
+
+    @property
+    def since(self) -> int:
+        return min(self.members.values()) - SUBSCRIPTION_OVERLAP
+
+
+async def collect_groups() -> dict[str, Group]:
+    """
+    Читает подписки постранично (keyset по tg_user) вместе с настройками
+    и раскладывает пользователей по каноническому ключу фильтров.
+    Подписки без единого фильтра пропускаются: это была бы вся выдача HH.
+    """
+    groups: dict[str, Group] = {}
+    after = 0
+    while True:
+        subs = await storage.fetchall(
+            "SELECT tg_user, last_checked FROM subscriptions WHERE tg_user > ? ORDER BY tg_user LIMIT ?",
+            (after, SUBSCRIPTION_PAGE),
+        )
+        if not subs:
+            return groups
+        after = subs[-1][0]
+        marks = ",".join("?" * len(subs))
+        rows = await storage.fetchall(
+            f"SELECT tg_user, key, value FROM user_settings WHERE tg_user IN ({marks})",
+            [uid for uid, _ in subs],
+        )
+        settings: dict[int, dict] = {}
+        for uid, key, value in rows:
+            settings.setdefault(uid, {})[key] = value
+        for uid, last_checked in subs:
+            params = await search_filters.compile_filters(settings.get(uid, {}))
+            if not params:
+                continue
+            key = search_filters.canonical_key(params)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = Group(params)
+            group.members[uid] = last_checked
+
+
+# ────────── опрос HH ──────────
+
+def _hh_time(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S%z")
+
+
+def _published_at(vacancy: Dict[str, Any]) -> int:
+    try:
+        return int(datetime.strptime(vacancy["published_at"], "%Y-%m-%dT%H:%M:%S%z").timestamp())
+    except (KeyError, TypeError, ValueError):
+        return int(time.time())
+
+
+async def fetch_new(params: Dict[str, Any], since: int) -> tuple[list[Dict[str, Any]], bool]:
+    """
+    Вакансии, опубликованные после since, свежие первыми, и признак того,
+    что выдача обрезана на SUBSCRIPTION_MAX_PAGES страницах (окно покрыто
+    только до самой старой из полученных вакансий).
+    """
+    query = {
+        **params,
+        "date_from": _hh_time(since),
+        "order_by": "publication_time",
+        "per_page": 100,
+    }
+    found: list[Dict[str, Any]] = []
+    for page in range(SUBSCRIPTION_MAX_PAGES):
+        data = await hh_api.search_public(query, page)
+        found.extend(data.get("items", []))
+        if page + 1 >= (data.get("pages") or 1):
+            return found, False
+    return found, True
+
+
+async def _unseen(tg_user: int, ids: list[int]) -> set[int]:
+    marks = ",".join("?" * len(ids))
+    rows = await storage.fetchall(
+        f"SELECT vacancy_id FROM subscription_seen WHERE tg_user = ? AND vacancy_id IN ({marks})",
+        [tg_user, *ids],
+    )
+    return set(ids) - {r[0] for r in rows}
+
+
+def format_digest(vacancies: list[Dict[str, Any]]) -> str:
+    lines = ["🆕 <b>Новые вакансии по вашим фильтрам</b>", ""]
+    for v in vacancies[:DIGEST_LIMIT]:
+        name = html.escape(v.get("name") or "Вакансия")
+        url = html.escape(v.get("alternate_url") or f"https://hh.ru/vacancy/{v.get('id')}")
+        employer = html.escape((v.get("employer") or {}).get("name") or "")
+        lines.append(f"• <a href=\"{url}\">{name}</a>" + (f" — {employer}" if employer else ""))
+    if len(vacancies) > DIGEST_LIMIT:
+        lines.append(f"…и ещё {len(vacancies) - DIGEST_LIMIT}")
+    return "\n".join(lines)
+
+
+async def poll_group(group: Group, bot: Bot, bucket: TokenBucket) -> int:
+    """
+    Один запрос (до SUBSCRIPTION_MAX_PAGES страниц) на группу; каждому
+    участнику — только вакансии новее его last_checked, которых он ещё
+    не получал. Возвращает число отправленных сообщений.
+
+    last_checked сдвигается только до покрытой части окна: если выдача
+    обрезана, — до самой старой полученной вакансии, и остаток окна
+    дочитает следующий опрос. Вакансии считаются отправленными, а
+    last_checked не сдвигается, пока сообщение не доставлено.
+    """
+    checked_at = int(time.time())
+    vacancies, truncated = await fetch_new(group.params, group.since)
+    by_id = {}
+    for v in vacancies:
+        if str(v.get("id", "")).isdigit():
+            by_id[int(v["id"])] = v
+    # выдача обрезана — окно покрыто только с самой старой полученной вакансии
+    covered_from = None
+    if truncated:
+        covered_from = min((_published_at(v) for v in vacancies), default=checked_at)
+
+    sent = 0
+    seen_rows: list[tuple] = []
+    checked: list[tuple] = []
+    for uid, last_checked in group.members.items():
+        since = last_checked - SUBSCRIPTION_OVERLAP
+        if covered_from is None or covered_from <= since:
+            next_checked = checked_at
+        else:
+            next_checked = max(last_checked, covered_from)
+        candidates = [vid for vid, v in by_id.items() if _published_at(v) >= since]
+        fresh = await _unseen(uid, candidates) if candidates else set()
+        if fresh:
+            digest = [by_id[vid] for vid in candidates if vid in fresh]
+            if not await send_text(bot, bucket, uid, format_digest(digest),
+                                   parse_mode="HTML", disable_web_page_preview=True):
+                # не доставлено — повторим со следующим опросом
+                continue
+            sent += 1
+            seen_rows.extend((uid, vid, checked_at) for vid in fresh)
+        checked.append((next_checked, uid))
+
+    async def _save(db) -> None:
+        if seen_rows:
+            await db.executemany(
+                "INSERT OR IGNORE INTO subscription_seen (tg_user, vacancy_id, seen_at) VALUES (?, ?, ?)",
+                seen_rows,
+            )
+        await db.executemany(
+            "UPDATE subscriptions SET last_checked = ? WHERE tg_user = ?",
+            checked,
+        )
+
+    await storage.write(_save)
+    return sent
+
+
+async def run_once(bot: Bot, lease: float | None = None) -> tuple[int, int]:
+    """
+    Один проход по всем подпискам; возвращает (групп, сообщений).
+    С lease перед каждой группой аренда продлевается на lease секунд;
+    если её забрал другой процесс, оставшиеся группы пропускаются.
+    """
+    groups = await collect_groups()
+    bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+    sem = asyncio.Semaphore(SUBSCRIPTION_CONCURRENCY)
+    lost = False
+
+    async def _bounded(group: Group) -> int:
+        nonlocal lost
+        async with sem:
+            if lease is not None and not lost and not await claim_lease(lease):
+                logger.warning("Аренду опроса подписок забрал другой процесс")
+                lost = True
+            if lost:
+                return 0
+            try:
+                return await poll_group(group, bot, bucket)
+            except Exception:
+                logger.exception("Не удалось опросить группу подписок %s", group.params)
+                return 0
+
+    sent = sum(await asyncio.gather(*(_bounded(g) for g in groups.values())))
+    await storage.execute(
+        "DELETE FROM subscription_seen WHERE seen_at < ?",
+        (int(time.time()) - SUBSCRIPTION_SEEN_TTL,),
+    )
+    subscribers = sum(len(g.members) for g in groups.values())
+    logger.info("Подписки: %d пользователей в %d группах, отправлено %d",
+                subscribers, len(groups), sent)
+    return len(groups), sent
+
+
+async def claim_lease(duration: float, owner: str = SCHEDULER_ID) -> bool:
+    """
+    Берёт (или продлевает свою) аренду опроса на duration секунд.
+    Чужая действующая аренда — False: этот проход сделает другой процесс.
+    """
+    return await storage.claim_lease(LEASE_NAME, owner, duration)
+
+
+async def run_scheduler(bot: Bot, interval: float = SUBSCRIPTION_INTERVAL) -> None:
+    """
+    Опрос раз в interval. Запускать можно в каждом процессе: проход
+    выполняет только держатель аренды job_leases, остальные ждут.
+    Аренда берётся с запасом и продлевается по ходу прохода, поэтому
+    долгий проход не пересекается со следующим; после прохода она
+    укорачивается до конца интервала.
+    """
+    lease = interval + SUBSCRIPTION_LEASE_MARGIN
+    while True:
+        started = time.monotonic()
+        try:
+            if await claim_lease(lease):
+                try:
+                    await run_once(bot, lease)
+                finally:
+                    # следующий проход — не раньше чем через interval от начала
+                    left = interval - (time.monotonic() - started)
+                    await asyncio.shield(claim_lease(max(0.0, left)))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка планировщика подписок")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def start_scheduler(bot: Bot) -> asyncio.Task:
+    global _scheduler_task
+    if _scheduler_task is None or _scheduler_task.done():
+        _scheduler_task = asyncio.create_task(run_scheduler(bot))
+    return _scheduler_task
+
+
+async def stop_scheduler() -> None:
+    global _scheduler_task
+    if _scheduler_task is None:
+        return
+    _scheduler_task.cancel()
+    try:
+        await _scheduler_task
+    except asyncio.CancelledError:
+        pass
+    _scheduler_task = None
+
+
+async def main(token: Optional[str] = None):
+    bot = Bot(token=token or os.getenv("TG_BOT_TOKEN"))
+    await storage.init_db()
+    await migrate_settings.migrate()
+    await hh_api.open_pool()
+    try:
+        await run_scheduler(bot)
+    finally:
+        await bot.session.close()
+        await hh_api.close_pool()
+        await storage.close_db()
+
+
+if __name__ == "__main__":
+    # Отдельный процесс: python subscriptions.py
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(0)
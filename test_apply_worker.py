@@ -0,0 +1,129 @@
+import asyncio
+
+import storage
+import apply_worker
+
+
+async def _status(job_id: int) -> tuple:
+    return await storage.fetchone("SELECT status, attempts FROM queues WHERE id = ?", (job_id,))
+
+
+def test_claim_leases_each_row_once(run, monkeypatch):
+    async def scenario():
+        await apply_worker.enqueue(1, ["10", "11", "12"], "r1")
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-a")
+        first = await apply_worker.claim(2)
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-b")
+        second = await apply_worker.claim(5)
+        third = await apply_worker.claim(5)
+        return first, second, third
+
+    first, second, third = run(scenario)
+    assert [job[2] for job in first] == ["10", "11"]
+    assert [job[2] for job in second] == ["12"]
+    assert third == []
+
+
+def test_ack_requires_lease_owner(run, monkeypatch):
+    async def scenario():
+        await apply_worker.enqueue(1, ["10"])
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-a")
+        (job,) = await apply_worker.claim()
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-b")
+        await apply_worker.ack(job[0])
+        stolen = await _status(job[0])
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-a")
+        await apply_worker.ack(job[0])
+        return stolen, await _status(job[0])
+
+    assert run(scenario) == (("leased", 0), ("done", 0))
+
+
+def test_expired_lease_is_retried_and_counted(run, monkeypatch):
+    async def scenario():
+        await apply_worker.enqueue(1, ["10"])
+        monkeypatch.setattr(apply_worker, "APPLY_LEASE", -1)
+        first = await apply_worker.claim()
+        return first, await apply_worker.claim()
+
+    first, second = run(scenario)
+    assert [job[0] for job in first] == [job[0] for job in second]
+    assert (first[0][4], second[0][4]) == (0, 1)
+
+
+def test_job_that_keeps_losing_its_lease_fails(run, monkeypatch):
+    monkeypatch.setattr(apply_worker, "APPLY_MAX_ATTEMPTS", 3)
+
+    async def scenario():
+        await apply_worker.enqueue(1, ["10"])
+        monkeypatch.setattr(apply_worker, "APPLY_LEASE", -1)
+        claims = [len(await apply_worker.claim()) for _ in range(4)]
+        (job_id,) = await storage.fetchone("SELECT id FROM queues")
+        return claims, await _status(job_id)
+
+    claims, status = run(scenario)
+    assert claims == [1, 1, 1, 0]
+    assert status == ("failed", 3)
+
+
+def test_renew_keeps_rows_from_other_workers(run, monkeypatch):
+    async def scenario():
+        await apply_worker.enqueue(1, ["10"])
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-a")
+        monkeypatch.setattr(apply_worker, "APPLY_LEASE", -1)
+        (job,) = await apply_worker.claim()
+        monkeypatch.setattr(apply_worker, "APPLY_LEASE", 300)
+        await apply_worker.renew([job[0]])
+        monkeypatch.setattr(apply_worker, "WORKER_ID", "worker-b")
+        return await apply_worker.claim()
+
+    assert run(scenario) == []
+
+
+def test_run_once_renews_lease_while_batch_runs(run, monkeypatch):
+    renewed = []
+
+    async def slow_process(job):
+        await asyncio.sleep(0.05)
+
+    async def record(ids):
+        renewed.append(set(ids))
+
+    monkeypatch.setattr(apply_worker, "_process", slow_process)
+    monkeypatch.setattr(apply_worker, "renew", record)
+
+    async def scenario():
+        await apply_worker.enqueue(1, ["10", "11"])
+        monkeypatch.setattr(apply_worker, "APPLY_LEASE", 0.03)
+        return await apply_worker.run_once(concurrency=1)
+
+    assert run(scenario) == 2
+    assert renewed and renewed[0]
+
+
+def test_lost_lease_skips_respond(run, monkeypatch):
+    sent = []
+
+    async def token(tg_user):
+        return "t"
+
+    async def letter(vacancy_id, resume_id, prompt, token=None):
+        # пока письмо генерировалось, аренду забрал другой воркер
+        await storage.execute("UPDATE queues SET lease_owner = 'worker-b'")
+        return "letter"
+
+    async def respond(*args, **kwargs):
+        sent.append(args)
+
+    monkeypatch.setattr(apply_worker, "get_user_token", token)
+    monkeypatch.setattr(apply_worker.cover_letters, "get_cover_letter", letter)
+    monkeypatch.setattr(apply_worker.hh_client, "respond_to_vacancy", respond)
+
+    async def scenario():
+        await apply_worker.enqueue(1, ["10"], "r1")
+        (job,) = await apply_worker.claim()
+        await apply_worker._process(job)
+        return await storage.fetchone("SELECT status, lease_owner FROM queues WHERE id = ?", (job[0],))
+
+    assert run(scenario) == ("leased", "worker-b")
+    assert sent == []
@@ -0,0 +1,74 @@
+import asyncio
+
+import areas
+from bench_fakes import AREAS_TREE
+
+
+def _directory(tree=AREAS_TREE) -> areas.AreaDirectory:
+    directory = areas.AreaDirectory()
+    directory.load_tree(tree)
+    return directory
+
+
+def _ids(suggestions) -> list[str]:
+    return [s.id for s in suggestions]
+
+
+def test_normalize_folds_case_yo_and_punctuation():
+    assert areas.normalize("  Орёл,  ОБЛАСТЬ! ") == "орел область"
+    assert areas.normalize("Санкт-Петербург") == "санкт петербург"
+
+
+def test_exact_match_ranks_above_prefix():
+    tree = [{"id": "113", "parent_id": None, "name": "Россия", "areas": [
+        {"id": "10", "parent_id": "113", "name": "Мирный", "areas": []},
+        {"id": "11", "parent_id": "113", "name": "Мир", "areas": []},
+    ]}]
+    assert _ids(_directory(tree).matcher.search("мир")) == ["11", "10"]
+
+
+def test_word_prefix_and_label_with_parent():
+    matcher = _directory().matcher
+    assert _ids(matcher.search("петер")) == ["2"]
+    found = matcher.search("йошкар")
+    assert _ids(found) == ["1621"]
+    # у города в регионе подпись с названием региона
+    assert found[0].name == "Йошкар-Ола (Республика Марий Эл)"
+    assert _ids(matcher.search("марий")) == ["1620"]
+
+
+def test_typo_is_found_by_trigrams():
+    assert _ids(_directory().matcher.search("масква")) == ["1"]
+    assert _directory().matcher.search("хьюстон") == []
+
+
+def test_limit_and_empty_query():
+    matcher = _directory().matcher
+    assert matcher.search("") == []
+    assert matcher.search("?!") == []
+    assert len(matcher.search("р", limit=1)) == 1
+
+
+def test_reload_rebuilds_matcher():
+    directory = _directory()
+    first = directory.matcher
+    directory.load_tree([{"id": "5", "parent_id": None, "name": "Казахстан", "areas": []}])
+    assert directory.matcher is not first
+    assert _ids(directory.matcher.search("моск")) == []
+    assert _ids(directory.matcher.search("казах")) == ["5"]
+
+
+def test_refresh_replaces_directory_and_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / "areas.json")
+    monkeypatch.setattr(areas, "directory", areas.AreaDirectory())
+
+    async def fetch_tree():
+        return AREAS_TREE
+
+    asyncio.run(areas.refresh(fetch_tree, path))
+    assert _ids(areas.suggest("москва")) == ["1"]
+    assert areas.area_name(1621) == "Йошкар-Ола"
+
+    restored = areas.AreaDirectory()
+    assert restored.load_file(path)
+    assert _ids(restored.matcher.search("санкт")) == ["2"]
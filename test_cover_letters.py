@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+import cover_letters
+
+
+class CountingBackend:
+    """Генератор-заглушка: считает вызовы и одновременные генерации."""
+
+    def __init__(self):
+        self.calls: list[str] = []
+        self.active = 0
+        self.peak = 0
+
+    async def generate(self, vacancy, resume_id, prompt):
+        self.calls.append(vacancy["id"])
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if vacancy["id"] == "bad":
+            raise RuntimeError("generator failed")
+        return f"letter {vacancy['id']} {prompt or ''}".strip()
+
+
+class FakeHH:
+    def __init__(self):
+        self.loaded: list[str] = []
+
+    async def get_vacancy(self, vacancy_id, token=None):
+        self.loaded.append(vacancy_id)
+        return {"id": vacancy_id, "name": f"Вакансия {vacancy_id}"}
+
+
+@pytest.fixture
+def letters(monkeypatch):
+    backend = CountingBackend()
+    monkeypatch.setitem(cover_letters.BACKENDS, "counting", lambda: backend)
+    layer = cover_letters.CoverLetters("counting", concurrency=2)
+    layer._hh = FakeHH()
+    return layer
+
+
+def test_same_letter_is_generated_once(run, letters):
+    async def scenario():
+        first = await asyncio.gather(*(letters.get("1", "r1") for _ in range(5)))
+        again = await letters.get("1", "r1")
+        other_prompt = await letters.get("1", "r1", "коротко")
+        return first, again, other_prompt
+
+    first, again, other_prompt = run(scenario)
+    assert set(first) == {again} == {"letter 1"}
+    assert other_prompt == "letter 1 коротко"
+    assert letters.backend.calls == ["1", "1"]
+    assert (letters.hits, letters.misses) == (1, 6)
+
+
+def test_known_vacancy_is_not_loaded_again(run, letters):
+    async def scenario():
+        return await letters.get("7", "r1", vacancy={"id": "7", "name": "Python"})
+
+    assert run(scenario) == "letter 7"
+    assert letters._hh.loaded == []
+
+
+def test_batch_reuses_cache_limits_concurrency_and_keeps_errors(run, letters):
+    async def scenario():
+        await letters.get("1", "r1")
+        return await letters.get_many(["1", "2", "3", "4", "bad"], "r1")
+
+    result = run(scenario)
+    assert {vid: result[vid] for vid in "1234"} == {vid: f"letter {vid}" for vid in "1234"}
+    assert isinstance(result["bad"], RuntimeError)
+    assert sorted(letters.backend.calls) == ["1", "2", "3", "4", "bad"]
+    assert letters.backend.peak <= 2
+
+
+def test_template_backend_needs_no_network():
+    backend = cover_letters.TemplateBackend("{vacancy}{employer_part}.{prompt_part}")
+    vacancy = {"name": "Python", "employer": {"name": "Ромашка"}}
+
+    letter = asyncio.run(backend.generate(vacancy, "r1", " Готов к переезду "))
+    assert letter == "Python в компании Ромашка. Готов к переезду"
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        cover_letters.CoverLetters("nope")
@@ -0,0 +1,121 @@
+import time
+import asyncio
+
+import httpx
+
+import hh_api
+import hh_tokens
+import storage
+
+UID = 100500
+
+
+def _oauth(calls: list, status: int = 200, body: dict | None = None):
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        if status != 200:
+            return httpx.Response(status, json=body or {})
+        return httpx.Response(200, json={
+            "access_token": f"new-{len(calls)}", "refresh_token": "refresh-2", "expires_in": 1209600,
+        })
+
+    return handler
+
+
+def _setup(monkeypatch, handler) -> None:
+    monkeypatch.setattr(hh_tokens, "_retry_after", {})
+    monkeypatch.setattr(hh_tokens, "_inflight", {})
+    monkeypatch.setattr(
+        hh_api, "_http", httpx.AsyncClient(base_url=hh_api.HHApiClient.BASE_URL, transport=httpx.MockTransport(handler))
+    )
+
+
+async def _store(expires_in: int) -> None:
+    await hh_tokens.save_tokens(UID, {"access_token": "old", "refresh_token": "refresh-1", "expires_in": expires_in})
+
+
+def test_fresh_token_is_returned_without_refresh(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls))
+
+    async def scenario():
+        await _store(3600)
+        return await hh_tokens.get_user_token(UID)
+
+    assert run(scenario) == "old"
+    assert calls == []
+
+
+def test_expiring_token_is_refreshed_once_for_concurrent_callers(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls))
+
+    async def scenario():
+        await _store(60)
+        tokens = await asyncio.gather(*(hh_tokens.get_user_token(UID) for _ in range(10)))
+        row = await storage.fetchone("SELECT access_token, refresh_token FROM user_tokens WHERE tg_user = ?", (UID,))
+        return tokens, row
+
+    tokens, row = run(scenario)
+    assert calls == ["/oauth/token"]
+    assert set(tokens) == {"new-1"}
+    assert row == ("new-1", "refresh-2")
+
+
+def test_token_not_expired_answer_stops_repeated_refresh(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls, 400, {"error": "invalid_grant", "error_description": "token not expired"}))
+
+    async def scenario():
+        await _store(300)
+        return [await hh_tokens.get_user_token(UID) for _ in range(20)]
+
+    tokens = run(scenario)
+    assert tokens == ["old"] * 20
+    assert len(calls) == 1
+    assert hh_tokens._retry_after[UID] >= time.time() + 250
+
+
+def test_expired_token_without_refresh_returns_none(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls, 400, {"error": "invalid_grant"}))
+
+    async def scenario():
+        await _store(-10)
+        return await hh_tokens.get_user_token(UID)
+
+    assert run(scenario) is None
+    assert len(calls) == 1
+
+
+def test_expired_token_backoff_after_failed_refresh(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls, 500, {"error": "server_error"}))
+
+    async def scenario():
+        await _store(-10)
+        return [await hh_tokens.get_user_token(UID) for _ in range(5)]
+
+    assert run(scenario) == [None] * 5
+    assert len(calls) == 1
+
+
+def test_revoked_refresh_token_is_forgotten(run, monkeypatch):
+    calls = []
+    _setup(monkeypatch, _oauth(calls, 400, {"error": "invalid_grant", "error_description": "token deactivated"}))
+
+    async def scenario():
+        await _store(60)
+        first = await hh_tokens.get_user_token(UID)
+        second = await hh_tokens.get_user_token(UID)
+        return first, second, await storage.fetchone("SELECT 1 FROM user_tokens WHERE tg_user = ?", (UID,))
+
+    assert run(scenario) == (None, None, None)
+    assert len(calls) == 1
+
+
+def test_expired_retry_pauses_are_pruned(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(hh_tokens, "_retry_after", {1: now - 1, 2: now + 300})
+    hh_tokens._prune_retry_after()
+    assert list(hh_tokens._retry_after) == [2]
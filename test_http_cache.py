@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+
+from http_cache import CacheStore, CachingTransport, cache_key
+
+
+def _client(tmp_path, handler) -> tuple[httpx.AsyncClient, CachingTransport]:
+    transport = CachingTransport(httpx.MockTransport(handler), CacheStore(path=str(tmp_path / "cache.db")))
+    return httpx.AsyncClient(base_url="https://api.hh.ru", transport=transport), transport
+
+
+def test_cache_key_ignores_param_order_and_separates_tokens():
+    a = httpx.Request("GET", "https://api.hh.ru/vacancies?text=py&area=1")
+    b = httpx.Request("GET", "https://api.hh.ru/vacancies?area=1&text=py")
+    c = httpx.Request("GET", "https://api.hh.ru/vacancies?area=1&text=py", headers={"Authorization": "Bearer x"})
+    assert cache_key(a) == cache_key(b)
+    assert cache_key(a) != cache_key(c)
+
+
+def test_fresh_response_served_without_network(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"n": len(calls)}, headers={"cache-control": "max-age=600"})
+
+    async def scenario():
+        client, transport = _client(tmp_path, handler)
+        async with client:
+            bodies = [(await client.get("/dictionaries")).json() for _ in range(3)]
+        return bodies, transport.hits
+
+    bodies, hits = asyncio.run(scenario())
+    assert bodies == [{"n": 1}] * 3
+    assert len(calls) == 1 and hits == 2
+
+
+def test_etag_revalidation_returns_stored_body(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers={"etag": '"v1"'})
+        return httpx.Response(200, json={"items": [1, 2]}, headers={"etag": '"v1"'})
+
+    async def scenario():
+        client, transport = _client(tmp_path, handler)
+        async with client:
+            first = await client.get("/resumes/mine")
+            second = await client.get("/resumes/mine")
+        return first.json(), second.status_code, second.json(), transport.revalidated
+
+    first, status, second, revalidated = asyncio.run(scenario())
+    assert calls == [None, '"v1"']
+    assert (status, second) == (200, first)
+    assert revalidated == 1
+
+
+def test_private_responses_are_not_shared_between_tokens(tmp_path):
+    def handler(request):
+        return httpx.Response(
+            200, json={"auth": request.headers.get("authorization")}, headers={"cache-control": "max-age=600"}
+        )
+
+    async def scenario():
+        client, _ = _client(tmp_path, handler)
+        async with client:
+            a = await client.get("/resumes/mine", headers={"Authorization": "Bearer a"})
+            b = await client.get("/resumes/mine", headers={"Authorization": "Bearer b"})
+        return a.json()["auth"], b.json()["auth"]
+
+    assert asyncio.run(scenario()) == ("Bearer a", "Bearer b")
+
+
+def test_no_store_and_errors_are_not_cached(tmp_path):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path == "/areas":
+            return httpx.Response(200, json={}, headers={"cache-control": "no-store"})
+        return httpx.Response(500, json={}, headers={"cache-control": "max-age=600"})
+
+    async def scenario():
+        client, _ = _client(tmp_path, handler)
+        async with client:
+            for path in ("/areas", "/areas", "/vacancies", "/vacancies"):
+                await client.get(path)
+
+    asyncio.run(scenario())
+    assert calls == ["/areas", "/areas", "/vacancies", "/vacancies"]
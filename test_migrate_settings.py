@@ -0,0 +1,51 @@
+import asyncio
+
+import aiosqlite
+
+import storage
+import migrate_settings
+
+
+def test_migrations_are_versioned_and_idempotent(run):
+    async def scenario():
+        version = await migrate_settings.migrate()
+        again = await migrate_settings.migrate()
+        (user_version,) = await storage.fetchone("PRAGMA user_version")
+        tables = {r[0] for r in await storage.fetchall("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return version, again, user_version, tables
+
+    version, again, user_version, tables = run(scenario)
+    assert version == again == user_version == migrate_settings.SCHEMA_VERSION
+    assert {"users", "user_tokens", "queues", "seen_updates", "subscriptions", "job_leases"} <= tables
+
+
+def test_migrations_upgrade_legacy_schema(tmp_path):
+    path = str(tmp_path / "legacy.db")
+
+    async def scenario():
+        # база до user_version: таблица queues без колонок аренды
+        async with aiosqlite.connect(path) as db:
+            await db.execute("""
+                CREATE TABLE queues (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tg_user    INTEGER NOT NULL,
+                    vacancy_id TEXT    NOT NULL,
+                    created_at INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+                )
+            """)
+            await db.execute("INSERT INTO queues (tg_user, vacancy_id) VALUES (1, '10')")
+            await db.commit()
+        async with aiosqlite.connect(path, isolation_level=None) as db:
+            await db.execute("BEGIN")
+            version = await migrate_settings.upgrade(db)
+            await db.execute("COMMIT")
+            async with db.execute("PRAGMA table_info(queues)") as cur:
+                columns = {row[1] for row in await cur.fetchall()}
+            async with db.execute("SELECT vacancy_id, status FROM queues") as cur:
+                rows = await cur.fetchall()
+        return version, columns, rows
+
+    version, columns, rows = asyncio.run(scenario())
+    assert version == migrate_settings.SCHEMA_VERSION
+    assert {"status", "lease_owner", "lease_until", "attempts"} <= columns
+    assert rows == [("10", "pending")]
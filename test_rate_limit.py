@@ -0,0 +1,159 @@
+import time
+import asyncio
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+import hh_api
+from bench_fakes import FakeHH
+from http_cache import CacheStore, CachingTransport
+from rate_limit import FairLimiter, TokenBucket, parse_retry_after
+
+
+def test_parse_retry_after_seconds_and_dates():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-5") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 55 <= parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0
+
+
+def test_token_bucket_burst_then_wait():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.try_take() == 0.0
+    assert bucket.try_take() == 0.0
+    assert 0 < bucket.try_take() <= 0.1
+    bucket.pause(30)
+    assert bucket.try_take() > 29
+
+
+async def _acquired(limiter: FairLimiter, key, count: int, timeout: float = 0.2) -> int:
+    done = 0
+    try:
+        async with asyncio.timeout(timeout):
+            for _ in range(count):
+                await limiter.acquire(key)
+                done += 1
+    except TimeoutError:
+        pass
+    return done
+
+
+def test_fair_limiter_per_key_bucket():
+    limiter = FairLimiter(rate=1000, burst=1000, per_key_rate=0.01, per_key_burst=2)
+
+    async def scenario():
+        return await _acquired(limiter, "user-1", 5), await _acquired(limiter, "user-2", 1)
+
+    assert asyncio.run(scenario()) == (2, 1)
+
+
+def test_fair_limiter_anonymous_uses_only_global_bucket():
+    limiter = FairLimiter(rate=1000, burst=20, per_key_rate=0.01, per_key_burst=2)
+
+    async def scenario():
+        return await _acquired(limiter, None, 12)
+
+    assert asyncio.run(scenario()) == 12
+
+
+def test_fair_limiter_round_robin_between_keys():
+    limiter = FairLimiter(rate=50, burst=1, per_key_rate=1000, per_key_burst=1000)
+    order = []
+
+    async def take(key):
+        await limiter.acquire(key)
+        order.append(key)
+
+    async def scenario():
+        await limiter.acquire("warmup")
+        await asyncio.gather(*(take("heavy") for _ in range(5)), take("light"))
+
+    asyncio.run(scenario())
+    assert order.index("light") <= 1
+
+
+# ────────── limiter под HTTP-кэшем ──────────
+
+@pytest.fixture
+def strict_limiter(monkeypatch):
+    """Лимитер, который пропускает по одному запросу на ключ и почти не пополняется."""
+    limiter = FairLimiter(rate=1000, burst=1000, per_key_rate=0.01, per_key_burst=1)
+    monkeypatch.setattr(hh_api, "limiter", limiter)
+    return limiter
+
+
+def _client(tmp_path, handler) -> httpx.AsyncClient:
+    store = CacheStore(path=str(tmp_path / "cache.db"))
+    transport = CachingTransport(hh_api.LimitedTransport(httpx.MockTransport(handler)), store)
+    return httpx.AsyncClient(base_url=hh_api.HHApiClient.BASE_URL, transport=transport)
+
+
+def test_cache_hits_bypass_limiter(tmp_path, monkeypatch, strict_limiter):
+    network = []
+
+    def handler(request):
+        network.append(request.url.path)
+        return httpx.Response(200, json={"id": "1"}, headers={"cache-control": "max-age=600"})
+
+    async def scenario():
+        monkeypatch.setattr(hh_api, "_http", _client(tmp_path, handler))
+        client = hh_api.HHApiClient()
+        async with asyncio.timeout(1):
+            first = await client.get_vacancy("1", token="t")
+            strict_limiter.pause(60)
+            for _ in range(15):
+                assert await client.get_vacancy("1", token="t") == first
+        await hh_api.close_pool()
+
+    asyncio.run(scenario())
+    assert network == ["/vacancies/1"]
+
+
+def test_network_requests_still_limited_per_token(tmp_path, monkeypatch, strict_limiter):
+    async def scenario():
+        monkeypatch.setattr(hh_api, "_http", _client(tmp_path, FakeHH().handle))
+        client = hh_api.HHApiClient()
+        await client.get_vacancy("1", token="t")
+        try:
+            async with asyncio.timeout(0.2):
+                await client.get_vacancy("2", token="t")
+        except TimeoutError:
+            return "limited"
+        finally:
+            await hh_api.close_pool()
+        return "passed"
+
+    assert asyncio.run(scenario()) == "limited"
+
+
+def test_anonymous_and_oauth_calls_skip_per_key_limit(tmp_path, monkeypatch, strict_limiter):
+    fake = FakeHH()
+
+    async def scenario():
+        monkeypatch.setattr(hh_api, "_http", _client(tmp_path, fake.handle))
+        async with asyncio.timeout(1):
+            await asyncio.gather(*(hh_api.search_public({"text": "python"}, page) for page in range(12)))
+            strict_limiter.pause(60)
+            await hh_api.HHApiClient().refresh_access_token("refresh")
+        await hh_api.close_pool()
+
+    asyncio.run(scenario())
+    assert fake.requests == 13
+
+
+def test_cancelled_waiter_returns_its_key_token():
+    limiter = FairLimiter(rate=5, burst=1, per_key_rate=0.01, per_key_burst=1)
+
+    async def scenario():
+        # общий токен занят — ожидающий держит токен ключа и ждёт общий
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire("user-1"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await _acquired(limiter, "user-1", 1, timeout=1)
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,84 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+import resume_utils
+
+UID = 7
+
+
+@pytest.fixture
+def hh(monkeypatch):
+    """list_resumes отдаёт версию списка: сколько раз его загружали."""
+    calls = []
+
+    async def list_resumes(token=None):
+        calls.append(token)
+        await asyncio.sleep(0.01)
+        return [{"id": f"r{len(calls)}", "title": token}]
+
+    monkeypatch.setattr(resume_utils.hh_client, "list_resumes", list_resumes)
+    monkeypatch.setattr(resume_utils, "_cache", OrderedDict())
+    monkeypatch.setattr(resume_utils, "_inflight", {})
+    return calls
+
+
+async def _settle() -> None:
+    await asyncio.gather(*resume_utils._background)
+
+
+def test_fresh_list_is_served_from_memory(run, hh):
+    async def scenario():
+        first = await asyncio.gather(*(resume_utils.get_resumes(UID, "t1") for _ in range(3)))
+        return first, await resume_utils.get_resumes(UID, "t1")
+
+    first, again = run(scenario)
+    assert hh == ["t1"]
+    assert all(r == again for r in first)
+
+
+def test_stale_list_is_returned_and_refreshed_in_background(run, hh, monkeypatch):
+    async def scenario():
+        await resume_utils.get_resumes(UID, "t1")
+        monkeypatch.setattr(resume_utils, "RESUME_CACHE_TTL", -1)
+        stale = await resume_utils.get_resumes(UID, "t1")
+        await _settle()
+        monkeypatch.setattr(resume_utils, "RESUME_CACHE_TTL", 300)
+        return stale, await resume_utils.get_resumes(UID, "t1")
+
+    stale, fresh = run(scenario)
+    assert stale[0]["id"] == "r1"
+    assert fresh[0]["id"] == "r2"
+    assert len(hh) == 2
+
+
+def test_too_old_list_is_fetched_before_answer(run, hh, monkeypatch):
+    async def scenario():
+        await resume_utils.get_resumes(UID, "t1")
+        monkeypatch.setattr(resume_utils, "RESUME_CACHE_MAX_STALE", -1)
+        return await resume_utils.get_resumes(UID, "t1")
+
+    assert run(scenario)[0]["id"] == "r2"
+
+
+def test_list_saved_by_other_process_is_used(run, hh):
+    async def scenario():
+        # OAuth-сервис загрузил список сразу после входа
+        await resume_utils.warm_resumes(UID, "t1")
+        resume_utils._cache.clear()
+        return await resume_utils.get_resumes(UID, "t1")
+
+    assert run(scenario)[0]["id"] == "r1"
+    assert hh == ["t1"]
+
+
+def test_new_login_replaces_list(run, hh):
+    async def scenario():
+        await resume_utils.get_resumes(UID, "t1")
+        await resume_utils.warm_resumes(UID, "t2")
+        return await resume_utils.get_resumes(UID, "t2")
+
+    resumes = run(scenario)
+    assert resumes == [{"id": "r2", "title": "t2"}]
+    assert hh == ["t1", "t2"]
@@ -0,0 +1,101 @@
+import asyncio
+
+import httpx
+
+import main
+import storage
+import search_filters
+
+
+def test_compile_filters_is_normalized(label_map):
+    settings = {
+        "keyword": " python ",
+        "region": "1",
+        "salary": "150000",
+        "schedule": "гибкий график, полный день",
+        "work_format": "дистанционно",
+    }
+
+    async def scenario():
+        reordered = {**settings, "schedule": "полный день,гибкий график"}
+        return (
+            await search_filters.compile_filters(settings),
+            await search_filters.compile_filters(reordered),
+        )
+
+    params, again = asyncio.run(scenario())
+    assert params == {
+        "text": "python",
+        "area": "1",
+        "salary": 150000,
+        "schedule": ["flexible", "fullDay"],
+        "work_format": ["REMOTE"],
+    }
+    assert search_filters.canonical_key(params) == search_filters.canonical_key(again)
+
+
+def test_unknown_filters_are_reported(label_map):
+    skipped = []
+    settings = {"region": "Атлантида", "schedule": "полный день,вахта"}
+
+    params = asyncio.run(search_filters.compile_filters(settings, "go", skipped))
+    assert params == {"text": "go", "schedule": ["fullDay"]}
+    assert skipped == ["region=Атлантида", "schedule=вахта"]
+
+
+def test_canonical_key_ignores_order():
+    first = search_filters.canonical_key({"text": "python", "area": "1", "schedule": ["a", "b"]})
+    second = search_filters.canonical_key({"schedule": ["a", "b"], "area": "1", "text": "python"})
+    assert first == second
+    assert first != search_filters.canonical_key({"text": "python", "area": "2", "schedule": ["a", "b"]})
+
+
+def test_search_is_single_flight_and_cached(monkeypatch):
+    calls = []
+
+    async def search_public(params, page=0, limit_key=None):
+        calls.append((page, limit_key))
+        await asyncio.sleep(0.01)
+        return {"items": [{"id": "1"}], "found": 1, "pages": 1}
+
+    monkeypatch.setattr(search_filters.hh_api, "search_public", search_public)
+    search_filters.clear_cache()
+
+    async def scenario():
+        params = {"text": "python"}
+        first = await asyncio.gather(*(
+            search_filters.search(params, limit_key=uid) for uid in range(5)
+        ))
+        return first, await search_filters.search(params, limit_key=99)
+
+    first, cached = asyncio.run(scenario())
+    search_filters.clear_cache()
+    assert len(calls) == 1
+    assert all(data is cached for data in first)
+
+
+def test_search_endpoint_never_queries_whole_feed(run, monkeypatch, label_map):
+    queries = []
+
+    async def search_public(params, page=0, limit_key=None):
+        queries.append((params, limit_key))
+        return {"items": [], "found": 0, "pages": 1}
+
+    async def token(tg_user):
+        return "t"
+
+    monkeypatch.setattr(search_filters.hh_api, "search_public", search_public)
+    monkeypatch.setattr(main, "get_user_token", token)
+    search_filters.clear_cache()
+
+    async def scenario():
+        await storage.execute("INSERT INTO user_settings (tg_user, key, value) VALUES (7, 'region', 'Атлантида')")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.get("/search", params={"tg_user": 7})
+        return resp.json()
+
+    body = run(scenario)
+    search_filters.clear_cache()
+    assert body["skipped_filters"] == ["region=Атлантида"]
+    assert queries == [({"text": main.SEARCH_DEFAULT_TEXT, "per_page": 10}, 7)]
@@ -0,0 +1,71 @@
+import pytest
+
+import storage
+import sessions
+import settings_utils
+
+
+def _fresh_store(monkeypatch) -> sessions.SessionStore:
+    store = sessions.SessionStore(flush_interval=3600)
+    monkeypatch.setattr(sessions, "store", store)
+    return store
+
+
+async def _stored(tg_user: int, key: str):
+    row = await storage.fetchone(
+        "SELECT value FROM user_settings WHERE tg_user = ? AND key = ?", (tg_user, key)
+    )
+    return row[0] if row else None
+
+
+def test_settings_are_written_behind(run, monkeypatch):
+    _fresh_store(monkeypatch)
+
+    async def scenario():
+        await settings_utils.save_user_setting(1, "keyword", "python")
+        before = await _stored(1, "keyword")
+        await sessions.flush()
+        return before, await _stored(1, "keyword")
+
+    assert run(scenario) == (None, "python")
+
+
+def test_shared_keys_are_written_immediately(run, monkeypatch):
+    _fresh_store(monkeypatch)
+
+    async def scenario():
+        await settings_utils.save_user_setting(1, "resume", "r1")
+        return await _stored(1, "resume")
+
+    assert run(scenario) == "r1"
+
+
+def test_read_through_sees_other_process_writes(run, monkeypatch):
+    _fresh_store(monkeypatch)
+    sessions.read_through()
+
+    async def scenario():
+        await storage.execute("INSERT INTO user_settings (tg_user, key, value) VALUES (1, 'resume', 'r1')")
+        first = await settings_utils.get_user_setting(1, "resume")
+        # бот в другом процессе выбрал другое резюме
+        await storage.execute("UPDATE user_settings SET value = 'r2' WHERE tg_user = 1 AND key = 'resume'")
+        return first, await settings_utils.get_user_setting(1, "resume")
+
+    assert run(scenario) == ("r1", "r2")
+
+
+def test_second_bot_process_cannot_own_sessions(run, monkeypatch):
+    _fresh_store(monkeypatch)
+    owner = sessions.SESSION_OWNER_ID
+
+    async def scenario():
+        await sessions.hold_ownership(wait=0)
+        monkeypatch.setattr(sessions, "SESSION_OWNER_ID", "other-process")
+        with pytest.raises(RuntimeError):
+            await sessions.hold_ownership(wait=0)
+        monkeypatch.setattr(sessions, "SESSION_OWNER_ID", owner)
+        await sessions.close()
+        # после остановки владельца аренда свободна
+        return await storage.claim_lease(sessions.SESSION_LEASE, "other-process", 60)
+
+    assert run(scenario) is True
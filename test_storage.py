@@ -0,0 +1,35 @@
+import asyncio
+
+import storage
+
+
+def test_failed_write_is_isolated_within_batch(run):
+    def insert(chat_id):
+        async def _op(db):
+            await db.execute("INSERT INTO users (chat_id) VALUES (?)", (chat_id,))
+        return _op
+
+    async def broken(db):
+        await db.execute("INSERT INTO users (chat_id) VALUES (?)", (2,))
+        raise ValueError("handler bug")
+
+    async def scenario():
+        # три записи попадают в одну транзакцию писателя
+        results = await asyncio.gather(
+            storage.write(insert(1)), storage.write(broken), storage.write(insert(3)),
+            return_exceptions=True,
+        )
+        rows = await storage.fetchall("SELECT chat_id FROM users ORDER BY chat_id")
+        return results, rows
+
+    results, rows = run(scenario)
+    assert isinstance(results[1], ValueError)
+    assert rows == [(1,), (3,)]
+
+
+def test_execute_returns_rowcount(run):
+    async def scenario():
+        await storage.execute("INSERT INTO users (chat_id) VALUES (?)", (1,))
+        return await storage.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (1,))
+
+    assert run(scenario) == 0
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+import storage
+import hh_api
+import subscriptions
+
+
+def _vacancy(vid: int, published: int) -> dict:
+    return {
+        "id": str(vid),
+        "name": f"Вакансия {vid}",
+        "published_at": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(published)),
+    }
+
+
+async def _subscribe(group: subscriptions.Group, last_checked: int, *users: int) -> None:
+    for uid in users:
+        await storage.execute(
+            "INSERT INTO subscriptions (tg_user, created_at, last_checked) VALUES (?, ?, ?)",
+            (uid, last_checked, last_checked),
+        )
+        group.members[uid] = last_checked
+
+
+async def _state(uid: int) -> tuple:
+    (last_checked,) = await storage.fetchone(
+        "SELECT last_checked FROM subscriptions WHERE tg_user = ?", (uid,)
+    )
+    seen = await storage.fetchall(
+        "SELECT vacancy_id FROM subscription_seen WHERE tg_user = ? ORDER BY vacancy_id", (uid,)
+    )
+    return last_checked, [r[0] for r in seen]
+
+
+@pytest.fixture
+def hh_pages(monkeypatch):
+    """Выдача HH по страницам; pages — сколько страниц всего в поиске."""
+    feed = {"items": [], "pages": 1}
+
+    async def search_public(params, page=0, limit_key=None):
+        per_page = params["per_page"]
+        items = feed["items"][page * per_page:(page + 1) * per_page]
+        return {"items": items, "pages": feed["pages"]}
+
+    monkeypatch.setattr(hh_api, "search_public", search_public)
+    return feed
+
+
+@pytest.fixture
+def delivered(monkeypatch):
+    """Отправленные дайджесты; чаты из blocked недоступны."""
+    log = {"sent": [], "blocked": set()}
+
+    async def send_text(bot, bucket, chat_id, text, **kwargs):
+        if chat_id in log["blocked"]:
+            return False
+        log["sent"].append(chat_id)
+        return True
+
+    monkeypatch.setattr(subscriptions, "send_text", send_text)
+    return log
+
+
+def test_truncated_feed_moves_last_checked_to_oldest_fetched(run, monkeypatch, hh_pages, delivered):
+    monkeypatch.setattr(subscriptions, "SUBSCRIPTION_MAX_PAGES", 1)
+    now = int(time.time())
+    hh_pages["items"] = [_vacancy(i, now - 10 * i) for i in range(1, 101)]
+    hh_pages["pages"] = 3
+    group = subscriptions.Group({"text": "python"})
+
+    async def scenario():
+        await _subscribe(group, now - 86400, 1)
+        await subscriptions.poll_group(group, None, None)
+        return await _state(1)
+
+    last_checked, seen = run(scenario)
+    assert last_checked == now - 1000
+    assert len(seen) == 100
+
+
+def test_undelivered_digest_is_retried(run, hh_pages, delivered):
+    now = int(time.time())
+    hh_pages["items"] = [_vacancy(1, now - 10)]
+    delivered["blocked"].add(2)
+    group = subscriptions.Group({"text": "python"})
+
+    async def scenario():
+        await _subscribe(group, now - 600, 1, 2)
+        sent = await subscriptions.poll_group(group, None, None)
+        return sent, await _state(1), await _state(2)
+
+    sent, first, second = run(scenario)
+    assert sent == 1
+    assert first[0] >= now and first[1] == [1]
+    assert second == (now - 600, [])
+
+
+@pytest.mark.parametrize("duration, expected", [(600, (True, False, True)), (0, (True, True, True))])
+def test_subscription_lease(run, duration, expected):
+    async def scenario():
+        return (
+            await subscriptions.claim_lease(duration, "a"),
+            await subscriptions.claim_lease(duration, "b"),
+            await subscriptions.claim_lease(duration, "b" if duration == 0 else "a"),
+        )
+
+    assert run(scenario) == expected
+
+
+@pytest.mark.parametrize("other_owner, polled", [(False, 1), (True, 0)])
+def test_pass_renews_lease_between_groups(run, monkeypatch, label_map, other_owner, polled):
+    groups = []
+
+    async def poll_group(group, bot, bucket):
+        groups.append(group.params)
+        return 0
+
+    monkeypatch.setattr(subscriptions, "poll_group", poll_group)
+
+    async def scenario():
+        await subscriptions.subscribe(1)
+        await storage.execute("INSERT INTO user_settings (tg_user, key, value) VALUES (1, 'keyword', 'python')")
+        if other_owner:
+            # пока шёл проход, аренда истекла и её взял другой процесс
+            await storage.claim_lease(subscriptions.LEASE_NAME, "other", 600)
+        await subscriptions.run_once(None, lease=900)
+        (lease_until,) = await storage.fetchone(
+            "SELECT lease_until FROM job_leases WHERE name = ?", (subscriptions.LEASE_NAME,)
+        )
+        return lease_until - int(time.time())
+
+    left = run(scenario)
+    assert len(groups) == polled
+    assert left > (800 if polled else 500)
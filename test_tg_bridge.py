@@ -0,0 +1,82 @@
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import storage
+import tg_bridge
+from rate_limit import TokenBucket
+
+
+class FakeBot:
+    """Отвечает на send_message; floods — сколько раз подряд ответить RetryAfter."""
+
+    def __init__(self, floods: int = 0, blocked=()):
+        self.floods = floods
+        self.blocked = set(blocked)
+        self.delivered: list[int] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.floods:
+            self.floods -= 1
+            raise TelegramRetryAfter(None, "Too Many Requests", 0)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(None, "bot was blocked by the user")
+        self.delivered.append(chat_id)
+
+
+async def _users(*chats: int) -> None:
+    await storage.executemany("INSERT INTO users (chat_id) VALUES (?)", [(c,) for c in chats])
+
+
+async def _progress(campaign_id: int) -> tuple:
+    return await storage.fetchone(
+        "SELECT last_chat_id, sent, failed FROM broadcasts WHERE id = ?", (campaign_id,)
+    )
+
+
+def test_flood_control_is_not_a_failed_attempt(run):
+    bot = FakeBot(floods=tg_bridge.SEND_ATTEMPTS + 2)
+
+    async def scenario():
+        return await tg_bridge.send_text(bot, TokenBucket(1000, 1000), 1, "hi")
+
+    assert run(scenario) is True
+    assert bot.delivered == [1]
+
+
+def test_campaign_counts_failures_and_moves_cursor(run):
+    bot = FakeBot(floods=4, blocked={3})
+
+    async def scenario():
+        await _users(1, 2, 3, 4, 5)
+        campaign = await tg_bridge.create_campaign("news")
+        result = await tg_bridge.run_campaign(campaign, bot)
+        return result, await _progress(campaign)
+
+    result, progress = run(scenario)
+    assert result == (4, 1)
+    assert progress == (5, 4, 1)
+    assert sorted(bot.delivered) == [1, 2, 4, 5]
+
+
+def test_campaign_resumes_after_cursor(run):
+    bot = FakeBot()
+
+    async def scenario():
+        await _users(1, 2, 3)
+        campaign = await tg_bridge.create_campaign("news")
+        # прошлый запуск успел разослать первую страницу
+        await storage.execute(
+            "UPDATE broadcasts SET last_chat_id = 2, sent = 2 WHERE id = ?", (campaign,)
+        )
+        return await tg_bridge.run_campaign(campaign, bot)
+
+    assert run(scenario) == (3, 0)
+    assert bot.delivered == [3]
+
+
+def test_unknown_campaign_is_an_error(run):
+    async def scenario():
+        with pytest.raises(ValueError):
+            await tg_bridge.run_campaign(404, FakeBot())
+
+    run(scenario)
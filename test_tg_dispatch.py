@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from aiogram import types
+
+from tg_updates import text_update
+from tg_dispatch import UserOrderedDispatcher
+
+
+def _update(update_id: int, user_id: int = 1) -> types.Update:
+    return types.Update.model_validate(text_update(update_id, user_id, "x"))
+
+
+def test_updates_of_one_user_run_in_order_and_users_in_parallel():
+    active: dict[int, int] = {}
+    order: list[int] = []
+    overlap = []
+
+    async def handler(update):
+        uid = update.message.from_user.id
+        active[uid] = active.get(uid, 0) + 1
+        overlap.append(sum(1 for n in active.values() if n))
+        assert active[uid] == 1
+        await asyncio.sleep(0.01)
+        if uid == 1:
+            order.append(update.update_id)
+        active[uid] -= 1
+
+    async def scenario():
+        dispatcher = UserOrderedDispatcher(handler, workers=4, batch=2)
+        for i in range(6):
+            await dispatcher.submit(_update(i, 1))
+            await dispatcher.submit(_update(100 + i, 2))
+        await dispatcher.stop()
+        return dispatcher.pending
+
+    assert asyncio.run(scenario()) == 0
+    assert order == list(range(6))
+    assert max(overlap) == 2
+
+
+def test_handler_error_reaches_waiting_submit():
+    async def handler(update):
+        raise ValueError("boom")
+
+    async def scenario():
+        dispatcher = UserOrderedDispatcher(handler, workers=1)
+        try:
+            with pytest.raises(ValueError):
+                await dispatcher.submit(_update(1), wait=True)
+        finally:
+            await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+
+def test_handler_cancellation_keeps_worker_and_user_alive():
+    handled = []
+
+    async def handler(update):
+        if update.update_id == 1:
+            raise asyncio.CancelledError()
+        handled.append(update.update_id)
+        return update.update_id
+
+    async def scenario():
+        dispatcher = UserOrderedDispatcher(handler, workers=1)
+        async with asyncio.timeout(1):
+            with pytest.raises(RuntimeError):
+                await dispatcher.submit(_update(1), wait=True)
+            await dispatcher.submit(_update(2))
+            result = await dispatcher.submit(_update(3), wait=True)
+            await dispatcher.stop()
+        return result, dispatcher.pending
+
+    assert asyncio.run(scenario()) == (3, 0)
+    assert handled == [2, 3]
+
+
+def test_stop_waits_for_queued_updates():
+    handled = []
+
+    async def handler(update):
+        await asyncio.sleep(0.005)
+        handled.append(update.update_id)
+
+    async def scenario():
+        dispatcher = UserOrderedDispatcher(handler, workers=2)
+        for i in range(5):
+            await dispatcher.submit(_update(i, i % 2))
+        await dispatcher.stop()
+        return dispatcher.running
+
+    assert asyncio.run(scenario()) is False
+    assert sorted(handled) == list(range(5))
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from tg_edits import EditCoalescer
+
+
+class FakeBot:
+    """Записывает правки; error — ответ Telegram на следующую правку."""
+
+    def __init__(self):
+        self.calls: list[tuple] = []
+        self.error: str | None = None
+
+    async def _call(self, *call):
+        self.calls.append(call)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise TelegramBadRequest(None, error)
+        return True
+
+    def edit_message_text(self, text, chat_id, message_id, reply_markup=None, parse_mode=None):
+        return self._call("text", chat_id, message_id, text, reply_markup)
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        return self._call("markup", chat_id, message_id, reply_markup)
+
+
+def _markup(label: str) -> types.InlineKeyboardMarkup:
+    button = types.InlineKeyboardButton(text=label, callback_data=label)
+    return types.InlineKeyboardMarkup(inline_keyboard=[[button]])
+
+
+def test_markup_toggles_coalesce_into_one_edit():
+    bot = FakeBot()
+    edits = EditCoalescer(bot, debounce=0.01)
+
+    async def scenario():
+        for label in ("a", "b", "c"):
+            edits.edit(1, 10, markup=_markup(label))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert bot.calls == [("markup", 1, 10, _markup("c"))]
+    assert edits.coalesced == 2
+
+
+def test_unchanged_state_is_not_sent_again():
+    bot = FakeBot()
+    edits = EditCoalescer(bot, debounce=0.01)
+
+    async def scenario():
+        sent = await edits.edit_now(1, 10, "hello", _markup("a"))
+        again = await edits.edit_now(1, 10, "hello", _markup("a"))
+        edits.edit(1, 10, markup=_markup("a"))
+        await asyncio.sleep(0.05)
+        return sent, again
+
+    assert asyncio.run(scenario()) == (True, True)
+    assert len(bot.calls) == 1
+    assert edits.skipped == 2
+
+
+def test_text_edit_absorbs_pending_markup():
+    bot = FakeBot()
+    edits = EditCoalescer(bot, debounce=0.05)
+
+    async def scenario():
+        edits.edit(1, 10, markup=_markup("a"))
+        await edits.edit_now(1, 10, "menu", _markup("b"))
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert bot.calls == [("text", 1, 10, "menu", _markup("b"))]
+
+
+@pytest.mark.parametrize("error", [
+    "Bad Request: message to edit not found",
+    "Bad Request: message can't be edited",
+])
+def test_missing_message_calls_on_missing(error):
+    bot = FakeBot()
+    bot.error = error
+    edits = EditCoalescer(bot)
+    resent = []
+
+    async def on_missing(chat_id, text, markup, html):
+        resent.append((chat_id, text, html))
+
+    async def scenario():
+        return await edits.edit_now(1, 10, "menu", None, True, on_missing=on_missing)
+
+    assert asyncio.run(scenario()) is False
+    assert resent == [(1, "menu", True)]
+
+
+def test_text_edit_errors_reach_caller():
+    bot = FakeBot()
+    bot.error = "Bad Request: can't parse entities"
+    edits = EditCoalescer(bot, debounce=0.01)
+
+    async def scenario():
+        with pytest.raises(TelegramBadRequest):
+            await edits.edit_now(1, 10, "<b>", None, True)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    # ошибку получил обработчик — в фоне правка не повторяется
+    assert len(bot.calls) == 1
@@ -0,0 +1,50 @@
+import tg_register
+from tg_router import CallbackRouter
+
+
+async def on_menu(call, arg):
+    return "menu"
+
+
+async def on_region(call, arg):
+    return "region"
+
+
+async def on_region_moscow(call, arg):
+    return "moscow"
+
+
+def _router() -> CallbackRouter:
+    router = CallbackRouter()
+    router.exact("back_menu", "open_menu")(on_menu)
+    router.prefix("region_")(on_region)
+    router.add_prefix("region_suggest_", on_region_moscow)
+    return router
+
+
+def test_exact_keys_win_and_return_no_argument():
+    router = _router()
+    assert router.resolve("back_menu") == (on_menu, "", "back_menu")
+    assert router.resolve("open_menu") == (on_menu, "", "open_menu")
+
+
+def test_longest_prefix_wins_and_tail_is_the_argument():
+    router = _router()
+    assert router.resolve("region_suggest_1") == (on_region_moscow, "1", "region_suggest_")
+    assert router.resolve("region_other") == (on_region, "other", "region_")
+    assert router.resolve("region_") == (on_region, "", "region_")
+
+
+def test_unknown_data_is_not_routed():
+    router = _router()
+    assert router.resolve("regio") is None
+    assert router.resolve("back_menu_extra") is None
+    assert router.resolve("") is None
+
+
+def test_bot_callbacks_resolve_to_their_handlers():
+    router = tg_register.router
+    _, arg, route = router.resolve("schedule_suggest_полный день")
+    assert (arg, route) == ("полный день", "schedule_suggest_")
+    assert router.resolve("select_resume_abc")[1:] == ("abc", "select_resume_")
+    assert router.resolve("open_settings")[2] == "open_settings"
@@ -0,0 +1,40 @@
+import json
+import asyncio
+
+import tracing
+from tg_edits import EditCoalescer
+
+
+def test_traces_are_written_by_background_thread(tmp_path, monkeypatch):
+    path = tmp_path / "traces.ndjson"
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE", 1.0)
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    monkeypatch.setattr(tracing, "TRACE_EXPORT", "all")
+
+    for update_id in range(3):
+        with tracing.trace("tg.update", update_id=update_id):
+            with tracing.span("hh.request"):
+                pass
+    tracing.close()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [r["root"]["attrs"]["update_id"] for r in records] == [0, 1, 2]
+    assert tracing._lines is None
+
+
+def test_edit_timer_does_not_inherit_update_trace(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE", 1.0)
+    seen = []
+
+    class Bot:
+        async def edit_message_reply_markup(self, **kwargs):
+            seen.append(tracing.current())
+
+    async def scenario():
+        edits = EditCoalescer(Bot(), debounce=0.01)
+        with tracing.trace("tg.update"):
+            edits.edit(1, 10, markup=None)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert seen == [None]
@@ -0,0 +1,50 @@
+import json
+
+import update_capture
+from tg_updates import callback_update, text_update
+
+SALT = b"test-salt"
+
+
+def test_user_and_chat_ids_are_pseudonymized_consistently():
+    payload = text_update(1, 42, "/start")
+    payload["message"]["from"].update(last_name="Иванов", username="ivanov")
+
+    masked = update_capture.anonymize(payload, SALT)
+    message = masked["message"]
+    assert message["from"]["id"] == message["chat"]["id"] != 42
+    assert message["from"]["id"] == update_capture.pseudonym(42, SALT)
+    assert "last_name" not in message["from"] and "username" not in message["from"]
+    assert message["from"]["first_name"] == "user"
+    assert masked["update_id"] == 1
+
+
+def test_input_text_is_replaced_with_same_shape():
+    keyword = update_capture.anonymize(text_update(1, 42, "Python Django"), SALT)
+    salary = update_capture.anonymize(text_update(2, 42, "150000"), SALT)
+    command = update_capture.anonymize(text_update(3, 42, "/start ref_Ivan"), SALT)
+
+    assert keyword["message"]["text"] == "Xxxxxx Xxxxxx"
+    assert salary["message"]["text"] == "000000"
+    assert command["message"]["text"] == "/start xxx_Xxxx"
+
+
+def test_callback_data_survives_but_message_text_does_not():
+    payload = callback_update(1, 42, "toggle:schedule:полный день")
+    payload["callback_query"]["message"]["text"] = "Ключевое слово: python"
+
+    masked = update_capture.anonymize(payload, SALT)["callback_query"]
+    assert masked["data"] == "toggle:schedule:полный день"
+    assert masked["message"]["text"] == "Xxxxxxxx xxxxx: xxxxxx"
+
+
+def test_recorder_writes_masked_ndjson(tmp_path):
+    path = tmp_path / "updates.ndjson"
+    recorder = update_capture.UpdateRecorder(str(path), sample=1.0, salt="s")
+    recorder.record(text_update(1, 42, "секретный промпт"))
+    recorder.close()
+
+    (line,) = path.read_text(encoding="utf-8").splitlines()
+    record = json.loads(line)
+    assert record["update"]["message"]["text"] == "xxxxxxxxx xxxxxx"
+    assert "секрет" not in line
@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+
+import storage
+import tg_register
+import update_dedup
+from tg_updates import text_update
+from tg_dispatch import UserOrderedDispatcher
+
+
+def test_memory_dedup_window_and_forget():
+    seen = update_dedup.SeenUpdates(window=600, size=100)
+
+    async def scenario():
+        first = await seen.first_seen(1)
+        again = await seen.first_seen(1)
+        await seen.forget(1)
+        return first, again, await seen.first_seen(1)
+
+    assert asyncio.run(scenario()) == (True, False, True)
+
+
+def test_memory_dedup_is_bounded():
+    seen = update_dedup.SeenUpdates(window=600, size=3)
+
+    async def scenario():
+        for update_id in range(5):
+            await seen.first_seen(update_id)
+        return len(seen._seen), await seen.first_seen(0)
+
+    size, evicted_is_new = asyncio.run(scenario())
+    assert size <= 3
+    assert evicted_is_new
+
+
+def test_sqlite_dedup_is_shared_between_processes(run):
+    async def scenario():
+        first, second = update_dedup.SqliteSeenUpdates(), update_dedup.SqliteSeenUpdates()
+        return await first.first_seen(7), await second.first_seen(7)
+
+    assert run(scenario) == (True, False)
+
+
+def test_sqlite_dedup_failed_insert_is_not_remembered(run, monkeypatch):
+    seen = update_dedup.SqliteSeenUpdates()
+    real_execute = storage.execute
+
+    async def locked(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    async def scenario():
+        monkeypatch.setattr(storage, "execute", locked)
+        try:
+            await seen.first_seen(9)
+        except RuntimeError:
+            pass
+        monkeypatch.setattr(storage, "execute", real_execute)
+        return await seen.first_seen(9)
+
+    assert run(scenario) is True
+
+
+def test_webhook_redelivery_after_dedup_failure_is_processed(run, monkeypatch):
+    handled = []
+
+    async def handler(update):
+        handled.append(update.update_id)
+
+    real_execute = storage.execute
+    state = {"fail": True}
+
+    async def flaky(sql, params=()):
+        if state["fail"]:
+            raise RuntimeError("database is locked")
+        return await real_execute(sql, params)
+
+    monkeypatch.setattr(storage, "execute", flaky)
+    monkeypatch.setattr(tg_register, "seen_updates", update_dedup.SqliteSeenUpdates())
+    monkeypatch.setattr(tg_register, "dispatcher", UserOrderedDispatcher(handler, workers=2))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=tg_register.app, raise_app_exceptions=False)
+        url = f"/bot{tg_register.BOT_TOKEN}"
+        payload = text_update(42, 1, "hello")
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            failed = await client.post(url, json=payload)
+            state["fail"] = False
+            retried = await client.post(url, json=payload)
+            duplicate = await client.post(url, json=payload)
+        await tg_register.dispatcher.stop()
+        return failed.status_code, retried.status_code, duplicate.status_code
+
+    assert run(scenario) == (500, 200, 200)
+    assert handled == [42]
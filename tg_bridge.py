@@ -1,41 +1,179 @@
 import os
 import sys
+import time
 import asyncio
 import logging
+from typing import AsyncIterator
 
-import aiosqlite
 from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+import storage
+import migrate_settings
+from rate_limit import TokenBucket
 
 # Загрузка токена бота из переменных окружения
 TOKEN = os.getenv("TG_BOT_TOKEN")
 
+# Telegram допускает ~30 сообщений в секунду на бота; берём с запасом
+BROADCAST_RATE = float(os.getenv("TG_BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("TG_BROADCAST_CONCURRENCY", "20"))
+# прогресс сохраняется после каждой страницы chat_id
+BROADCAST_PAGE = int(os.getenv("TG_BROADCAST_PAGE", "200"))
+SEND_ATTEMPTS = 3
+
 # Настройка логгера
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def _get_all_chats() -> list[int]:
+
+async def _iter_chat_pages(after: int, page: int = BROADCAST_PAGE) -> AsyncIterator[list[int]]:
     """
-    Возвращает список chat_id всех пользователей из таблицы users.
+    Постранично отдаёт chat_id из таблицы users по возрастанию,
+    начиная после курсора after (keyset-пагинация, без OFFSET).
     """
-    async with aiosqlite.connect("tg_users.db") as db:
-        cur = await db.execute("SELECT chat_id FROM users")
-        rows = await cur.fetchall()
-    return [r[0] for r in rows]
+    while True:
+        rows = await storage.fetchall(
+            "SELECT chat_id FROM users WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+            (after, page),
+        )
+        if not rows:
+            return
+        chats = [r[0] for r in rows]
+        yield chats
+        after = chats[-1]
+
+
+async def create_campaign(text: str) -> int:
+    """Регистрирует рассылку и возвращает её id."""
+    async def _insert(db) -> int:
+        cur = await db.execute(
+            "INSERT INTO broadcasts (text, created_at) VALUES (?, ?)",
+            (text, int(time.time())),
+        )
+        return cur.lastrowid
+
+    return await storage.write(_insert)
 
-async def send_to_all(text: str):
+
+async def send_text(bot: Bot, bucket: TokenBucket, chat_id: int, text: str, **kwargs) -> bool:
     """
-    Отправляет сообщение text всем chat_id из БД.
+    Отправляет одно сообщение с учётом flood control; True — доставлено.
+    kwargs уходят в send_message (parse_mode и т. п.).
+    RetryAfter — не отказ, а просьба подождать: такие ответы не считаются
+    попытками, иначе долгий flood control «проваливал» бы чаты подряд.
     """
-    bot = Bot(token=TOKEN)
-    for chat_id in await _get_all_chats():
+    attempts = 0
+    while attempts < SEND_ATTEMPTS:
+        await bucket.acquire()
         try:
-            await bot.send_message(chat_id, text)
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except TelegramRetryAfter as e:
+            # flood control касается всего бота — тормозим общее ведро
+            bucket.pause(e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            attempts += 1
+            logger.warning("Временная ошибка при отправке %s: %s", chat_id, e)
+            await asyncio.sleep(1)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован или чат удалён — повторять нет смысла
+            logger.info("Чат %s недоступен: %s", chat_id, e)
+            return False
         except Exception as e:
             logger.warning("Не удалось отправить сообщение %s: %s", chat_id, e)
-    # Закрываем сессию бота
-    await bot.session.close()
+            return False
+    return False
+
+
+async def run_campaign(campaign_id: int, bot: Bot) -> tuple[int, int]:
+    """
+    Досылает рассылку campaign_id, начиная с сохранённого курсора.
+    Внутри страницы сообщения уходят параллельно (не больше
+    BROADCAST_CONCURRENCY, не быстрее BROADCAST_RATE в секунду); каждому
+    чату — одно сообщение, так что лимит Telegram «1 в секунду на чат»
+    соблюдается сам собой. При обрыве повторно уйдёт не больше одной страницы.
+    """
+    row = await storage.fetchone(
+        "SELECT text, last_chat_id, sent, failed FROM broadcasts WHERE id = ?",
+        (campaign_id,),
+    )
+    if row is None:
+        raise ValueError(f"Рассылка {campaign_id} не найдена")
+    text, cursor, sent, failed = row
+    bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def _bounded(chat_id: int) -> bool:
+        async with sem:
+            return await send_text(bot, bucket, chat_id, text)
+
+    async for chats in _iter_chat_pages(cursor):
+        results = await asyncio.gather(*(_bounded(c) for c in chats))
+        ok = sum(results)
+        sent += ok
+        failed += len(results) - ok
+        await storage.execute(
+            "UPDATE broadcasts SET last_chat_id = ?, sent = ?, failed = ? WHERE id = ?",
+            (chats[-1], sent, failed, campaign_id),
+        )
+        logger.info("Рассылка %s: отправлено %d, ошибок %d", campaign_id, sent, failed)
+
+    await storage.execute(
+        "UPDATE broadcasts SET finished_at = ? WHERE id = ?",
+        (int(time.time()), campaign_id),
+    )
+    return sent, failed
+
+
+async def unfinished_campaigns() -> list[int]:
+    rows = await storage.fetchall(
+        "SELECT id FROM broadcasts WHERE finished_at IS NULL ORDER BY id"
+    )
+    return [r[0] for r in rows]
+
+
+async def send_to_all(text: str) -> int:
+    """
+    Отправляет сообщение text всем chat_id из БД; возвращает id рассылки.
+    """
+    bot = Bot(token=TOKEN)
+    try:
+        await migrate_settings.migrate()
+        campaign_id = await create_campaign(text)
+        await run_campaign(campaign_id, bot)
+    finally:
+        # Закрываем сессию бота и соединения с БД
+        await bot.session.close()
+        await storage.close_db()
+    return campaign_id
+
+
+async def resume(campaign_id: int | None = None) -> None:
+    """Продолжает указанную рассылку или все незавершённые."""
+    bot = Bot(token=TOKEN)
+    try:
+        await migrate_settings.migrate()
+        ids = [campaign_id] if campaign_id else await unfinished_campaigns()
+        for cid in ids:
+            await run_campaign(cid, bot)
+    finally:
+        await bot.session.close()
+        await storage.close_db()
+
 
 if __name__ == "__main__":
     # Запуск рассылки из командной строки: python tg_bridge.py "Ваше сообщение"
-    message = " ".join(sys.argv[1:]) if len(sys.argv) > 1 else "Hello from tg_bridge!"
-    asyncio.run(send_to_all(message))
\ No newline at end of file
+    # Продолжить прерванные: python tg_bridge.py --resume [id]
+    if sys.argv[1:2] == ["--resume"]:
+        asyncio.run(resume(int(sys.argv[2]) if len(sys.argv) > 2 else None))
+    else:
+        message = " ".join(sys.argv[1:]) if len(sys.argv) > 1 else "Hello from tg_bridge!"
+        asyncio.run(send_to_all(message))
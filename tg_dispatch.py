@@ -0,0 +1,154 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram import types
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+UpdateHandler = Callable[[types.Update], Awaitable[Any]]
+
+
+def update_user_key(update: types.Update) -> Hashable:
+    """Ключ шарда: id пользователя; апдейты без пользователя идут сами по себе."""
+    for event in (update.callback_query, update.message, update.edited_message):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return ("update", update.update_id)
+
+
+class UserOrderedDispatcher:
+    """
+    Апдейты одного пользователя обрабатываются строго по очереди,
+    разных пользователей — параллельно, не более workers одновременно.
+
+    У каждого пользователя своя очередь; в общей очереди готовых стоит
+    не больше одной ссылки на пользователя, поэтому его апдейты никогда
+    не выполняются двумя воркерами сразу. Воркер берёт у пользователя
+    не больше batch апдейтов подряд и возвращает его в конец — так
+    активный пользователь не занимает воркер навсегда. Число апдейтов
+    в работе ограничено max_pending: submit() ждёт (backpressure).
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        workers: int = 8,
+        max_pending: int = 1000,
+        batch: int = 8,
+        key: Callable[[types.Update], Hashable] = update_user_key,
+    ):
+        self._handler = handler
+        self._workers = workers
+        self._max_pending = max_pending
+        self._batch = batch
+        self._key = key
+        self._queues: dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._idle: asyncio.Event | None = None
+        self._pending = 0
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self._max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def submit(self, update: types.Update, wait: bool = False) -> Optional[Any]:
+        """
+        Ставит апдейт в очередь его пользователя. С wait=True дожидается
+        обработки и пробрасывает исключение обработчика.
+        """
+        if not self.running:
+            self.start()
+        await self._slots.acquire()
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        key = self._key(update)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.put_nowait(key)
+        # трасса вебхука продолжается в воркере (и ждёт его при wait=False)
+        queue.append((update, fut, tracing.hold(), time.perf_counter()))
+        self._pending += 1
+        self._idle.clear()
+        if fut is not None:
+            return await fut
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            try:
+                await self._run_batch(self._queues[key])
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # останавливают сам воркер (stop())
+                    raise
+                # отмена пришла из обработчика (таймаут и т. п.) — воркер живёт дальше
+            finally:
+                # пользователь освобождается при любом исходе, иначе его
+                # следующие апдейты навсегда останутся в очереди
+                if self._queues[key]:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                    if not self._pending:
+                        self._idle.set()
+
+    async def _run_batch(self, queue: deque) -> None:
+        for _ in range(self._batch):
+            if not queue:
+                break
+            update, fut, span, queued_at = queue.popleft()
+            try:
+                with tracing.resume(span):
+                    tracing.add_span("dispatch.queue", queued_at)
+                    result = await self._handler(update)
+            except Exception as e:
+                if fut is None:
+                    logger.exception("Ошибка обработки апдейта %s", update.update_id)
+                elif not fut.done():
+                    fut.set_exception(e)
+            except BaseException as e:
+                # отмена и т. п.: ожидающий вебхук получает обычную ошибку (500,
+                # Telegram повторит), а не зависает и не отменяется сам
+                logger.warning("Обработка апдейта %s прервана: %r", update.update_id, e)
+                if fut is not None and not fut.done():
+                    error = RuntimeError(f"Обработка апдейта {update.update_id} прервана")
+                    error.__cause__ = e
+                    fut.set_exception(error)
+                raise
+            else:
+                if fut is not None and not fut.done():
+                    fut.set_result(result)
+            finally:
+                self._pending -= 1
+                self._slots.release()
+
+    async def stop(self) -> None:
+        """Дорабатывает все очереди и останавливает воркеров."""
+        if not self.running:
+            return
+        await self._idle.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,246 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать следующих правок того же сообщения перед отправкой
+TG_EDIT_DEBOUNCE = float(os.getenv("TG_EDIT_DEBOUNCE", "0.25"))
+# Сколько сообщений помнить для пропуска правок «без изменений»
+TG_EDIT_MEMORY = int(os.getenv("TG_EDIT_MEMORY", "10000"))
+
+# вызывается, если сообщение для правки удалено или его нельзя редактировать:
+# (chat_id, текст, клавиатура, html)
+MissingHandler = Callable[[int, str, Optional[types.InlineKeyboardMarkup], bool], Awaitable[None]]
+
+_UNSET = object()
+
+
+def _is_missing(err: str) -> bool:
+    return "message to edit not found" in err or "message can't be edited" in err
+
+
+def _markup_key(markup: Optional[types.InlineKeyboardMarkup]) -> Optional[str]:
+    return markup.model_dump_json(exclude_none=True) if markup is not None else None
+
+
+class _Pending:
+    __slots__ = ("text", "html", "markup", "on_missing", "version")
+
+    def __init__(self):
+        self.text = _UNSET
+        self.html = False
+        self.markup = _UNSET
+        self.on_missing: Optional[MissingHandler] = None
+        self.version = 0
+
+
+class EditCoalescer:
+    """
+    Склеивает правки одного сообщения (chat_id, message_id): первая правка
+    запускает таймер на debounce секунд, последующие лишь заменяют текст
+    и/или клавиатуру, и по таймеру уходит один запрос. Новая клавиатура
+    без текста вливается в ожидающую правку текста. Правки, совпадающие
+    с уже отправленным состоянием, не отправляются вовсе.
+
+    Вызов edit() не ждёт отправки: обработчик апдейта завершается сразу,
+    и следующие нажатия того же пользователя успевают попасть в окно.
+    Ошибки такой правки только логируются, поэтому через edit() идут лишь
+    клавиатуры (переключатели). Текст правится через edit_now(): запрос
+    уходит сразу, а результат и ошибки получает вызывающий.
+    """
+
+    def __init__(self, bot: Bot, debounce: float = TG_EDIT_DEBOUNCE, memory: int = TG_EDIT_MEMORY):
+        self.bot = bot
+        self.debounce = debounce
+        self.memory = memory
+        self._pending: dict[tuple[int, int], _Pending] = {}
+        self._tasks: dict[tuple[int, int], asyncio.Task] = {}
+        # последнее отправленное состояние: (текст | None, html, клавиатура)
+        self._sent: "OrderedDict[tuple[int, int], tuple]" = OrderedDict()
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    def edit(
+        self,
+        chat_id: int,
+        message_id: int,
+        text=_UNSET,
+        markup=_UNSET,
+        html: bool = False,
+        on_missing: Optional[MissingHandler] = None,
+    ) -> None:
+        """Ставит правку в очередь; text/markup, не переданные явно, не меняются."""
+        key = (chat_id, message_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending()
+        else:
+            self.coalesced += 1
+        if text is not _UNSET:
+            pending.text = text
+            pending.html = html
+        if markup is not _UNSET:
+            pending.markup = markup
+        if on_missing is not None:
+            pending.on_missing = on_missing
+        pending.version += 1
+        if key not in self._tasks:
+            self._start(key)
+
+    async def edit_now(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        markup: Optional[types.InlineKeyboardMarkup] = None,
+        html: bool = False,
+        on_missing: Optional[MissingHandler] = None,
+    ) -> bool:
+        """
+        Правит текст без окна и ждёт ответа. Ожидающая правка клавиатуры
+        того же сообщения поглощается: уходит одна правка с последним
+        состоянием. Правка, совпадающая с отправленной, пропускается.
+        Если сообщения нет или его нельзя редактировать, вызывает
+        on_missing и возвращает False; прочие ошибки Telegram пробрасываются.
+        """
+        key = (chat_id, message_id)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending()
+        pending.text, pending.html, pending.markup = text, html, markup
+        if on_missing is not None:
+            pending.on_missing = on_missing
+        pending.version += 1
+        version = pending.version
+        try:
+            return await self._flush(key)
+        except BaseException:
+            # ошибку получил вызывающий — повторять правку в фоне не нужно
+            if self._pending.get(key) is pending and pending.version == version:
+                del self._pending[key]
+            raise
+        finally:
+            # правка пришла во время запроса — её отправит обычный таймер
+            if key in self._pending and key not in self._tasks:
+                self._start(key)
+
+    def _start(self, key: tuple[int, int]) -> None:
+        # таймер переживает апдейт, который его запустил, — без его трассы
+        with tracing.detached():
+            self._tasks[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: tuple[int, int]) -> None:
+        """Одна задача на сообщение: шлёт последнее состояние, пока оно меняется."""
+        try:
+            await asyncio.sleep(self.debounce)
+            while key in self._pending:
+                try:
+                    await self._flush(key)
+                except TelegramRetryAfter as e:
+                    # за время паузы могут прийти новые правки — уйдёт последняя
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                if key in self._pending:
+                    # правки пришли во время запроса — выдерживаем новое окно
+                    await asyncio.sleep(self.debounce)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Не удалось отредактировать сообщение %s", key)
+            self._pending.pop(key, None)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def _flush(self, key: tuple[int, int]) -> bool:
+        """
+        Отправляет текущее состояние; убирает его из очереди, если оно не
+        менялось. False — сообщения для правки больше нет.
+        """
+        pending = self._pending[key]
+        version = pending.version
+        text, html = pending.text, pending.html
+        markup = pending.markup if pending.markup is not _UNSET else None
+        markup_key = _markup_key(markup)
+        chat_id, message_id = key
+        last_text, last_html, last_markup = self._sent.get(key, (None, False, _UNSET))
+
+        def _done() -> None:
+            if pending.version == version and self._pending.get(key) is pending:
+                del self._pending[key]
+
+        if text is _UNSET:
+            if markup_key == last_markup:
+                self.skipped += 1
+                _done()
+                return True
+            request = self.bot.edit_message_reply_markup(
+                chat_id=chat_id, message_id=message_id, reply_markup=markup
+            )
+            state = (last_text, last_html, markup_key)
+        else:
+            if (text, html, markup_key) == (last_text, last_html, last_markup):
+                self.skipped += 1
+                _done()
+                return True
+            request = self.bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=markup,
+                parse_mode="HTML" if html else None,
+            )
+            state = (text, html, markup_key)
+
+        try:
+            await request
+        except TelegramBadRequest as e:
+            err = str(e).lower()
+            if _is_missing(err):
+                # сообщения больше нет (или оно слишком старое) — дальнейшие
+                # правки ему бессмысленны
+                self._pending.pop(key, None)
+                self._sent.pop(key, None)
+                if pending.on_missing is not None and text is not _UNSET:
+                    await pending.on_missing(chat_id, text, markup, html)
+                return False
+            if "message is not modified" not in err:
+                _done()
+                raise
+        self.sent += 1
+        self._sent[key] = state
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.memory:
+            self._sent.popitem(last=False)
+        _done()
+        return True
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        """Сбрасывает запомненное состояние (сообщение изменили в обход)."""
+        self._sent.pop((chat_id, message_id), None)
+
+    async def flush(self) -> None:
+        """Отправляет все ожидающие правки, не дожидаясь таймеров (остановка)."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for key in list(self._pending):
+            try:
+                await self._flush(key)
+            except Exception:
+                logger.exception("Не удалось отредактировать сообщение %s", key)
+            self._pending.pop(key, None)
@@ -1,8 +1,8 @@
 import os
+import time
 import logging
 from dotenv import load_dotenv
 
-import aiosqlite
 from fastapi import FastAPI, Request, HTTPException
 from aiogram import Bot, types
 from aiogram.exceptions import TelegramBadRequest
@@ -11,6 +11,7 @@ import html
 from settings_utils import (
     save_user_setting,
     get_user_setting,
+    get_user_settings,
     build_settings_keyboard,
     build_main_menu_keyboard,
     set_pending,
@@ -18,6 +19,19 @@ from settings_utils import (
 )
 from resume_utils import build_resume_keyboard
 import hh_api
+import areas
+import search_filters
+import subscriptions
+from tg_router import CallbackRouter
+from tg_dispatch import UserOrderedDispatcher
+from update_dedup import make_seen_updates
+from update_capture import make_recorder
+from tg_edits import EditCoalescer
+import storage
+import metrics
+import tracing
+import migrate_settings
+import sessions
 
 # ────────── базовая инициализация ──────────
 load_dotenv()
@@ -29,29 +43,30 @@ if not BOT_TOKEN:
     raise RuntimeError("TG_BOT_TOKEN not set")
 
 bot = Bot(token=BOT_TOKEN)
+metrics.instrument_bot(bot)
+tracing.instrument_bot(bot)
+# правки сообщений уходят через склейщик (см. tg_edits)
+edits = EditCoalescer(bot)
 app = FastAPI()
+metrics.instrument_app(app, "bot")
 
-DB_PATH = "tg_users.db"
-
-# ────────── helpers ──────────
-async def get_user_token(tg_user: int) -> str | None:
-    """
-    Читаем access_token из таблицы user_tokens.
-    Возвращаем None, если запись не найдена.
-    """
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT access_token FROM user_tokens WHERE tg_user = ?",
-            (tg_user,),
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
-
+UPDATE_SECONDS = metrics.histogram("tg_update_seconds", "Обработка апдейта по типу", ("kind",))
+UPDATE_QUERIES = metrics.histogram(
+    "tg_update_sqlite_queries", "Обращений к SQLite за апдейт", ("kind",), buckets=metrics.COUNT_BUCKETS
+)
+UPDATE_ERRORS = metrics.counter("tg_update_errors_total", "Апдейты, упавшие с исключением", ("kind",))
+DUPLICATE_UPDATES = metrics.counter("tg_updates_duplicate_total", "Повторы апдейтов, отброшенные вебхуком")
+metrics.callback(
+    "telegram_edits_total", "Правки сообщений через склейщик",
+    lambda: {"sent": edits.sent, "coalesced": edits.coalesced, "skipped": edits.skipped},
+    ("result",), kind="counter",
+)
 
 # ────────── подсказки ──────────
-SCHEDULE_SUGGESTIONS = ["полный день", "гибкий график", "сменный график"]
-WORK_FORMAT_SUGGESTIONS = ["дистанционно", "офис", "гибрид"]
-EMPLOYMENT_TYPE_SUGGESTIONS = ["полная", "частичная", "проектная", "стажировка"]
+# подписи и их соответствие справочникам HH — в search_filters
+SCHEDULE_SUGGESTIONS = list(search_filters.SCHEDULE_LABELS)
+WORK_FORMAT_SUGGESTIONS = list(search_filters.WORK_FORMAT_LABELS)
+EMPLOYMENT_TYPE_SUGGESTIONS = list(search_filters.EMPLOYMENT_LABELS)
 
 MULTI_KEYS = {
     "schedule": SCHEDULE_SUGGESTIONS,
@@ -87,7 +102,29 @@ def build_inline_suggestions(
     return types.InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def build_region_suggestions(
+    suggestions: list[hh_api.AreaSuggestion],
+) -> types.InlineKeyboardMarkup:
+    """Кнопки выбора региона из найденных вариантов."""
+    rows = [
+        [
+            types.InlineKeyboardButton(
+                text=s.name, callback_data=f"region_suggest_{s.id}"
+            )
+        ]
+        for s in suggestions
+    ]
+    rows.append([
+        types.InlineKeyboardButton(
+            text="⬅️ Назад", callback_data="back_settings"
+        )
+    ])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 async def toggle_multi_value(user_id: int, key: str, value: str) -> set[str]:
+    # чтение-изменение-запись через сессию: корректно, пока бот один
+    # (sessions.hold_ownership на старте)
     curr = await get_user_setting(user_id, key) or ""
     items = {v.strip() for v in curr.split(",") if v.strip()}
     if value in items:
@@ -102,13 +139,13 @@ async def build_filters_summary(uid: int) -> str:
     def esc(v):
         return html.escape(str(v)) if v else "—"
 
-    region_raw = await get_user_setting(uid, "region")
-    region = esc(await hh_api.area_name(region_raw))
-    salary = esc(await get_user_setting(uid, "salary") or "—")
-    schedule = esc(await get_user_setting(uid, "schedule") or "—")
-    work_fmt = esc(await get_user_setting(uid, "work_format") or "—")
-    employ = esc(await get_user_setting(uid, "employment_type") or "—")
-    keyword = esc(await get_user_setting(uid, "keyword") or "—")
+    settings = await get_user_settings(uid)
+    region = esc(await hh_api.area_name(settings.get("region")))
+    salary = esc(settings.get("salary") or "—")
+    schedule = esc(settings.get("schedule") or "—")
+    work_fmt = esc(settings.get("work_format") or "—")
+    employ = esc(settings.get("employment_type") or "—")
+    keyword = esc(settings.get("keyword") or "—")
 
     return (
     "<b>📋 Ваши действующие фильтры</b>\n"
@@ -131,16 +168,8 @@ def build_oauth_url(tg_user: int) -> str:
 
 
 async def safe_edit_markup(message: types.Message, markup: types.InlineKeyboardMarkup | None = None):
-    """Обновить reply_markup; игнорировать BadRequest, если не изменилось."""
-    try:
-        await bot.edit_message_reply_markup(
-            chat_id=message.chat.id,
-            message_id=message.message_id,
-            reply_markup=markup,
-        )
-    except TelegramBadRequest as e:
-        if "message is not modified" not in str(e):
-            raise
+    """Обновить reply_markup; частые нажатия склеиваются в одну правку."""
+    edits.edit(message.chat.id, message.message_id, markup=markup)
 
 
 async def safe_edit_text(
@@ -149,58 +178,48 @@ async def safe_edit_text(
     markup: types.InlineKeyboardMarkup | None,
     html: bool = False,
 ):
-    """Безопасно обновить текст сообщения и клавиатуру."""
-    try:
-        await bot.edit_message_text(
-            text=text,
-            chat_id=message.chat.id,
-            message_id=message.message_id,
-            reply_markup=markup,
-            parse_mode="HTML" if html else None,
-        )
-    except TelegramBadRequest as e:
-        if "message is not modified" not in str(e):
-            raise
+    """
+    Обновить текст сообщения и клавиатуру. Если сообщение уже нельзя
+    редактировать, ответ приходит новым сообщением; прочие ошибки
+    Telegram пробрасываются обработчику.
+    """
+    await edits.edit_now(
+        message.chat.id, message.message_id, text, markup, html,
+        on_missing=_send_instead,
+    )
+
+
+async def _send_instead(
+    chat_id: int,
+    text: str,
+    markup: types.InlineKeyboardMarkup | None,
+    html: bool,
+) -> None:
+    await bot.send_message(
+        chat_id, text, reply_markup=markup, parse_mode="HTML" if html else None
+    )
 
 
 async def get_settings_msg_id(uid: int) -> int | None:
     """Возвращает сохранённый msg_id сообщения настроек."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            async with db.execute(
-                "SELECT settings_msg_id FROM users WHERE chat_id = ?",
-                (uid,),
-            ) as cur:
-                row = await cur.fetchone()
-                return row[0] if row else None
-        except aiosqlite.OperationalError as e:
-            if "no such column" in str(e).lower():
-                await db.execute(
-                    "ALTER TABLE users ADD COLUMN settings_msg_id INTEGER"
-                )
-                await db.commit()
-                return None
-            raise
+    return (await sessions.get_session(uid)).settings_msg_id
 
 
 async def set_settings_msg_id(uid: int, msg_id: int) -> None:
-    """Сохраняет msg_id сообщения настроек."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute(
-                "UPDATE users SET settings_msg_id = ? WHERE chat_id = ?",
-                (msg_id, uid),
-            )
-        except aiosqlite.OperationalError as e:
-            if "no such column" in str(e).lower():
-                await db.execute(
-                    "ALTER TABLE users ADD COLUMN settings_msg_id INTEGER"
-                )
-                await db.execute(
-                    "UPDATE users SET settings_msg_id = ? WHERE chat_id = ?",
-                    (msg_id, uid),
-                )
-        await db.commit()
+    """Сохраняет msg_id сообщения настроек (в БД — при сбросе сессий)."""
+    (await sessions.get_session(uid)).set_settings_msg_id(msg_id)
+
+
+async def _resend_settings_message(
+    uid: int,
+    text: str,
+    markup: types.InlineKeyboardMarkup | None,
+    html: bool,
+) -> None:
+    new_msg = await bot.send_message(
+        uid, text, reply_markup=markup, parse_mode="HTML" if html else None
+    )
+    await set_settings_msg_id(uid, new_msg.message_id)
 
 
 async def safe_edit_text_by_id(
@@ -210,26 +229,13 @@ async def safe_edit_text_by_id(
     markup: types.InlineKeyboardMarkup | None,
     html: bool = False,
 ):
-    """Редактирует сообщение по id, отправляя новое при ошибке."""
+    """Редактирует сообщение по id, отправляя новое, если его нельзя отредактировать."""
     if msg_id is None:
-        new_msg = await bot.send_message(uid, text, reply_markup=markup)
-        await set_settings_msg_id(uid, new_msg.message_id)
+        await _resend_settings_message(uid, text, markup, html)
         return
-    try:
-        await bot.edit_message_text(
-            text=text,
-            chat_id=uid,
-            message_id=msg_id,
-            reply_markup=markup,
-            parse_mode="HTML" if html else None,
-        )
-    except TelegramBadRequest as e:
-        err = str(e).lower()
-        if "message to edit not found" in err:
-            new_msg = await bot.send_message(uid, text, reply_markup=markup)
-            await set_settings_msg_id(uid, new_msg.message_id)
-        elif "message is not modified" not in err:
-            raise
+    await edits.edit_now(
+        uid, msg_id, text, markup, html, on_missing=_resend_settings_message,
+    )
 
 
 async def safe_delete(message: types.Message) -> None:
@@ -246,6 +252,16 @@ async def safe_delete(message: types.Message) -> None:
 # ────────── FastAPI lifecycle ──────────
 @app.on_event("startup")
 async def _startup():
+    await storage.init_db()
+    await migrate_settings.migrate()
+    await hh_api.open_pool()
+    # сессии в памяти процесса: второй воркер бота не стартует
+    await sessions.hold_ownership()
+    areas.start_background_refresh(hh_api.fetch_area_tree)
+    dispatcher.start()
+    # опрос подписок тоже под арендой job_leases (на случай отдельного процесса)
+    if os.getenv("SUBSCRIPTIONS", "1") == "1":
+        subscriptions.start_scheduler(bot)
     webhook = os.getenv("WEBHOOK_URL")
     if webhook:
         await bot.delete_webhook(drop_pending_updates=True)
@@ -255,206 +271,308 @@ async def _startup():
 
 @app.on_event("shutdown")
 async def _shutdown():
+    await dispatcher.stop()
+    await subscriptions.stop_scheduler()
+    await edits.flush()
+    await areas.stop_background_refresh()
     await bot.session.close()
+    await hh_api.close_pool()
+    await sessions.close()
+    await storage.close_db()
+    if recorder is not None:
+        recorder.close()
+    tracing.close()
 
 
-# ────────── main webhook ──────────
-@app.post("/bot{token:path}")
-async def telegram_webhook(request: Request, token: str):
-    if token != BOT_TOKEN:
-        raise HTTPException(status_code=403, detail="Invalid token")
+# ────────── callbacks ──────────
+router = CallbackRouter()
 
-    update = types.Update(**await request.json())
+BACK_TO_MENU_MARKUP = types.InlineKeyboardMarkup(
+    inline_keyboard=[
+        [types.InlineKeyboardButton(text="⬅️ В меню", callback_data="back_menu")]
+    ]
+)
 
-    # ===== CALLBACKS =====
-    if update.callback_query:
-        call = update.callback_query
-        uid = call.from_user.id
-        data = call.data
-
-        # ensure user row exists
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
-            await db.commit()
-
-        # === возврат в главное меню ===
-        if data == "back_menu":
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(uid, smsg, "📌 Главное меню:", build_main_menu_keyboard())
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-        # === открыть настройку фильтров ===
-        if data == "open_settings":
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(uid, smsg, "Ваши фильтры:", build_settings_keyboard())
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-        # === открыть резюме ===
-        if data == "open_resumes":
-            kb = await build_resume_keyboard(uid)
-            await safe_edit_text(
-                call.message,
-                "📄 Ваши резюме:",
-                kb,
-            )
-            return {"ok": True}
-
-        if data == "show_filters":
-            summary = await build_filters_summary(uid)
-            await safe_edit_text(
-                call.message,
-                summary,
-                types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="⬅️ В меню", callback_data="back_menu"
-                            )
-                        ]
-                    ]
-                ),
-                html=True,
-            )
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
-
-        if data == "back_settings":
-            smsg = await get_settings_msg_id(uid)
-            await safe_edit_text_by_id(
-                uid,
-                smsg,
-                "Ваши фильтры:",
-                build_settings_keyboard(),
-            )
-            await bot.answer_callback_query(call.id)
-            return {"ok": True}
 
+@router.exact("back_menu")
+async def on_back_menu(call: types.CallbackQuery, _: str):
+    uid = call.from_user.id
+    smsg = await get_settings_msg_id(uid)
+    menu = build_main_menu_keyboard(await subscriptions.is_subscribed(uid))
+    await safe_edit_text_by_id(uid, smsg, "📌 Главное меню:", menu)
+    await bot.answer_callback_query(call.id)
+
+
+@router.exact("open_settings", "back_settings")
+async def on_open_settings(call: types.CallbackQuery, _: str):
+    uid = call.from_user.id
+    smsg = await get_settings_msg_id(uid)
+    await safe_edit_text_by_id(uid, smsg, "Ваши фильтры:", build_settings_keyboard())
+    await bot.answer_callback_query(call.id)
+
+
+@router.exact("open_resumes")
+async def on_open_resumes(call: types.CallbackQuery, _: str):
+    kb = await build_resume_keyboard(call.from_user.id)
+    await safe_edit_text(call.message, "📄 Ваши резюме:", kb)
+
+
+@router.exact("show_filters")
+async def on_show_filters(call: types.CallbackQuery, _: str):
+    summary = await build_filters_summary(call.from_user.id)
+    await safe_edit_text(call.message, summary, BACK_TO_MENU_MARKUP, html=True)
+    await bot.answer_callback_query(call.id)
+
+
+@router.exact("toggle_subscription")
+async def on_toggle_subscription(call: types.CallbackQuery, _: str):
+    uid = call.from_user.id
+    if not await subscriptions.is_subscribed(uid):
+        params = await search_filters.compile_filters(await get_user_settings(uid))
+        if not params:
+            await bot(call.answer("Сначала настройте фильтры", show_alert=True))
+            return
+    subscribed = await subscriptions.toggle(uid)
+    await safe_edit_markup(call.message, build_main_menu_keyboard(subscribed))
+    await bot(call.answer(
+        "Буду присылать новые вакансии" if subscribed else "Уведомления выключены"
+    ))
+
+
+# ---------- запуск фильтров с текстовым вводом ----------
+TEXT_FILTER_PROMPTS = {
+    "region": "Введите название региона:",
+    "salary": "Введите минимальную зарплату (число):",
+    "keyword": "Введите ключевое слово:",
+}
 
-        # ---------- запуск фильтров ----------
-        if data.startswith("filter_"):
-            fkey = data.split("_", 1)[1]
 
-            if fkey == "region":
-                await set_pending(uid, "region")
-                await safe_edit_text(call.message, "Введите название региона:", None)
-                return {"ok": True}
+def _text_filter_handler(fkey: str):
+    async def handler(call: types.CallbackQuery, _: str):
+        await set_pending(call.from_user.id, fkey)
+        await safe_edit_text(call.message, TEXT_FILTER_PROMPTS[fkey], None)
+    return handler
 
-            if fkey == "salary":
-                await set_pending(uid, "salary")
-                await safe_edit_text(call.message, "Введите минимальную зарплату (число):", None)
-                return {"ok": True}
 
-            if fkey == "keyword":
-                await set_pending(uid, "keyword")
-                await safe_edit_text(call.message, "Введите ключевое слово:", None)
-                return {"ok": True}
+def _multi_filter_handler(fkey: str):
+    async def handler(call: types.CallbackQuery, _: str):
+        selection = await get_user_setting(call.from_user.id, fkey) or ""
+        sel_set = {i.strip() for i in selection.split(",") if i.strip()}
+        await safe_edit_text(
+            call.message,
+            f"Выберите {fkey.replace('_', ' ')} (можно несколько):",
+            build_inline_suggestions(
+                MULTI_KEYS[fkey], f"{fkey}_suggest", sel_set, with_back=True
+            ),
+        )
+    return handler
+
+
+# ---------- мультивыбор ----------
+def _multi_toggle_handler(fkey: str):
+    async def handler(call: types.CallbackQuery, val: str):
+        sel_set = await toggle_multi_value(call.from_user.id, fkey, val)
+        await safe_edit_markup(
+            call.message,
+            build_inline_suggestions(
+                MULTI_KEYS[fkey], f"{fkey}_suggest", sel_set, with_back=True
+            ),
+        )
+        await bot(call.answer("✓"))
+    return handler
 
-            if fkey in MULTI_KEYS:
-                selection = await get_user_setting(uid, fkey) or ""
-                sel_set = {i.strip() for i in selection.split(",") if i.strip()}
-                await safe_edit_text(
-                    call.message,
-                    f"Выберите {fkey.replace('_', ' ')} (можно несколько):",
-                    build_inline_suggestions(
-                        MULTI_KEYS[fkey], f"{fkey}_suggest", sel_set, with_back=True
-                    ),
-                )
-                return {"ok": True}
 
-        # ---------- мультивыбор ----------
-        for m in MULTI_KEYS:
-            prefix = f"{m}_suggest_"
-            if data.startswith(prefix):
-                val = data[len(prefix):]
-                sel_set = await toggle_multi_value(uid, m, val)
-                await safe_edit_markup(
-                    call.message,
-                    build_inline_suggestions(
-                        MULTI_KEYS[m], f"{m}_suggest", sel_set, with_back=True
-                    ),
-                )
-                await bot(call.answer("✓"))
-                return {"ok": True}
+for _fkey in TEXT_FILTER_PROMPTS:
+    router.add_exact(f"filter_{_fkey}", _text_filter_handler(_fkey))
+for _fkey in MULTI_KEYS:
+    router.add_exact(f"filter_{_fkey}", _multi_filter_handler(_fkey))
+    router.add_prefix(f"{_fkey}_suggest_", _multi_toggle_handler(_fkey))
 
 
-        # ---------- region из suggestions ----------
-        if data.startswith("region_suggest_"):
-            area_id = int(data.split("_")[-1])
-            await save_user_setting(uid, "region", area_id)
-            await safe_edit_markup(call.message, None)
-            await bot(call.answer("Сохранено"))
-            return {"ok": True}
+# ---------- region из suggestions ----------
+@router.prefix("region_suggest_")
+async def on_region_suggest(call: types.CallbackQuery, area_id: str):
+    await save_user_setting(call.from_user.id, "region", int(area_id))
+    await safe_edit_text(call.message, "Ваши фильтры:", build_settings_keyboard())
+    await bot(call.answer("Сохранено"))
 
-        # ---------- выбор резюме ----------
-        if data.startswith("select_resume_"):
-            rid = data.split("_")[-1]
-            await save_user_setting(uid, "resume", rid)
-            await bot(call.answer("Резюме сохранено"))
-            return {"ok": True}
 
+# ---------- выбор резюме ----------
+@router.prefix("select_resume_")
+async def on_select_resume(call: types.CallbackQuery, rid: str):
+    await save_user_setting(call.from_user.id, "resume", rid)
+    await bot(call.answer("Резюме сохранено"))
+
+
+async def handle_callback(call: types.CallbackQuery) -> None:
+    uid = call.from_user.id
+
+    # ensure user row exists
+    (await sessions.get_session(uid)).remember_user()
+
+    route = router.resolve(call.data or "")
+    if route is None:
         await bot(call.answer())  # fallback
-        return {"ok": True}
+        return
+    handler, arg, _ = route
+    await handler(call, arg)
+
+
+# ────────── text ──────────
+async def _show_settings_after_input(uid: int) -> None:
+    await set_pending(uid, None)
+    msg_id = await get_settings_msg_id(uid)
+    await safe_edit_text_by_id(uid, msg_id, "Ваши фильтры:", build_settings_keyboard())
+
+
+async def on_cmd_menu(uid: int) -> None:
+    await set_pending(uid, None)
+    sent = await bot.send_message(
+        uid,
+        "📌 Главное меню:",
+        reply_markup=build_main_menu_keyboard(await subscriptions.is_subscribed(uid)),
+    )
+    await set_settings_msg_id(uid, sent.message_id)
+
+
+async def on_cmd_settings(uid: int) -> None:
+    await set_pending(uid, None)
+    sent = await bot.send_message(
+        uid, "Ваши фильтры:", reply_markup=build_settings_keyboard()
+    )
+    await set_settings_msg_id(uid, sent.message_id)
+
+
+async def on_input_region(uid: int, text: str) -> None:
+    suggestions = await hh_api.get_area_suggestions(text)
+    if suggestions:
+        await set_pending(uid, None)
+        msg_id = await get_settings_msg_id(uid)
+        await safe_edit_text_by_id(
+            uid, msg_id, "Выберите регион:", build_region_suggestions(suggestions)
+        )
+        return
+    await save_user_setting(uid, "region", text)
+    await _show_settings_after_input(uid)
+
+
+async def on_input_salary(uid: int, text: str) -> None:
+    if not text.isdigit():
+        return
+    await save_user_setting(uid, "salary", text)
+    await _show_settings_after_input(uid)
 
-    # ===== TEXT =====
+
+async def on_input_keyword(uid: int, text: str) -> None:
+    await save_user_setting(uid, "keyword", text)
+    await _show_settings_after_input(uid)
+
+
+COMMANDS = {
+    "/start": on_cmd_menu,
+    "/menu": on_cmd_menu,
+    "/settings": on_cmd_settings,
+}
+
+PENDING_INPUTS = {
+    "region": on_input_region,
+    "salary": on_input_salary,
+    "keyword": on_input_keyword,
+}
+
+
+async def handle_text(msg: types.Message) -> None:
+    uid = msg.from_user.id
+    text = msg.text.strip()
+    pending = await get_pending(uid)
+
+    (await sessions.get_session(uid)).remember_user()
+
+    try:
+        command = COMMANDS.get(text)
+        if command is not None:
+            await command(uid)
+            return
+        handler = PENDING_INPUTS.get(pending)
+        if handler is not None and not text.startswith("/"):
+            await handler(uid, text)
+    finally:
+        if pending:
+            await safe_delete(msg)
+
+
+def update_kind(update: types.Update) -> str:
+    """Метка апдейта для метрик: маршрут кнопки, команда или просто текст."""
+    if update.callback_query:
+        route = router.resolve(update.callback_query.data or "")
+        return f"callback:{route[2] if route else 'unknown'}"
     if update.message and update.message.text:
-        msg = update.message
-        uid = msg.from_user.id
-        text = msg.text.strip()
-        pending = await get_pending(uid)
+        text = update.message.text.strip()
+        return f"command:{text}" if text in COMMANDS else "text"
+    return "other"
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("INSERT OR IGNORE INTO users(chat_id) VALUES (?)", (uid,))
-            await db.commit()
 
+async def process_update(update: types.Update) -> None:
+    """Обрабатывает один апдейт Telegram целиком."""
+    kind = update_kind(update)
+    started = time.perf_counter()
+    with metrics.count_queries() as queries, tracing.span("update", kind=kind):
         try:
-            # ---------- commands ----------
-            if text.startswith("/"):
-                if text in ("/start", "/menu"):
-                    await set_pending(uid, None)
-                    msg = await bot.send_message(
-                        uid,
-                        "📌 Главное меню:",
-                        reply_markup=build_main_menu_keyboard(),
-                    )
-                    await set_settings_msg_id(uid, msg.message_id)
-                    return {"ok": True}
-
-                if text == "/settings":
-                    await set_pending(uid, None)
-                    msg = await bot.send_message(
-                        uid, "Ваши фильтры:", reply_markup=build_settings_keyboard()
-                    )
-                    await set_settings_msg_id(uid, msg.message_id)
-                    return {"ok": True}
-
-            if pending == "region":
-                await save_user_setting(uid, "region", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
-                return {"ok": True}
+            if update.callback_query:
+                await handle_callback(update.callback_query)
+            elif update.message and update.message.text:
+                await handle_text(update.message)
+        except Exception:
+            UPDATE_ERRORS.inc(kind=kind)
+            raise
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, kind=kind)
+            UPDATE_QUERIES.observe(queries[0], kind=kind)
+
+
+# Апдейты одного пользователя выполняются по порядку (машина состояний pending),
+# разных пользователей — параллельно. При WEBHOOK_ASYNC=1 вебхук отвечает
+# сразу, иначе ждёт обработки своего апдейта.
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+dispatcher = UserOrderedDispatcher(
+    process_update,
+    workers=int(os.getenv("WEBHOOK_WORKERS", "8")),
+    max_pending=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")),
+)
+seen_updates = make_seen_updates()
+metrics.callback("tg_updates_pending", "Апдейтов в очереди диспетчера", lambda: dispatcher.pending)
+# запись апдейтов для нагрузочного теста (TG_CAPTURE_PATH, см. loadtest_webhook.py)
+recorder = make_recorder()
 
-            if pending == "salary" and text.isdigit():
-                await save_user_setting(uid, "salary", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
-                return {"ok": True}
 
-            if pending == "keyword":
-                await save_user_setting(uid, "keyword", text)
-                await set_pending(uid, None)
-                msg_id = await get_settings_msg_id(uid)
-                await safe_edit_text_by_id(
-                    uid, msg_id, "Ваши фильтры:", build_settings_keyboard()
-                )
+# ────────── main webhook ──────────
+@app.post("/bot{token:path}")
+async def telegram_webhook(request: Request, token: str):
+    if token != BOT_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+    # трасса охватывает и обработку в воркере диспетчера (см. tracing.hold)
+    with tracing.trace("webhook"):
+        payload = await request.json()
+        if recorder is not None:
+            recorder.record(payload)
+        # Повтор доставки (Telegram не дождался ответа) отбрасываем ещё до
+        # разбора апдейта, чтобы не повторять побочные эффекты обработчиков
+        update_id = payload.get("update_id")
+        tracing.annotate(update_id=update_id)
+        try:
+            if update_id is not None and not await seen_updates.first_seen(update_id):
+                DUPLICATE_UPDATES.inc()
+                tracing.annotate(duplicate=True)
                 return {"ok": True}
-        finally:
-            if pending:
-                await safe_delete(msg)
\ No newline at end of file
+
+            # контекст bot нужен методам-шорткатам (message.delete, call.answer)
+            update = types.Update.model_validate(payload, context={"bot": bot})
+            await dispatcher.submit(update, wait=not WEBHOOK_ASYNC)
+        except Exception:
+            # апдейт не обработан (или не зафиксирован) — повтор от Telegram
+            # должен дойти до обработчика
+            if update_id is not None:
+                await seen_updates.forget(update_id)
+            raise
+        return {"ok": True}
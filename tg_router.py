@@ -0,0 +1,60 @@
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import types
+
+# обработчик callback-кнопки: (call, хвост callback_data после префикса)
+CallbackHandler = Callable[[types.CallbackQuery, str], Awaitable[Any]]
+
+
+class CallbackRouter:
+    """
+    Таблица обработчиков callback_data: точные ключи ищутся в dict,
+    префиксы — в trie по символам (побеждает самый длинный префикс).
+    """
+
+    def __init__(self):
+        self._exact: dict[str, CallbackHandler] = {}
+        self._trie: dict = {}
+
+    def add_exact(self, key: str, handler: CallbackHandler) -> None:
+        self._exact[key] = handler
+
+    def add_prefix(self, prefix: str, handler: CallbackHandler) -> None:
+        node = self._trie
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        # обработчик и сам префикс храним под ключом None
+        node[None] = (handler, prefix)
+
+    def exact(self, *keys: str):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            for key in keys:
+                self.add_exact(key, handler)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str):
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            for p in prefixes:
+                self.add_prefix(p, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[tuple[CallbackHandler, str, str]]:
+        """
+        Возвращает (обработчик, аргумент, маршрут) или None.
+        Маршрут — точный ключ или сработавший префикс (для логов и метрик).
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, "", data
+        node = self._trie
+        best = None
+        for i, ch in enumerate(data):
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                handler, prefix = node[None]
+                best = (handler, data[i + 1:], prefix)
+        return best
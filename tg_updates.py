@@ -0,0 +1,33 @@
+"""
+JSON апдейтов Telegram для тестов, бенчмарков и нагрузочного теста.
+"""
+from typing import Any, Dict
+
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    """JSON апдейта с нажатием inline-кнопки."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": message_id, "date": 0, "text": "bench",
+                "chat": {"id": user_id, "type": "private"},
+            },
+        },
+    }
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """JSON апдейта с текстовым сообщением."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        },
+    }
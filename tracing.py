@@ -0,0 +1,360 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import functools
+import itertools
+import threading
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Доля апдейтов, для которых собираются спаны; 0 — трассировка выключена
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0"))
+# Апдейт дольше порога попадает в лог вместе с деревом спанов
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+# Файл для выгрузки трасс (NDJSON); пусто — только лог
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# slow — выгружать только медленные трассы, all — все собранные
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "slow")
+# Предел спанов в одной трассе (циклы по сотням вакансий и т. п.)
+MAX_SPANS = 1000
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+_trace_ids = itertools.count(1)
+# строки трасс пишет отдельный поток: запись в файл не блокирует цикл событий
+_lines: "queue.SimpleQueue[Optional[str]] | None" = None
+_writer: Optional[threading.Thread] = None
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "error", "children", "trace")
+
+    def __init__(self, name: str, trace: "Trace", attrs: dict, start: Optional[float] = None):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: list[Span] = []
+        self.trace = trace
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_dict(self, origin: float) -> dict:
+        data: dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.end - self.start) * 1000, 3) if self.end is not None else None,
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [c.to_dict(origin) for c in self.children]
+        return data
+
+
+class Trace:
+    """
+    Дерево спанов одного апдейта. Завершается, когда его отпустили все
+    держатели: обработчик вебхука и, при асинхронной обработке, воркер
+    диспетчера (см. hold/resume).
+    """
+
+    __slots__ = ("id", "wall", "root", "pending", "spans")
+
+    def __init__(self, name: str, attrs: dict):
+        self.id = next(_trace_ids)
+        self.wall = time.time()
+        self.root = Span(name, self, attrs)
+        self.pending = 1
+        self.spans = 1
+
+    def release(self) -> None:
+        self.pending -= 1
+        if self.pending == 0:
+            _finish(self)
+
+
+# ────────── контекстные менеджеры ──────────
+
+class _Noop:
+    """Общий пустой контекст: цена выключенной трассировки — одно чтение ContextVar."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _SpanScope:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        _current.reset(self.token)
+        return False
+
+
+class _TraceScope(_SpanScope):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.span.trace.release()
+        return False
+
+
+class _ResumeScope:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        self.span.trace.release()
+        return False
+
+
+class _DetachedScope:
+    __slots__ = ("token",)
+
+    def __enter__(self):
+        self.token = _current.set(None)
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        return False
+
+
+def _child(parent: Span, name: str, attrs: dict, start: Optional[float] = None) -> Optional[Span]:
+    trace = parent.trace
+    if trace.spans >= MAX_SPANS:
+        return None
+    trace.spans += 1
+    span = Span(name, trace, attrs, start)
+    parent.children.append(span)
+    return span
+
+
+def trace(name: str, **attrs: Any):
+    """
+    Начинает трассу (с вероятностью TRACE_SAMPLE). Внутри уже идущей
+    трассы — просто вложенный спан.
+    """
+    if _current.get() is not None:
+        return span(name, **attrs)
+    if TRACE_SAMPLE <= 0 or (TRACE_SAMPLE < 1 and random.random() >= TRACE_SAMPLE):
+        return _NOOP
+    return _TraceScope(Trace(name, attrs).root)
+
+
+def span(name: str, **attrs: Any):
+    """Вложенный спан: with tracing.span("hh.request", endpoint=...)."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    child = _child(parent, name, attrs)
+    return _SpanScope(child) if child is not None else _NOOP
+
+
+def add_span(name: str, started: float, **attrs: Any) -> None:
+    """Готовый спан от started (time.perf_counter()) до текущего момента."""
+    parent = _current.get()
+    if parent is None:
+        return
+    child = _child(parent, name, attrs, started)
+    if child is not None:
+        child.end = time.perf_counter()
+
+
+def annotate(**attrs: Any) -> None:
+    """Дописывает атрибуты текущему спану (id апдейта известен не сразу)."""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def hold() -> Optional[Span]:
+    """
+    Текущий спан для продолжения в другой задаче; трасса не завершится,
+    пока его не отпустит resume().
+    """
+    current = _current.get()
+    if current is not None:
+        current.trace.pending += 1
+    return current
+
+
+def resume(span: Optional[Span]):
+    """Продолжает трассу, взятую hold(), и отпускает её по выходе."""
+    return _ResumeScope(span) if span is not None else _NOOP
+
+
+def detached():
+    """
+    Контекст без трассы: долгоживущие задачи, запущенные из апдейта
+    (фоновый сброс сессий и т. п.), не должны наследовать его спан.
+    """
+    return _DetachedScope() if _current.get() is not None else _NOOP
+
+
+def traced(name: Optional[str] = None):
+    """
+    Декоратор async-функции: вызов оборачивается в спан. При TRACE_SAMPLE=0
+    функция возвращается как есть, без лишнего кадра на каждый вызов.
+    """
+
+    def decorate(fn):
+        if TRACE_SAMPLE <= 0:
+            # трассировка выключена настройкой — функция без обёртки
+            return fn
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            parent = _current.get()
+            if parent is None:
+                return await fn(*args, **kwargs)
+            child = _child(parent, label, {})
+            if child is None:
+                return await fn(*args, **kwargs)
+            with _SpanScope(child):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# ────────── Telegram ──────────
+
+class TelegramTracing(BaseRequestMiddleware):
+    """Middleware сессии aiogram: каждый вызов Bot API — спан telegram.<метод>."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def instrument_bot(bot) -> None:
+    if not any(isinstance(m, TelegramTracing) for m in bot.session.middleware):
+        bot.session.middleware(TelegramTracing())
+
+
+# ────────── вывод ──────────
+
+def render(trace_obj: Trace) -> str:
+    """Дерево спанов для лога: длительность, смещение от начала, атрибуты."""
+    origin = trace_obj.root.start
+    lines = []
+
+    def _line(span: Span, depth: int) -> None:
+        duration = f"{(span.end - span.start) * 1000:.1f} мс" if span.end is not None else "не завершён"
+        attrs = " ".join(f"{k}={v}" for k, v in span.attrs.items())
+        error = f" ошибка={span.error}" if span.error else ""
+        lines.append(
+            f"{'  ' * depth}{span.name} {duration} (+{(span.start - origin) * 1000:.1f}){error}"
+            + (f" {attrs}" if attrs else "")
+        )
+        for child in span.children:
+            _line(child, depth + 1)
+
+    _line(trace_obj.root, 0)
+    return "\n".join(lines)
+
+
+def _duration_ms(trace_obj: Trace) -> float:
+    ends = [s.end for s in trace_obj.root.walk() if s.end is not None]
+    return (max(ends) - trace_obj.root.start) * 1000 if ends else 0.0
+
+
+def _write_loop(lines: "queue.SimpleQueue[Optional[str]]", path: str) -> None:
+    """Поток записи: дописывает строки в файл, сбрасывая его, когда очередь опустела."""
+    try:
+        file = open(path, "a", encoding="utf-8")
+    except OSError as e:
+        logger.warning("Не удалось открыть файл трасс: %s", e)
+        file = None
+    try:
+        while (line := lines.get()) is not None:
+            if file is None:
+                continue
+            try:
+                file.write(line)
+                if lines.empty():
+                    file.flush()
+            except OSError as e:
+                logger.warning("Не удалось записать трассу: %s", e)
+    finally:
+        if file is not None:
+            file.close()
+
+
+def _export(trace_obj: Trace, duration: float) -> None:
+    global _lines, _writer
+    if _lines is None:
+        _lines = queue.SimpleQueue()
+        _writer = threading.Thread(
+            target=_write_loop, args=(_lines, TRACE_FILE), name="trace-writer", daemon=True
+        )
+        _writer.start()
+    _lines.put(json.dumps({
+        "trace_id": trace_obj.id,
+        "ts": round(trace_obj.wall, 3),
+        "duration_ms": round(duration, 3),
+        "root": trace_obj.root.to_dict(trace_obj.root.start),
+    }, ensure_ascii=False, default=str) + "\n")
+
+
+def _finish(trace_obj: Trace) -> None:
+    duration = _duration_ms(trace_obj)
+    slow = duration >= TRACE_SLOW_MS
+    if slow:
+        logger.warning("Медленный апдейт: %.0f мс\n%s", duration, render(trace_obj))
+    if TRACE_FILE and (slow or TRACE_EXPORT == "all"):
+        _export(trace_obj, duration)
+
+
+def close() -> None:
+    """Дописывает очередь трасс и закрывает файл (остановка приложения)."""
+    global _lines, _writer
+    if _lines is not None:
+        _lines.put(None)
+        _writer.join()
+        _lines = _writer = None
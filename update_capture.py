@@ -0,0 +1,126 @@
+import os
+import json
+import hmac
+import time
+import random
+import hashlib
+import logging
+from typing import Any, Optional
+
+# Куда писать входящие апдейты (NDJSON) для loadtest_webhook.py; пусто — не пишем
+TG_CAPTURE_PATH = os.getenv("TG_CAPTURE_PATH", "")
+# Доля записываемых апдейтов
+TG_CAPTURE_SAMPLE = float(os.getenv("TG_CAPTURE_SAMPLE", "1.0"))
+# Соль для псевдонимов id; пустая — случайная на процесс (id не сопоставить между запусками)
+TG_CAPTURE_SALT = os.getenv("TG_CAPTURE_SALT", "")
+# Сбрасывать файл на диск каждые столько строк
+FLUSH_EVERY = 100
+
+# Поля с персональными данными: удаляются на любом уровне вложенности
+_DROP_FIELDS = {
+    "last_name", "username", "phone_number", "bio",
+    "contact", "location", "venue", "photo", "document", "voice",
+    "video", "video_note", "audio", "sticker", "caption", "entities",
+}
+# Обязательные в Bot API поля: значение заменяется заглушкой
+_MASK_FIELDS = {"first_name": "user", "title": "chat"}
+# Объекты, чьё поле id — идентификатор пользователя или чата
+_ID_OBJECTS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat"}
+
+logger = logging.getLogger(__name__)
+
+
+def pseudonym(value: int, salt: bytes) -> int:
+    """Стабильная замена id: один и тот же id в рамках соли даёт одно число."""
+    digest = hmac.new(salt, str(value).encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:6], "big")
+
+
+def _shape(text: str) -> str:
+    """Заглушка той же формы: буквы -> x/X, цифры -> 0, остальное как есть."""
+    return "".join(
+        "0" if ch.isdigit() else ("X" if ch.isupper() else "x") if ch.isalpha() else ch
+        for ch in text
+    )
+
+
+def mask_text(text: str) -> str:
+    """Команда (/start, /menu) сохраняется, её аргументы и прочий текст — заглушка."""
+    if text.startswith("/"):
+        command, sep, args = text.partition(" ")
+        return command + sep + _shape(args)
+    return _shape(text)
+
+
+def anonymize(payload: Any, salt: bytes, _parent: Optional[str] = None) -> Any:
+    """
+    Копия апдейта без имён, контактов и вложений; id пользователей и
+    чатов заменены псевдонимами (в личке chat.id == from.id сохраняется).
+
+    Текст сообщений (ввод ключевых слов, зарплаты, региона, промпта, а также
+    сводки фильтров в сообщениях бота) заменяется заглушкой той же длины и
+    формы: зарплата остаётся числом, и повтор идёт по тем же обработчикам
+    ожидаемого ввода. Команды сохраняются как есть. Остаются также
+    callback_data — значения кнопок бота (подписи фильтров, id региона из
+    подсказок, id резюме), даты и служебные id сообщений.
+    """
+    if isinstance(payload, list):
+        return [anonymize(item, salt, _parent) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+    result = {}
+    for key, value in payload.items():
+        if key in _DROP_FIELDS:
+            continue
+        if key in _MASK_FIELDS and _parent in _ID_OBJECTS:
+            result[key] = _MASK_FIELDS[key]
+        elif key == "id" and _parent in _ID_OBJECTS and isinstance(value, int):
+            result[key] = pseudonym(value, salt)
+        elif key == "text" and isinstance(value, str):
+            result[key] = mask_text(value)
+        else:
+            result[key] = anonymize(value, salt, key)
+    return result
+
+
+class UpdateRecorder:
+    """
+    Дописывает обезличенные апдейты в NDJSON: {"ts": время, "update": {...}}.
+    Файл открывается в режиме дозаписи; строки буферизуются и сбрасываются
+    каждые FLUSH_EVERY апдейтов и при close().
+    """
+
+    def __init__(self, path: str, sample: float = TG_CAPTURE_SAMPLE, salt: str = TG_CAPTURE_SALT):
+        self.path = path
+        self.sample = sample
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self.recorded = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, payload: dict) -> None:
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return
+        try:
+            line = json.dumps(
+                {"ts": round(time.time(), 3), "update": anonymize(payload, self.salt)},
+                ensure_ascii=False,
+            )
+            self._file.write(line + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Не удалось записать апдейт: %s", e)
+            return
+        self.recorded += 1
+        if self.recorded % FLUSH_EVERY == 0:
+            self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+def make_recorder() -> Optional[UpdateRecorder]:
+    """Запись включается переменной TG_CAPTURE_PATH."""
+    if not TG_CAPTURE_PATH:
+        return None
+    logger.info("Апдейты записываются в %s (доля %.2f)", TG_CAPTURE_PATH, TG_CAPTURE_SAMPLE)
+    return UpdateRecorder(TG_CAPTURE_PATH)
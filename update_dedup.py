@@ -0,0 +1,98 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+
+import storage
+
+# Окно, в течение которого повтор update_id считается дублем
+UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "600"))
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "100000"))
+# memory — в пределах процесса; sqlite — общий набор для нескольких воркеров
+UPDATE_DEDUP_BACKEND = os.getenv("UPDATE_DEDUP_BACKEND", "memory")
+# как часто (в новых id) чистить таблицу seen_updates
+PRUNE_EVERY = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class SeenUpdates:
+    """
+    Ограниченное по размеру и времени множество update_id.
+    Порядок вставки совпадает с порядком времени, поэтому устаревшие
+    записи снимаются с головы OrderedDict за O(1) на запись.
+    """
+
+    def __init__(self, window: float = UPDATE_DEDUP_WINDOW, size: int = UPDATE_DEDUP_SIZE):
+        self.window = window
+        self.size = size
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def _remember(self, update_id: int) -> bool:
+        now = time.monotonic()
+        seen = self._seen
+        while seen:
+            seen_at = next(iter(seen.values()))
+            if now - seen_at <= self.window and len(seen) < self.size:
+                break
+            seen.popitem(last=False)
+        if update_id in seen:
+            return False
+        seen[update_id] = now
+        return True
+
+    async def first_seen(self, update_id: int) -> bool:
+        """True, если апдейт пришёл впервые (и теперь запомнен)."""
+        return self._remember(update_id)
+
+    async def forget(self, update_id: int) -> None:
+        """Разрешает повторную обработку (например, после ошибки)."""
+        self._seen.pop(update_id, None)
+
+
+class SqliteSeenUpdates(SeenUpdates):
+    """
+    Вариант для нескольких uvicorn-воркеров: локальный набор отсекает
+    повторы без обращения к БД, а первый показ фиксируется в таблице
+    seen_updates (INSERT OR IGNORE), чтобы повтор, попавший в другой
+    процесс, тоже был отброшен.
+    """
+
+    def __init__(self, window: float = UPDATE_DEDUP_WINDOW, size: int = UPDATE_DEDUP_SIZE):
+        super().__init__(window, size)
+        self._inserted = 0
+
+    async def first_seen(self, update_id: int) -> bool:
+        if not self._remember(update_id):
+            return False
+        now = int(time.time())
+        try:
+            inserted = await storage.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)",
+                (update_id, now),
+            )
+        except BaseException:
+            # апдейт не зафиксирован — повтор от Telegram должен пройти
+            self._seen.pop(update_id, None)
+            raise
+        self._inserted += 1
+        if self._inserted % PRUNE_EVERY == 0:
+            try:
+                await storage.execute(
+                    "DELETE FROM seen_updates WHERE seen_at < ?",
+                    (now - int(self.window),),
+                )
+            except Exception as e:
+                # апдейт уже зафиксирован; чистка подождёт следующего раза
+                logger.warning("Не удалось почистить seen_updates: %s", e)
+        return inserted > 0
+
+    async def forget(self, update_id: int) -> None:
+        await super().forget(update_id)
+        await storage.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+
+def make_seen_updates() -> SeenUpdates:
+    if UPDATE_DEDUP_BACKEND == "sqlite":
+        return SqliteSeenUpdates()
+    return SeenUpdates()